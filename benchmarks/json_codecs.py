@@ -0,0 +1,61 @@
+"""
+Compares the JSON codecs available to RuggedMiddleware
+
+Each codec decodes a representative form body, unflattens it and encodes the
+result, as the middleware does for every JSON request. Codecs that aren't
+installed are skipped. Run with:
+
+    python benchmarks/json_codecs.py
+
+"""
+
+import json
+import timeit
+from functools import partial
+from typing import Any
+
+from payloads import shopping_list, signup
+
+from rugged.caching import LRUCache
+from rugged.codecs import CODECS, Codec
+from rugged.unflatteners import unflatten
+
+BODIES = {
+    "signup": signup(),
+    "list x10": shopping_list(10),
+    "list x1000": shopping_list(1000),
+}
+
+
+def round_trip(codec: Codec, body: bytes, plan_cache: LRUCache[Any, Any]) -> bytes:
+    return codec.encode(unflatten(codec.decode(body), plan_cache=plan_cache))
+
+
+def main() -> None:
+    codecs: list[Codec] = []
+    for name, codec_class in CODECS.items():
+        try:
+            codecs.append(codec_class())
+        except ImportError:
+            print(f"{name} is not installed, skipping")
+
+    print(f"{'body':<12}{'bytes':>8}" + "".join(f"{c.name:>12}" for c in codecs))
+
+    for label, data in BODIES.items():
+        body = json.dumps(data).encode()
+        plan_cache: LRUCache[Any, Any] = LRUCache()
+
+        timings = []
+        for codec in codecs:
+            timer = timeit.Timer(partial(round_trip, codec, body, plan_cache))
+            number, _ = timer.autorange()
+            timings.append(min(timer.repeat(repeat=3, number=number)) / number)
+
+        print(
+            f"{label:<12}{len(body):>8}"
+            + "".join(f"{t * 1e6:>10.1f}us" for t in timings)
+        )
+
+
+if __name__ == "__main__":
+    main()
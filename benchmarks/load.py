@@ -0,0 +1,208 @@
+"""
+Measures the latency RuggedMiddleware adds to requests under concurrent load
+
+Starlette and FastAPI apps are driven in-process through httpx's ASGI transport, with and without
+the middleware, so no network or server is needed. The apps are those the middleware's tests
+set up, with an endpoint that echoes the body it receives, so both do the same work and the
+difference between them is the middleware's. Each scenario varies the app, the content type,
+the size of the body, whether it's sent in one message or streamed in chunks, and the number of
+concurrent clients, and reports the throughput and p50/p95/p99 latencies. Run with:
+
+    python benchmarks/load.py
+
+Use --help to pick the scenarios to run.
+
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlencode
+
+import anyio
+import httpx
+from payloads import shopping_list
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp
+
+from rugged.middleware import RuggedMiddleware
+
+# The apps are imported from the tests, in the root of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from tests.test_middleware_fastapi import make_app as fastapi_app
+from tests.test_middleware_starlette import make_app as starlette_app
+
+CHUNK_SIZE = 16 * 1024
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "form": "application/x-www-form-urlencoded",
+}
+
+
+async def echo(request: Request) -> Response:
+    """
+    Sends back the body the app receives, which is the same work whether or not the middleware
+    has unflattened it first
+
+    """
+
+    body = await request.body()
+    return Response(body, media_type=request.headers.get("content-type"))
+
+
+def make_app(name: str, middleware: list[Middleware]) -> ASGIApp:
+    if name == "fastapi":
+        return fastapi_app(echo, middleware)
+    return starlette_app(echo, middleware)
+
+
+APPS = ["starlette", "fastapi"]
+
+
+def make_body(content_type: str, rows: int) -> bytes:
+    data = shopping_list(rows)
+
+    if content_type == "json":
+        return json.dumps(data).encode()
+
+    # Forms repeat the field name for each value
+    fields = [
+        (key, value)
+        for key, values in data.items()
+        for value in (values if isinstance(values, list) else [values])
+    ]
+    return urlencode(fields).encode()
+
+
+async def chunked(body: bytes) -> AsyncIterator[bytes]:
+    for i in range(0, len(body), CHUNK_SIZE):
+        yield body[i : i + CHUNK_SIZE]
+
+
+@dataclass
+class Scenario:
+    app: str
+    content_type: str
+    rows: int
+    streamed: bool
+    concurrency: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.app:<10}{self.content_type:<6}{self.rows:>6}"
+            f"{'chunked' if self.streamed else 'single':>9}{self.concurrency:>6}"
+        )
+
+
+@dataclass
+class Result:
+    requests_per_second: float
+    p50: float
+    p95: float
+    p99: float
+
+
+async def run(app: ASGIApp, scenario: Scenario, requests: int) -> Result:
+    body = make_body(scenario.content_type, scenario.rows)
+    headers = {"content-type": CONTENT_TYPES[scenario.content_type]}
+
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+    latencies: list[float] = []
+    remaining = requests
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+
+                content: Any = chunked(body) if scenario.streamed else body
+                start = time.perf_counter()
+                response = await client.post(
+                    "/invite", content=content, headers=headers
+                )
+                latencies.append(time.perf_counter() - start)
+
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for _ in range(scenario.concurrency):
+                tg.start_soon(worker)
+        elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return Result(
+        requests_per_second=len(latencies) / elapsed,
+        p50=percentiles[49] * 1e3,
+        p95=percentiles[94] * 1e3,
+        p99=percentiles[98] * 1e3,
+    )
+
+
+def format_result(result: Result) -> str:
+    return (
+        f"{result.requests_per_second:>8.0f}"
+        f"{result.p50:>8.2f}{result.p95:>8.2f}{result.p99:>8.2f}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument(
+        "--content-types", nargs="+", choices=CONTENT_TYPES, default=list(CONTENT_TYPES)
+    )
+    parser.add_argument("--rows", nargs="+", type=int, default=[10, 1000])
+    parser.add_argument(
+        "--bodies",
+        nargs="+",
+        choices=["single", "chunked"],
+        default=["single", "chunked"],
+    )
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(
+        f"{'':<40}{'without middleware':^32}{'with middleware':^32}\n"
+        f"{'app':<10}{'type':<6}{'rows':>6}{'body':>9}{'conc':>6}"
+        + f"{'req/s':>8}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}"
+        * 2
+    )
+
+    for app_name, content_type, rows, body, concurrency in itertools.product(
+        args.apps, args.content_types, args.rows, args.bodies, args.concurrency
+    ):
+        scenario = Scenario(
+            app_name, content_type, rows, body == "chunked", concurrency
+        )
+
+        bare = make_app(app_name, [])
+        wrapped = make_app(app_name, [Middleware(RuggedMiddleware, forms=True)])
+
+        # Warm up the apps and the middleware's caches
+        warm_up = max(scenario.concurrency, 10)
+        await run(bare, scenario, warm_up)
+        await run(wrapped, scenario, warm_up)
+
+        without = await run(bare, scenario, args.requests)
+        with_ = await run(wrapped, scenario, args.requests)
+
+        print(f"{scenario}{format_result(without)}{format_result(with_)}")
+
+
+if __name__ == "__main__":
+    anyio.run(main)
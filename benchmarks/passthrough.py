@@ -0,0 +1,68 @@
+"""
+Measures the per-request overhead of RuggedMiddleware for passthrough traffic
+
+Requests that aren't unflattened (GETs, non-JSON bodies) should cost no more
+than a few attribute lookups. Run with:
+
+    python benchmarks/passthrough.py
+
+"""
+
+import time
+
+import anyio
+from starlette.types import Message, Receive, Scope, Send
+
+from rugged.middleware import RuggedMiddleware
+
+REQUESTS = 200_000
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    pass
+
+
+async def receive() -> Message:
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message: Message) -> None:
+    pass
+
+
+def make_scope(method: str, content_type: bytes) -> Scope:
+    return {
+        "type": "http",
+        "method": method,
+        "path": "/",
+        "headers": [
+            (b"host", b"example.com"),
+            (b"accept", b"*/*"),
+            (b"content-type", content_type),
+        ],
+    }
+
+
+async def timed(target: object, scope: Scope) -> float:
+    assert callable(target)
+
+    start = time.perf_counter_ns()
+    for _ in range(REQUESTS):
+        await target(scope, receive, send)
+    return (time.perf_counter_ns() - start) / REQUESTS
+
+
+async def main() -> None:
+    middleware = RuggedMiddleware(app)
+
+    for label, scope in [
+        ("GET", make_scope("GET", b"application/json")),
+        ("POST form", make_scope("POST", b"application/x-www-form-urlencoded")),
+    ]:
+        bare = await timed(app, scope)
+        wrapped = await timed(middleware, scope)
+        print(f"{label:<10} {wrapped - bare:>8.0f} ns/request overhead")
+
+
+if __name__ == "__main__":
+    anyio.run(main)
@@ -0,0 +1,100 @@
+"""
+Synthetic flattened payloads for the benchmarks
+
+Each function returns a flat dictionary of about n fields, counting each item of a list value as a
+field, in one of the shapes that unflatten() handles.
+
+"""
+
+from collections.abc import Callable
+from typing import Any
+
+
+def flat(n: int) -> dict[str, Any]:
+    """
+    Keys without any brackets, e.g. title
+
+    """
+
+    return {f"field{i}": f"value {i}" for i in range(n)}
+
+
+def deep(n: int) -> dict[str, Any]:
+    """
+    Nested maps four levels deep, e.g. section0[group1][entry2][field3]
+
+    """
+
+    return {
+        f"section{i // 1000}[group{i // 100 % 10}][entry{i // 10 % 10}][field{i % 10}]": i
+        for i in range(n)
+    }
+
+
+def grid(n: int, columns: int = 5) -> dict[str, Any]:
+    """
+    Lists of objects given as columns, e.g. items[][qty]
+
+    """
+
+    rows = max(n // columns, 1)
+    return {
+        f"items[][field{c}]": [f"row {r} field {c}" for r in range(rows)]
+        for c in range(columns)
+    }
+
+
+def indexed(n: int, columns: int = 5) -> dict[str, Any]:
+    """
+    Lists of objects given by numeric index, e.g. items[0][qty]
+
+    """
+
+    return {f"items[{i // columns}][field{i % columns}]": i for i in range(n)}
+
+
+def mixed(n: int) -> dict[str, Any]:
+    """
+    A form with plain fields, nested maps, a value list and a grid
+
+    """
+
+    part = max(n // 4, 1)
+    return {
+        **flat(part),
+        **{f"address[line{i}]": f"line {i}" for i in range(part)},
+        "emails[]": [f"user{i}@example.com" for i in range(part)],
+        **grid(n - 3 * part),
+    }
+
+
+def shopping_list(rows: int) -> dict[str, Any]:
+    return {
+        "title": "Sofrito time",
+        "notes": "Get the good olive oil",
+        "items[][item]": [f"item {i}" for i in range(rows)],
+        "items[][qty]": [i % 5 + 1 for i in range(rows)],
+        "items[][price]": [round(i * 0.37, 2) for i in range(rows)],
+    }
+
+
+def signup() -> dict[str, Any]:
+    return {
+        "action": "signup",
+        "email": "foo@example.com",
+        "address[road]": "1 Main St",
+        "address[city]": "London",
+        "address[zipcode]": "SW1A 1AA",
+        "social[twitter]": "rossmasters",
+        "social[github]": "rmasters",
+        "emails[]": ["foo@example.com", "bar@example.com"],
+    }
+
+
+PAYLOADS: dict[str, Callable[[int], dict[str, Any]]] = {
+    "flat": flat,
+    "deep": deep,
+    "grid": grid,
+    "indexed": indexed,
+    "mixed": mixed,
+}
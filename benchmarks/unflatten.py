@@ -0,0 +1,229 @@
+"""
+Measures unflatten() over synthetic payloads of different shapes and sizes
+
+For each payload the time per field, the total time and the peak memory allocated while
+unflattening are reported, both with warm caches (as for a form the middleware has seen before)
+and with caching disabled. Run with:
+
+    python benchmarks/unflatten.py
+
+Results can be saved as a baseline, and later runs compared against it, to check a change to
+the engine before it's merged:
+
+    python benchmarks/unflatten.py --save baseline.json
+    python benchmarks/unflatten.py --compare baseline.json
+
+Each time is the median of a number of runs (--repeats), with the interquartile range of the
+runs as its spread. Machines speed up and slow down between runs, so each run of a payload is
+timed alongside some fixed work that doesn't use rugged, and comparisons are made between the
+times relative to that work.
+
+Comparisons exit with status 1 if any result allocates more than the threshold allows (20% by
+default), or if its median relative time is slower by more than the threshold and its runs are
+slower than the baseline's beyond their spreads, i.e. the lower quartile of the new runs is
+above the upper quartile of the baseline's. Differences within the noise of either run aren't
+reported as regressions.
+
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import timeit
+import tracemalloc
+from dataclasses import asdict, dataclass
+from functools import cache
+from typing import Any
+
+from payloads import PAYLOADS
+
+from rugged.caching import LRUCache
+from rugged.keys import KeyCache
+from rugged.plans import PlanCache
+from rugged.unflatteners import unflatten
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+
+# The number of times each payload is timed, and about how long each of them takes
+REPEATS = 15
+SAMPLE_SECONDS = 0.05
+
+# The fixed work each payload is timed against
+CALIBRATION = {f"field{i}": [str(i), i, None] for i in range(100)}
+
+
+@dataclass
+class Result:
+    fields: int
+    # The median time
+    total_ns: float
+    peak_bytes: int
+    # The median time relative to the fixed work, with the lower and upper quartiles of those
+    relative: float = 0.0
+    relative_low: float = 0.0
+    relative_high: float = 0.0
+
+    @property
+    def ns_per_field(self) -> float:
+        return self.total_ns / self.fields
+
+
+def count_fields(data: dict[str, Any]) -> int:
+    return sum(len(value) if isinstance(value, list) else 1 for value in data.values())
+
+
+def calibrate() -> None:
+    json.loads(json.dumps(CALIBRATION))
+
+
+@cache
+def calibration_number() -> int:
+    number, elapsed = timeit.Timer(calibrate).autorange()
+    return max(1, round(number * SAMPLE_SECONDS / elapsed))
+
+
+def measure(data: dict[str, Any], warm: bool, repeats: int = REPEATS) -> Result:
+    def run() -> None:
+        if warm:
+            unflatten(data, key_cache=key_cache, plan_cache=plan_cache)
+        else:
+            unflatten(
+                data, key_cache=LRUCache(maxsize=0), plan_cache=LRUCache(maxsize=0)
+            )
+
+    key_cache: KeyCache = LRUCache(maxsize=len(data))
+    plan_cache: PlanCache = LRUCache()
+    run()
+
+    timer = timeit.Timer(run)
+    number, elapsed = timer.autorange()
+    number = max(1, round(number * SAMPLE_SECONDS / elapsed))
+
+    # The fixed work is timed just before each run, so both are slowed down alike
+    calibration = timeit.Timer(calibrate)
+    times = []
+    relative = []
+    for _ in range(repeats):
+        fixed = calibration.timeit(calibration_number()) / calibration_number()
+        time = timer.timeit(number) / number
+        times.append(time * 1e9)
+        relative.append(time / fixed)
+
+    low, median, high = statistics.quantiles(relative, n=4)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return Result(count_fields(data), statistics.median(times), peak, median, low, high)
+
+
+def slowdown(result: Result, base: Result) -> float:
+    """
+    Returns how much slower result is than base, relative to the fixed work if base has it
+
+    """
+
+    if base.relative:
+        return result.relative / base.relative - 1
+    return result.total_ns / base.total_ns - 1
+
+
+def compare(
+    results: dict[str, Result], baseline: dict[str, dict[str, Any]], threshold: float
+) -> list[str]:
+    """
+    Returns the names of results that regressed from the baseline by more than threshold
+
+    Times are compared relative to the fixed work, and only regress if the runs don't overlap
+    the baseline's between their quartiles, so a noisy median isn't mistaken for a regression.
+    Baselines saved without relative times are compared by their median times alone.
+
+    """
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base = Result(**baseline[name])
+        slower = slowdown(result, base)
+        # Runs that overlap the baseline's are within the noise of one or the other
+        overlaps = bool(base.relative) and result.relative_low <= base.relative_high
+        larger = result.peak_bytes / max(base.peak_bytes, 1) - 1
+
+        flags = []
+        if slower > threshold and not overlaps:
+            flags.append(f"{slower:+.0%} time")
+        if larger > threshold:
+            flags.append(f"{larger:+.0%} memory")
+
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--payloads", nargs="+", choices=PAYLOADS, default=list(PAYLOADS)
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--save", metavar="PATH", help="save results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare with a baseline")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.repeats < 2:
+        parser.error("--repeats must be at least 2, to find the spread of the times")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+
+    print(
+        f"{'payload':<28}{'fields':>8}{'ns/field':>10}{'total':>12}{'spread':>10}"
+        f"{'peak':>12}" + ("   vs baseline" if baseline else "")
+    )
+
+    results: dict[str, Result] = {}
+    for payload in args.payloads:
+        for size in args.sizes:
+            data = PAYLOADS[payload](size)
+
+            for warm in (True, False):
+                name = f"{payload}/{size}/{'warm' if warm else 'cold'}"
+                result = results[name] = measure(data, warm, args.repeats)
+
+                spread = (result.relative_high - result.relative_low) / result.relative
+                line = (
+                    f"{name:<28}{result.fields:>8}{result.ns_per_field:>10.0f}"
+                    f"{result.total_ns / 1e3:>10.1f}us{spread:>9.0%} "
+                    f"{result.peak_bytes / 1024:>10.1f}KB"
+                )
+                if name in baseline:
+                    base = Result(**baseline[name])
+                    line += f"   {slowdown(result, base):>+6.0%}"
+                print(line)
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump({name: asdict(r) for name, r in results.items()}, fh, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 __version__ = "0.2.2"
 
-from .unflatteners import unflatten
+from .flatteners import flatten
 from .middleware import RuggedMiddleware
+from .unflatteners import unflatten
 
-__all__ = ["unflatten", "RuggedMiddleware"]
+__all__ = ["RuggedMiddleware", "flatten", "unflatten"]
@@ -0,0 +1,112 @@
+from collections.abc import Iterator
+from tempfile import SpooledTemporaryFile
+
+from starlette.exceptions import HTTPException
+
+
+class BodyTooLarge(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(status_code=413, detail="Request body too large")
+
+
+class BodyBuffer:
+    """
+    Accumulates the chunks of a streamed request body
+
+    When the size of the body is known up front (from Content-Length), a buffer of that size is
+    allocated once and filled in place. Bodies larger than spool_size are written to a temporary
+    file instead, so that many large uploads in flight don't hold their bodies in memory.
+
+    A BodyTooLarge error is raised as soon as the body exceeds max_size.
+
+    """
+
+    def __init__(
+        self,
+        *,
+        content_length: int | None = None,
+        max_size: int | None = None,
+        spool_size: int = 1024 * 1024,
+    ):
+        if (
+            max_size is not None
+            and content_length is not None
+            and content_length > max_size
+        ):
+            raise BodyTooLarge()
+
+        self.max_size = max_size
+        self.size = 0
+
+        self._buffer: bytearray | None = None
+        self._spool: SpooledTemporaryFile[bytes] | None = None
+
+        if content_length is not None and content_length <= spool_size:
+            self._buffer = bytearray(content_length)
+        else:
+            # Kept open between writes, and closed by close()
+            self._spool = SpooledTemporaryFile(max_size=spool_size)  # noqa: SIM115
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+
+        start = self.size
+        self.size += len(chunk)
+
+        if self.max_size is not None and self.size > self.max_size:
+            self.close()
+            raise BodyTooLarge()
+
+        if self._buffer is not None:
+            # Writing past the end (i.e. a wrong Content-Length) grows the buffer
+            self._buffer[start : start + len(chunk)] = chunk
+        else:
+            assert self._spool is not None
+            self._spool.write(chunk)
+
+    def getvalue(self) -> bytes | bytearray:
+        """
+        Returns the body received so far
+
+        A body that was spooled to disk is read back into memory, as the codecs decode whole
+        bodies, and the spool is closed. Bodies that are too large to hold in memory at all
+        should be unflattened as they're received instead (see stream_size).
+
+        """
+
+        if self._buffer is not None:
+            # The body was shorter than Content-Length
+            if self.size < len(self._buffer):
+                del self._buffer[self.size :]
+            return self._buffer
+
+        assert self._spool is not None
+        self._spool.seek(0)
+        body = self._spool.read()
+        self.close()
+        return body
+
+    def chunks(self, size: int = 64 * 1024) -> Iterator[bytes]:
+        """
+        Yields the body received so far, then closes the buffer
+
+        A body that was spooled to disk is read back size bytes at a time, rather than all at
+        once.
+
+        """
+
+        if self._spool is None:
+            yield bytes(self.getvalue())
+            return
+
+        try:
+            self._spool.seek(0)
+            while chunk := self._spool.read(size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._spool is not None:
+            self._spool.close()
@@ -0,0 +1,122 @@
+import json
+from typing import Any, Protocol
+
+
+class Codec(Protocol):
+    """
+    Decodes request bodies, and encodes them again once unflattened
+
+    """
+
+    name: str
+
+    def decode(self, body: bytes | bytearray) -> Any: ...
+
+    def encode(self, data: Any) -> bytes: ...
+
+
+class StdlibCodec:
+    name = "json"
+
+    def decode(self, body: bytes | bytearray) -> Any:
+        return json.loads(body)
+
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+
+    def decode(self, body: bytes | bytearray) -> Any:
+        return self._loads(body)
+
+    def encode(self, data: Any) -> bytes:
+        return self._dumps(data)
+
+
+class MsgspecCodec:
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec
+
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+
+    def decode(self, body: bytes | bytearray) -> Any:
+        return self._decoder.decode(body)
+
+    def encode(self, data: Any) -> bytes:
+        return self._encoder.encode(data)
+
+
+# In order of preference
+CODECS: dict[str, type[Codec]] = {
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+    "json": StdlibCodec,
+}
+
+
+def get_codec(name: str = "json") -> Codec:
+    """
+    Returns the codec with the given name, one of "orjson", "msgspec" or "json"
+
+    "auto" picks the fastest codec that is installed, falling back to the standard library.
+    The fast codecs don't decode every body the standard library does: both reject NaN and
+    Infinity, and orjson decodes integers wider than 64 bits as floats, so they're opt-in.
+
+    """
+
+    if name != "auto":
+        try:
+            return CODECS[name]()
+        except KeyError:
+            raise ValueError(f"Unknown codec {name!r}") from None
+
+    for codec in CODECS.values():
+        try:
+            return codec()
+        except ImportError:
+            continue
+
+    return StdlibCodec()
+
+
+def decode_pairs(body: bytes | bytearray) -> tuple[Any, list[tuple[str, Any]] | None]:
+    """
+    Decodes a JSON body, returning the key/value pairs of its top-level object instead of a
+    dictionary, so keys that are repeated keep each of their values
+
+    Bodies that aren't objects are returned decoded, with None for their pairs. orjson and
+    msgspec can't report the pairs of an object, so the standard library is used.
+
+    """
+
+    # Objects are decoded innermost first, so the top level is the last object decoded. Each
+    # is only filled in once another follows it, so the top level is never built.
+    last: dict[str, Any] | None = None
+    last_pairs: list[tuple[str, Any]] = []
+
+    def object_pairs_hook(pairs: list[tuple[str, Any]]) -> dict[str, Any]:
+        nonlocal last, last_pairs
+        if last is not None:
+            last.update(last_pairs)
+        last, last_pairs = {}, pairs
+        return last
+
+    data = json.loads(body, object_pairs_hook=object_pairs_hook)
+    if last is None:
+        return data, None
+    if data is last:
+        return None, last_pairs
+
+    last.update(last_pairs)
+    return data, None
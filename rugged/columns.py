@@ -0,0 +1,103 @@
+"""
+Columnar results for lists of objects, e.g. from items[][qty] and items[][price]
+
+Bodies with many rows are usually consumed a column at a time, e.g. for a bulk insert. Rather
+than building an object for each row, only for the rows to be taken apart again, unflatten() can
+return each list of objects as a Columns: a dictionary of each field's list of values.
+
+"""
+
+from collections.abc import Iterator, Sequence
+from typing import Any, Literal, overload
+
+# Whether to return lists of objects as columns, and as NumPy arrays rather than lists
+ColumnsMode = bool | Literal["numpy"]
+
+__all__ = ["Columns", "ColumnsMode", "Rows", "to_arrays"]
+
+
+class Columns(dict[str, Any]):
+    """
+    A list of objects, as a dictionary of the list of values for each field
+
+    As a dictionary, it can be encoded as JSON like any other object, e.g.
+
+    => { "items[][item]": ["carrots", "celery"], "items[][qty]": [1, 2] }
+    <= { "items": { "item": ["carrots", "celery"], "qty": [1, 2] } }
+
+    Rows are built from the columns as they're accessed, with the rows view.
+
+    """
+
+    __slots__ = ("length",)
+
+    def __init__(self, columns: dict[str, Any], length: int):
+        super().__init__(columns)
+        # The number of rows, which every column has a value for
+        self.length = length
+
+    @property
+    def rows(self) -> "Rows":
+        return Rows(self)
+
+    def to_list(self) -> list[dict[str, Any]]:
+        """
+        Returns the list of objects the columns make, as unflatten() would without columns
+
+        """
+
+        fields = tuple(self)
+        return [dict(zip(fields, row)) for row in zip(*self.values())]
+
+
+class Rows(Sequence[dict[str, Any]]):
+    """
+    A read-only view of the rows of a Columns, each built as an object when it's accessed
+
+    """
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: Columns):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return self.columns.length
+
+    @overload
+    def __getitem__(self, index: int) -> dict[str, Any]: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[dict[str, Any]]: ...
+
+    def __getitem__(self, index: int | slice) -> dict[str, Any] | list[dict[str, Any]]:
+        if isinstance(index, slice):
+            return [self[idx] for idx in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+
+        return {field: column[index] for field, column in self.columns.items()}
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        fields = tuple(self.columns)
+        for row in zip(*self.columns.values()):
+            yield dict(zip(fields, row))
+
+
+def to_arrays(columns: Columns) -> Columns:
+    """
+    Converts each column to a NumPy array, with the type NumPy infers from its values
+
+    Requires numpy to be installed.
+
+    """
+
+    import numpy
+
+    return Columns(
+        {field: numpy.asarray(column) for field, column in columns.items()},
+        columns.length,
+    )
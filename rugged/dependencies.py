@@ -0,0 +1,94 @@
+"""
+FastAPI dependencies for reading unflattened request bodies
+
+Declaring a parameter as Unflattened[Model] validates the unflattened body against Model, using
+the object the middleware has already built. Unlike a plain body parameter, the body isn't
+re-encoded to JSON by the middleware only to be parsed again by FastAPI.
+
+"""
+
+from collections.abc import Callable, Coroutine
+from functools import cache
+from typing import TYPE_CHECKING, Annotated, Any, TypeVar
+
+from fastapi import Depends, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+from .middleware import STATE_KEY
+from .receivers import JSONReceiver
+
+T = TypeVar("T")
+
+# The model of each Unflattened[Model] dependency, so plans can be compiled for them up front
+dependency_models: dict[Callable[..., Any], Any] = {}
+
+
+@cache
+def get_type_adapter(model: Any) -> TypeAdapter[Any]:
+    """
+    Returns a TypeAdapter for model, built once per model
+
+    """
+
+    return TypeAdapter(model)
+
+
+async def get_unflattened(request: Request) -> Any:
+    """
+    Returns the unflattened body of a request
+
+    Falls back to the parsed request body when RuggedMiddleware isn't handling the request.
+
+    """
+
+    receiver = request.scope.get("state", {}).get(STATE_KEY)
+    if isinstance(receiver, JSONReceiver):
+        return await receiver.json()
+
+    return await request.json()
+
+
+@cache
+def unflattened_dependency(model: Any) -> Callable[..., Coroutine[Any, Any, Any]]:
+    """
+    Returns a dependency that validates the unflattened body against model
+
+    One dependency is created per model, so FastAPI can cache its result within a request.
+
+    """
+
+    adapter = get_type_adapter(model)
+
+    async def dependency(request: Request) -> Any:
+        data = await get_unflattened(request)
+
+        try:
+            return adapter.validate_python(data)
+        except ValidationError as exc:
+            errors = [
+                {**error, "loc": ("body", *error["loc"])} for error in exc.errors()
+            ]
+            raise RequestValidationError(errors, body=data) from None
+
+    dependency_models[dependency] = model
+    return dependency
+
+
+if TYPE_CHECKING:
+    # Type checkers see Unflattened[Model] as Model
+    Unflattened = Annotated[T, ...]
+else:
+
+    class Unflattened:
+        """
+        Declares an endpoint parameter as the unflattened request body, e.g.
+
+            @app.post("/list")
+            async def save_list(shopping_list: Unflattened[ShoppingList]):
+                ...
+
+        """
+
+        def __class_getitem__(cls, model: Any) -> Any:
+            return Annotated[model, Depends(unflattened_dependency(model))]
@@ -0,0 +1,244 @@
+"""
+Flattening nested data into bracket keys, the inverse of unflatten()
+
+This is used to pre-populate forms from the objects they were submitted as, where each input is
+named with the path to its value, e.g. address[city] or items[0][qty].
+
+"""
+
+import sys
+from collections.abc import Iterator, Mapping
+from typing import Any
+
+from .caching import LRUCache
+
+NameCache = LRUCache[tuple[str, str], str]
+
+# Shared by flatten() calls that don't bring their own cache
+default_name_cache: NameCache = LRUCache(maxsize=4096)
+
+# How lists are flattened: as one key for all their values (emails[]), numbered keys for each
+# value (users[0][id]), or one key for each column of a list of dictionaries (users[][id])
+_VALUES = 0
+_NUMBERED = 1
+_COLUMNS = 2
+_NESTED_COLUMNS = 3
+
+__all__ = [
+    "Flattener",
+    "NameCache",
+    "default_name_cache",
+    "flatten",
+    "iter_flatten",
+]
+
+
+def flatten(
+    data: Mapping[str, Any],
+    *,
+    columns: bool = False,
+    name_cache: NameCache | None = None,
+) -> dict[str, Any]:
+    """
+    Flatten a nested dictionary into bracket keys, so that unflatten() returns it
+
+    We follow the rules of unflatten() in reverse:
+
+    1. Values that aren't dictionaries or lists are returned straightforwardly:
+
+    => { "action": "signup", "email": "foo@example.com" }
+    <= { "action": "signup", "email": "foo@example.com" }
+
+    2. Dictionaries are given named square brackets:
+
+    => { "address": { "zipcode": "90210" } }
+    <= { "address[zipcode]": "90210" }
+
+    3. Lists of values are given postfix empty square brackets:
+
+    => { "emails": ["foo@example.com", "bar@example.com"] }
+    <= { "emails[]": ["foo@example.com", "bar@example.com"] }
+
+    4. Lists of dictionaries or lists are given numbered square brackets, one key per value:
+
+    => { "users": [{ "id": 1, "name": "foo" }, { "id": 2, "name": "bar" }] }
+    <= { "users[0][id]": 1, "users[0][name]": "foo", "users[1][id]": 2, "users[1][name]": "bar" }
+
+    With columns, lists of dictionaries that have the same keys, and no lists, are instead given
+    prefix empty square brackets, with a list of values for each key:
+
+    <= { "users[][id]": [1, 2], "users[][name]": ["foo", "bar"] }
+
+    Empty dictionaries are returned as values, as they have no keys to name.
+
+    Column keys are memoised in name_cache, or a shared module-level cache if none is given, as
+    they're repeated for every row and by every response with the same shape. Other keys are
+    unique to their value, and are built by appending each index to the key of its parent.
+
+    """
+
+    flattener = Flattener(columns=columns, name_cache=name_cache)
+    flat: dict[str, Any] = {}
+    for key, value in data.items():
+        flattener.add(flat, str(key), value)
+    return flat
+
+
+def iter_flatten(
+    data: Mapping[str, Any],
+    *,
+    columns: bool = False,
+    name_cache: NameCache | None = None,
+    batch_size: int = 1024,
+) -> Iterator[dict[str, Any]]:
+    """
+    Flatten a nested dictionary in batches of about batch_size keys
+
+    The batches together make up the result of flatten(), so a large result can be encoded and
+    sent in parts. Lists that are flattened into numbered keys are split between batches item
+    by item.
+
+    """
+
+    flattener = Flattener(columns=columns, name_cache=name_cache)
+    batch: dict[str, Any] = {}
+
+    for key, value in data.items():
+        key = str(key)
+        if isinstance(value, (list, tuple)) and flattener.layout(value) == _NUMBERED:
+            for idx, item in enumerate(value):
+                flattener.add(batch, f"{key}[{idx}]", item)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = {}
+        else:
+            flattener.add(batch, key, value)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+
+    if batch:
+        yield batch
+
+
+class Flattener:
+    """
+    Adds the flat keys for nested values to a dictionary
+
+    """
+
+    def __init__(self, *, columns: bool = False, name_cache: NameCache | None = None):
+        self.columns = columns
+        self.name_cache = default_name_cache if name_cache is None else name_cache
+
+        # Column names used during this flattening, to skip the shared cache's lock
+        self._names: dict[tuple[str, str], str] = {}
+
+    def column_name(self, prefix: str, suffix: str) -> str:
+        """
+        Returns the key for a column of a list of dictionaries, e.g. items[][qty]
+
+        Column names are repeated for every row, and by every response with the same shape, so
+        they're memoised rather than built each time.
+
+        """
+
+        pair = (prefix, suffix)
+        try:
+            return self._names[pair]
+        except KeyError:
+            pass
+
+        name = self.name_cache.get(pair)
+        if name is None:
+            name = sys.intern(f"{prefix}[]{suffix}")
+            self.name_cache.set(pair, name)
+
+        self._names[pair] = name
+        return name
+
+    def layout(self, items: list[Any] | tuple[Any, ...]) -> int:
+        """
+        Returns how a list is flattened, as one of the layout constants
+
+        """
+
+        first_row = items[0] if items else None
+        if not self.columns or not isinstance(first_row, dict) or not first_row:
+            if any(isinstance(item, (dict, list, tuple)) for item in items):
+                return _NUMBERED
+            return _VALUES
+
+        # Lists of dictionaries are only columns if every row has the same keys, and no lists
+        keys = first_row.keys()
+        layout = _COLUMNS
+        for row in items:
+            if not isinstance(row, dict) or row.keys() != keys:
+                return _NUMBERED
+            for value in row.values():
+                if isinstance(value, (list, tuple)):
+                    return _NUMBERED
+                if isinstance(value, dict):
+                    if _has_list(value):
+                        return _NUMBERED
+                    layout = _NESTED_COLUMNS
+
+        return layout
+
+    def add(self, flat: dict[str, Any], key: str, value: Any) -> None:
+        if isinstance(value, dict):
+            if not value:
+                flat[key] = value
+            for index, item in value.items():
+                self.add(flat, f"{key}[{index}]", item)
+
+        elif isinstance(value, (list, tuple)):
+            layout = self.layout(value)
+            if layout == _VALUES:
+                flat[f"{key}[]"] = list(value)
+            elif layout == _NUMBERED:
+                for idx, item in enumerate(value):
+                    self.add(flat, f"{key}[{idx}]", item)
+            elif layout == _COLUMNS:
+                for index in value[0]:
+                    flat[self.column_name(key, f"[{index}]")] = [
+                        row[index] for row in value
+                    ]
+            else:
+                self._add_nested_columns(flat, key, value)
+
+        else:
+            flat[key] = value
+
+    def _add_nested_columns(
+        self, flat: dict[str, Any], key: str, rows: list[Any] | tuple[Any, ...]
+    ) -> None:
+        # Each row is flattened on its own, into keys relative to the row, e.g. [qty]
+        flat_rows = []
+        for row in rows:
+            flat_row: dict[str, Any] = {}
+            for index, item in row.items():
+                self.add(flat_row, f"[{index}]", item)
+            flat_rows.append(flat_row)
+
+        # Rows have the same keys, but nested dictionaries within them may not
+        suffixes = flat_rows[0].keys()
+        if any(flat_row.keys() != suffixes for flat_row in flat_rows):
+            for idx, row in enumerate(rows):
+                self.add(flat, f"{key}[{idx}]", row)
+            return
+
+        for suffix in suffixes:
+            flat[self.column_name(key, suffix)] = [
+                flat_row[suffix] for flat_row in flat_rows
+            ]
+
+
+def _has_list(data: dict[str, Any]) -> bool:
+    for value in data.values():
+        if isinstance(value, (list, tuple)):
+            return True
+        if isinstance(value, dict) and _has_list(value):
+            return True
+    return False
@@ -0,0 +1,168 @@
+"""
+Incremental parsers for HTML form bodies
+
+Each parser is fed the chunks of a body as they arrive, and returns the (key, value) fields that
+are complete so far, so they can be given to an Unflattener without building a flat dictionary.
+
+"""
+
+from typing import Any, Protocol
+from urllib.parse import unquote_to_bytes
+
+Field = tuple[str, str]
+
+
+class FormParser(Protocol):
+    def feed(self, chunk: bytes) -> list[Field]: ...
+
+    def close(self) -> list[Field]: ...
+
+
+class FileFieldFound(Exception):
+    """
+    Raised when a multipart body contains a file, which can't be unflattened
+
+    """
+
+
+class URLEncodedParser:
+    """
+    Parses application/x-www-form-urlencoded bodies
+
+    """
+
+    def __init__(self, charset: str = "utf-8"):
+        self.charset = charset
+
+        # The start of a field that continues into the next chunk
+        self._pending: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[Field]:
+        if b"&" not in chunk:
+            if chunk:
+                self._pending.append(chunk)
+            return []
+
+        self._pending.append(chunk)
+        *fields, last = b"".join(self._pending).split(b"&")
+        self._pending = [last] if last else []
+
+        return [self._decode(field) for field in fields if field]
+
+    def close(self) -> list[Field]:
+        field = b"".join(self._pending)
+        self._pending = []
+
+        return [self._decode(field)] if field else []
+
+    def _decode(self, field: bytes) -> Field:
+        name, _, value = field.partition(b"=")
+        return self._unquote(name), self._unquote(value)
+
+    def _unquote(self, value: bytes) -> str:
+        return unquote_to_bytes(value.replace(b"+", b" ")).decode(
+            self.charset, "replace"
+        )
+
+
+class MultipartFieldParser:
+    """
+    Parses the fields of multipart/form-data bodies
+
+    Files can't be unflattened, so FileFieldFound is raised when a part has a filename.
+
+    Requires python-multipart to be installed.
+
+    """
+
+    def __init__(self, content_type: bytes):
+        from python_multipart.multipart import MultipartParser, parse_options_header
+
+        _, options = parse_options_header(content_type)
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise ValueError("Missing boundary in multipart content type")
+
+        self.charset = options.get(b"charset", b"utf-8").decode("latin-1")
+        self._parse_options_header = parse_options_header
+
+        self._fields: list[Field] = []
+        self._name = b""
+        self._header_field = b""
+        self._header_value = b""
+        self._data: list[bytes] = []
+        self._file = False
+
+        callbacks: Any = {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+        }
+        self._parser = MultipartParser(boundary, callbacks)
+
+    def feed(self, chunk: bytes) -> list[Field]:
+        self._parser.write(chunk)
+        return self._take()
+
+    def close(self) -> list[Field]:
+        self._parser.finalize()
+        return self._take()
+
+    def _take(self) -> list[Field]:
+        if self._file:
+            raise FileFieldFound()
+
+        fields = self._fields
+        self._fields = []
+        return fields
+
+    def _on_part_begin(self) -> None:
+        self._name = b""
+        self._data = []
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._data.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        name = self._name.decode(self.charset, "replace")
+        value = b"".join(self._data).decode(self.charset, "replace")
+        self._fields.append((name, value))
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            _, options = self._parse_options_header(self._header_value)
+            self._name = options.get(b"name", b"")
+            if b"filename" in options:
+                self._file = True
+
+        self._header_field = b""
+        self._header_value = b""
+
+
+def get_form_parser(content_type: bytes) -> FormParser | None:
+    """
+    Returns a parser for a form content type, or None if it can't be parsed
+
+    Multipart bodies need python-multipart to be installed.
+
+    """
+
+    if content_type.startswith(b"application/x-www-form-urlencoded"):
+        return URLEncodedParser()
+
+    if content_type.startswith(b"multipart/form-data"):
+        try:
+            return MultipartFieldParser(content_type)
+        except (ImportError, ValueError):
+            return None
+
+    return None
@@ -0,0 +1,112 @@
+"""
+Reporting how long RuggedMiddleware spends on each request
+
+Instruments given to the middleware are called with the RequestMetrics of each JSON or form
+request once the app has handled it. The time spent in each phase is recorded:
+
+-   read: receiving the body (including unflattening it, for forms and streamed bodies)
+-   decode: decoding the JSON body
+-   unflatten: unflattening the decoded body
+-   encode: re-encoding the unflattened body for the app
+-   process: decoding, unflattening and re-encoding the body in a worker process
+
+Phases that didn't happen, e.g. because the body had no keys to unflatten, are left out.
+
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+
+@dataclass
+class RequestMetrics:
+    method: str
+    path: str
+
+    # When the middleware started handling the request, as a UNIX timestamp in nanoseconds
+    started: int = field(default_factory=time.time_ns)
+    # How long each phase took, in seconds
+    phases: dict[str, float] = field(default_factory=dict)
+    # When the last phase ended, as a UNIX timestamp in nanoseconds
+    finished: int | None = None
+
+    body_size: int = 0
+    # The number of keys in the flat body
+    key_count: int = 0
+
+    # Whether the structure of the body was already known, if it was unflattened
+    plan_cache_hit: bool | None = None
+    # How many of the body's keys had already been parsed
+    key_cache_hits: int = 0
+    key_cache_misses: int = 0
+
+    def record(self, phase: str, start: float) -> None:
+        """
+        Records a phase that began at start, from time.perf_counter(), and has just ended
+
+        """
+
+        self.phases[phase] = time.perf_counter() - start
+        self.finished = time.time_ns()
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+
+class Instrument(Protocol):
+    def __call__(self, metrics: RequestMetrics, /) -> None: ...
+
+
+def server_timing(metrics: RequestMetrics) -> bytes:
+    """
+    Returns the phases of a request as a Server-Timing header value, in milliseconds
+
+    """
+
+    return ", ".join(
+        f"rugged-{phase};dur={duration * 1000:.3f}"
+        for phase, duration in metrics.phases.items()
+    ).encode("latin-1")
+
+
+class OpenTelemetryInstrument:
+    """
+    Records each request as an OpenTelemetry span, with its metrics as attributes
+
+    The span is a child of the span that is current when the app has handled the request, usually
+    the server span for the request. It runs from when the middleware started handling the
+    request until its last phase ended.
+
+    Requires opentelemetry-api to be installed.
+
+    """
+
+    def __init__(
+        self, tracer_provider: Any = None, span_name: str = "rugged.unflatten"
+    ):
+        from opentelemetry import trace
+
+        self.tracer = trace.get_tracer("rugged", tracer_provider=tracer_provider)
+        self.span_name = span_name
+
+    def __call__(self, metrics: RequestMetrics) -> None:
+        attributes: dict[str, Any] = {
+            "http.request.method": metrics.method,
+            "url.path": metrics.path,
+            "rugged.body_size": metrics.body_size,
+            "rugged.key_count": metrics.key_count,
+            "rugged.key_cache_hits": metrics.key_cache_hits,
+            "rugged.key_cache_misses": metrics.key_cache_misses,
+        }
+        if metrics.plan_cache_hit is not None:
+            attributes["rugged.plan_cache_hit"] = metrics.plan_cache_hit
+        for phase, duration in metrics.phases.items():
+            attributes[f"rugged.{phase}.duration_ms"] = duration * 1000
+
+        span = self.tracer.start_span(
+            self.span_name, start_time=metrics.started, attributes=attributes
+        )
+        # Phases may be apart, e.g. reading the body and encoding it when the app receives it
+        span.end(end_time=metrics.finished or time.time_ns())
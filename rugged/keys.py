@@ -0,0 +1,228 @@
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Literal
+
+from .caching import LRUCache
+from .limits import LimitExceeded
+
+ParsedKey = tuple[str | None, list[str | None]]
+ValidParsedKey = tuple[str, list[str | None]]
+CachedParsedKey = tuple[str | None, tuple[str | None, ...]]
+
+KeyCache = LRUCache[str, CachedParsedKey]
+
+# How keys are nested: with square brackets, e.g. items[0][name], with dots, e.g. items.0.name,
+# or with either, e.g. items[0].name
+KeyNotation = Literal["brackets", "dotted", "mixed"]
+
+
+@dataclass(frozen=True)
+class KeySyntax:
+    notation: KeyNotation = "brackets"
+    # Whether malformed keys, e.g. address]city[, raise LimitExceeded rather than being kept
+    # as they are
+    reject_malformed: bool = False
+
+    def __post_init__(self) -> None:
+        if self.notation not in ("brackets", "dotted", "mixed"):
+            raise ValueError(f"Unknown key notation {self.notation!r}")
+
+
+BRACKETS = KeySyntax()
+
+# Numeric indexes longer than this aren't treated as list positions
+MAX_POSITION_DIGITS = 18
+
+# Shared by unflatten() calls that don't bring their own cache
+default_key_cache: KeyCache = LRUCache(maxsize=4096)
+# The same, for calls with other key syntaxes, as keys are parsed differently by each
+default_key_caches: dict[KeySyntax, KeyCache] = {BRACKETS: default_key_cache}
+
+
+def get_default_key_cache(syntax: KeySyntax | None = None) -> KeyCache:
+    if syntax is None:
+        return default_key_cache
+    return default_key_caches.setdefault(syntax, LRUCache(maxsize=4096))
+
+
+# Used in place of a cache for bodies with more keys than their cache holds
+no_key_cache: KeyCache = LRUCache(maxsize=0)
+
+
+def key_cache_for(
+    key_count: int, cache: KeyCache | None = None, syntax: KeySyntax | None = None
+) -> KeyCache:
+    """
+    Returns the cache to parse the keys of a body with key_count distinct keys with
+
+    A body with more keys than the cache holds would evict every key in it, those of other
+    bodies included, before any of them is seen again, so its keys aren't cached at all.
+
+    """
+
+    if cache is None:
+        cache = get_default_key_cache(syntax)
+    return cache if key_count <= cache.maxsize else no_key_cache
+
+
+def parse_key(key: str, syntax: KeySyntax | None = None) -> ParsedKey:
+    """
+    Finds paired square brackets in a key, and returns the inner values
+
+    For example, results[0][name] will return 'results', ['0', 'name']
+
+    When no bracket pairs are present, an empty list is returned.
+
+    Empty square brackets, to represent auto-numbering of list indices, are represented as None
+
+    When no root key is given (e.g. [0][name]), the root key will be None.
+
+    The key is read in one pass, following the notation of syntax, by default square brackets.
+    With dotted notation each dot starts an index, e.g. results.0.name, and with mixed notation
+    either may, e.g. results[0].name. Malformed keys, e.g. address[road or results..name, are
+    returned as-is without indexes, or raise LimitExceeded if the syntax rejects them, as do
+    keys without a root key.
+
+    """
+
+    notation = "brackets" if syntax is None else syntax.notation
+    if notation == "brackets":
+        parsed = _scan_brackets(key)
+    elif notation == "dotted":
+        parsed = _scan_dotted(key)
+    else:
+        parsed = _scan_mixed(key)
+
+    if (
+        syntax is not None
+        and syntax.reject_malformed
+        and (parsed is None or parsed[0] is None)
+    ):
+        raise LimitExceeded(f"{key!r} is not a valid key")
+
+    return (key, []) if parsed is None else parsed
+
+
+def _scan_brackets(key: str) -> ParsedKey | None:
+    parts = key.split("[")
+    if len(parts) == 1:
+        return key, []
+
+    # A closing bracket before the first opening one is unmatched, e.g. address]home[city]
+    if "]" in parts[0]:
+        return None
+
+    # Each part after an opening bracket must be its index, closed at the end of the part
+    indexes: list[str | None] = []
+    for part in parts[1:]:
+        end = part.find("]")
+        if end == -1 or end != len(part) - 1:
+            return None
+        indexes.append(part[:-1] or None)
+
+    return parts[0] or None, indexes
+
+
+def _scan_dotted(key: str) -> ParsedKey | None:
+    parts = key.split(".")
+    if len(parts) == 1:
+        return key, []
+
+    indexes: list[str | None] = list(parts[1:])
+    if "" in indexes:
+        return None
+
+    return parts[0] or None, indexes
+
+
+def _scan_mixed(key: str) -> ParsedKey | None:
+    parts = key.split("[")
+    if len(parts) > 1 and "]" in parts[0]:
+        return None
+
+    # The root key may be followed by dotted indexes, e.g. results.0[name]
+    root, *dotted = parts[0].split(".")
+    if "" in dotted:
+        return None
+    indexes: list[str | None] = list(dotted)
+
+    # Each part after an opening bracket is its index, then any dotted indexes, e.g. 0].name
+    for part in parts[1:]:
+        end = part.find("]")
+        if end == -1:
+            return None
+        indexes.append(part[:end] or None)
+
+        if end < len(part) - 1:
+            if part[end + 1] != ".":
+                return None
+            dotted = part[end + 2 :].split(".")
+            if "" in dotted or "]" in part[end + 1 :]:
+                return None
+            indexes.extend(dotted)
+
+    return root or None, indexes
+
+
+def parse_key_cached(
+    key: str, cache: KeyCache | None = None, syntax: KeySyntax | None = None
+) -> CachedParsedKey:
+    """
+    Memoised version of parse_key, for keys that are seen on every request
+
+    The root key and indexes are interned, and indexes are returned as a tuple
+    so that the cached value can be shared safely between callers.
+
+    A cache must only be used with one key syntax. Rejected keys aren't cached.
+
+    """
+
+    if cache is None:
+        cache = get_default_key_cache(syntax)
+
+    if cache.maxsize:
+        parsed = cache.get(key)
+        if parsed is not None:
+            return parsed
+
+    prefix, key_pairs = parse_key(key, syntax)
+    parsed = (
+        sys.intern(prefix) if prefix is not None else None,
+        tuple(sys.intern(idx) if idx is not None else None for idx in key_pairs),
+    )
+    cache.set(key, parsed)
+
+    return parsed
+
+
+def has_nested_keys(keys: Iterable[str], syntax: KeySyntax | None = None) -> bool:
+    """
+    Whether any of the keys may be nested, i.e. has a square bracket or dot, depending on syntax
+
+    """
+
+    notation = "brackets" if syntax is None else syntax.notation
+    if notation == "brackets":
+        return any("[" in key for key in keys)
+    if notation == "dotted":
+        return any("." in key for key in keys)
+    return any("[" in key or "." in key for key in keys)
+
+
+def index_position(index: str | None) -> int | None:
+    """
+    Returns the list position a numeric index refers to, e.g. 3 for items[3]
+
+    Only indexes written as a list position would be are recognised, so named, empty and
+    zero-padded indexes (e.g. items[03]) return None, as do indexes too long to be a position.
+
+    """
+
+    if index is None or len(index) > MAX_POSITION_DIGITS:
+        return None
+    if not (index.isdecimal() and index.isascii()):
+        return None
+    if index[0] == "0" and len(index) > 1:
+        return None
+    return int(index)
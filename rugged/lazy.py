@@ -0,0 +1,88 @@
+"""
+Lazily unflattened bodies, which only unflatten the values that are read
+
+A body may be large but only a few of its fields read, e.g. an action field that decides whether
+the rest of the body is needed at all. unflatten(data, lazy=True) groups the keys of the body
+by their root key, and each group is only unflattened when its root key is first looked up.
+
+"""
+
+from collections.abc import Callable, Iterator, Mapping
+from typing import Any
+
+from .keys import KeyCache, KeySyntax, key_cache_for, parse_key_cached
+
+__all__ = ["LazyUnflattened", "group_by_root"]
+
+
+def group_by_root(
+    data: dict[str, Any],
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Groups the keys of a flat dictionary by the key they're unflattened into, e.g. address for
+    address[city], in the order each is first seen
+
+    """
+
+    key_cache = key_cache_for(len(data), key_cache, key_syntax)
+    groups: dict[str, dict[str, Any]] = {}
+    for key, value in data.items():
+        root = key
+        if key_syntax is not None or "[" in key:
+            # Keys that have no root key, or are malformed, are unflattened as they are
+            root = parse_key_cached(key, key_cache, key_syntax)[0] or key
+
+        group = groups.get(root)
+        if group is None:
+            groups[root] = {key: value}
+        else:
+            group[key] = value
+
+    return groups
+
+
+class LazyUnflattened(Mapping[str, Any]):
+    """
+    A read-only unflattened body, which unflattens the value of each key when it's first read
+
+    build is called with the flat keys of one root key, and returns the unflattened value.
+    Errors in those keys, such as exceeding limits, are raised when the value is first read.
+
+    """
+
+    __slots__ = ("build", "built", "groups")
+
+    def __init__(
+        self,
+        groups: dict[str, dict[str, Any]],
+        build: Callable[[str, dict[str, Any]], Any],
+    ):
+        self.groups = groups
+        self.build = build
+        # Values that have been read, by root key
+        self.built: dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self.built[key]
+        except KeyError:
+            pass
+
+        value = self.build(key, self.groups[key])
+        self.built[key] = value
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.groups)
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.groups
+
+    def __repr__(self) -> str:
+        built = ", ".join(f"{key!r}: {value!r}" for key, value in self.built.items())
+        return f"LazyUnflattened({{{built}}}, keys={list(self.groups)!r})"
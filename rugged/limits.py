@@ -0,0 +1,78 @@
+"""
+Limits on the size and shape of bodies that are unflattened
+
+Without limits, a single crafted body can make unflattening take a long time or a lot of memory,
+e.g. with a very large number of keys, or lists of many thousands of objects. Limits are checked
+as each key is parsed, so bodies that exceed them are rejected before they are built.
+
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+
+class LimitExceeded(ValueError):
+    """
+    Raised when a body exceeds one of the limits it's unflattened with
+
+    status_code is the HTTP status the middleware responds with: 413 for bodies that are too
+    large, and 400 for keys that aren't allowed.
+
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def __reduce__(self) -> tuple[type["LimitExceeded"], tuple[str, int]]:
+        # Keep the status code when raised in a worker process
+        return type(self), (str(self), self.status_code)
+
+
+class KeyConflict(LimitExceeded):
+    """
+    Raised when the keys of a body can't be unflattened together, e.g. a and a[b], or
+    users[][id] and users[][name] with different numbers of values
+
+    """
+
+
+@dataclass(frozen=True)
+class Limits:
+    # The most keys a body may have, counting each key of a form once per value
+    max_keys: int | None = None
+    # The most square brackets a key may have, e.g. 2 for address[home][city]
+    max_depth: int | None = None
+    # The most items in a list, e.g. of values for emails[], or objects for users[][name]
+    max_list_length: int | None = None
+    # The largest numeric index allowed in a key, e.g. 10 for items[10]
+    max_index: int | None = None
+
+    def check_key_count(self, count: int) -> None:
+        if self.max_keys is not None and count > self.max_keys:
+            raise LimitExceeded(
+                f"Body has more than {self.max_keys} keys", status_code=413
+            )
+
+    def check_key(self, key: str, indexes: Sequence[str | None]) -> None:
+        if self.max_depth is not None and len(indexes) > self.max_depth:
+            raise LimitExceeded(
+                f"{key!r} is nested more than {self.max_depth} levels deep"
+            )
+
+        if self.max_index is not None:
+            for index in indexes:
+                if index is not None and index.isdecimal():
+                    # Long indexes are compared by length, rather than converted
+                    digits = index.lstrip("0") or "0"
+                    too_long = len(digits) > len(str(self.max_index))
+                    if too_long or int(digits) > self.max_index:
+                        raise LimitExceeded(
+                            f"{key!r} has an index larger than {self.max_index}"
+                        )
+
+    def check_list_length(self, name: str, length: int) -> None:
+        if self.max_list_length is not None and length > self.max_list_length:
+            raise LimitExceeded(
+                f"{name!r} has more than {self.max_list_length} items", status_code=413
+            )
@@ -1,46 +1,454 @@
-import json
+import time
+from collections.abc import Iterable, Sequence
+from dataclasses import replace
+from typing import Any
 
-from starlette.types import ASGIApp, Receive, Scope, Send, Message
-from starlette.datastructures import MutableHeaders
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from .unflatteners import unflatten
+from .bodies import BodyBuffer, BodyTooLarge
+from .caching import LRUCache
+from .codecs import CODECS, Codec, get_codec
+from .flatteners import NameCache
+from .forms import FileFieldFound, FormParser, MultipartFieldParser, get_form_parser
+from .instrumentation import Instrument, server_timing
+from .keys import KeySyntax
+from .limits import LimitExceeded, Limits
+from .options import MiddlewareOptions
+from .plans import PlanCache
+from .receivers import InstrumentedJSONReceiver, JSONReceiver, NDJSONReceiver
+from .responses import FlatteningSender
+from .routes import Route, RouteMatcher
+from .unflatteners import KeyCache, SparseLists, Unflattener, get_plan
+from .websockets import WebSocketReceiver
+
+# Requests with these methods don't have a body to unflatten
+BODILESS_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "TRACE"})
+
+# The key in scope["state"] for the JSONReceiver of a request
+STATE_KEY = "rugged"
+
+
+def scan_headers(scope: Scope) -> tuple[bytes, int | None]:
+    """
+    Finds the content type and length of a request, without decoding its headers
+
+    ASGI servers give header names in lowercase, so they can be compared as bytes.
+
+    """
+
+    content_type = b""
+    content_length = None
+
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            content_type = value
+        elif name == b"content-length" and value.isdigit():
+            content_length = int(value)
+
+    return content_type, content_length
 
 
 class RuggedMiddleware:
-    should_unflatten: bool
-    receive: Receive
-    send: Send
+    key_cache: KeyCache
+    plan_cache: PlanCache
+    name_cache: NameCache
 
-    def __init__(self, app: ASGIApp):
+    def __init__(
+        self,
+        app: ASGIApp,
+        key_cache_size: int = 1024,
+        plan_cache_size: int = 128,
+        max_body_size: int | None = None,
+        spool_size: int = 1024 * 1024,
+        codec: Codec | str = "json",
+        forms: bool = False,
+        ndjson: bool = False,
+        websockets: bool = False,
+        flatten_responses: bool = False,
+        flatten_columns: bool = False,
+        stream_size: int | None = None,
+        instruments: Sequence[Instrument] = (),
+        server_timing: bool = False,
+        limits: Limits | None = None,
+        sparse_lists: SparseLists = "object",
+        columns: bool = False,
+        key_syntax: KeySyntax | None = None,
+        merge_duplicate_keys: bool = False,
+        thread_size: int | None = None,
+        process_size: int | None = None,
+        precompile: bool = False,
+        routes: Sequence[str | Route] | None = None,
+        exclude_routes: Sequence[str] = (),
+    ):
         self.app = app
 
-        self.should_unflatten = False
+        # The options of requests that aren't to a route with its own
+        self.options = MiddlewareOptions(
+            # Decodes and re-encodes JSON bodies, by default with the standard library
+            codec=get_codec(codec) if isinstance(codec, str) else codec,
+            limits=limits,
+            sparse_lists=sparse_lists,
+            columns=columns,
+            key_syntax=key_syntax,
+            merge_duplicate_keys=merge_duplicate_keys,
+            forms=forms,
+            ndjson=ndjson,
+            websockets=websockets,
+            flatten_responses=flatten_responses,
+            flatten_columns=flatten_columns,
+            max_body_size=max_body_size,
+            spool_size=spool_size,
+            stream_size=stream_size,
+            thread_size=thread_size,
+            process_size=process_size,
+        )
+        if process_size is not None and self.options.codec.name not in CODECS:
+            raise ValueError("process_size needs one of the built-in codecs")
+
+        # Called with the metrics of each request, and whether to send them to the client
+        self.instruments = list(instruments)
+        self.server_timing = server_timing
+        self.receiver_class = (
+            InstrumentedJSONReceiver if instruments or server_timing else JSONReceiver
+        )
+
+        # Parsed field names, shared across requests handled by this middleware
+        self.key_cache = LRUCache(maxsize=key_cache_size)
+        # Unflatten plans, keyed by the fields in a request body
+        self.plan_cache = LRUCache(maxsize=plan_cache_size)
+        # Flattened column names, shared across responses
+        self.name_cache = LRUCache(maxsize=key_cache_size)
+
+        # Whether to compile plans for the body models of a FastAPI app when it starts up
+        self.precompile = precompile
+
+        # The options to handle requests to each path with, if not all of them are handled
+        # alike. Requests to excluded paths, or to none of the given routes, are passed
+        # straight through
+        self.router: RouteMatcher[MiddlewareOptions | None] | None = None
+        self.default: MiddlewareOptions | None = self.options
+        if routes is not None or exclude_routes:
+            self.router = self.compile_routes(routes, exclude_routes)
+            self.default = None if routes is not None else self.options
+
+    def compile_routes(
+        self, routes: Sequence[str | Route] | None, exclude_routes: Sequence[str]
+    ) -> RouteMatcher[MiddlewareOptions | None]:
+        targets: list[tuple[str, MiddlewareOptions | None]] = [
+            (pattern, None) for pattern in exclude_routes
+        ]
+
+        for route in routes or ():
+            if isinstance(route, str):
+                route = Route(route)
+            targets.append((route.pattern, self.with_options(route.options)))
+
+        return RouteMatcher(targets)
+
+    def with_options(self, options: dict[str, Any]) -> MiddlewareOptions:
+        """
+        Returns the middleware's options with some of them changed, for the requests to a route
+
+        """
+
+        if not options:
+            return self.options
+
+        return replace(self.options, **options)
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        headers = MutableHeaders(scope=scope)
+        if scope["type"] == "lifespan" and self.precompile:
+            await self.app(scope, self.precompile_on_startup(scope, receive), send)
+            return
+
+        if self.router is None or scope["type"] not in ("http", "websocket"):
+            await self.handle(scope, receive, send, self.options)
+            return
 
-        self.should_unflatten = "application/json" in headers.get("content-type", "")
+        options = self.router.match(scope["path"], self.default)
+        if options is None:
+            await self.app(scope, receive, send)
+            return
 
-        self.receive = receive
-        await self.app(scope, self.receive_json, send)
+        await self.handle(scope, receive, send, options)
 
-    async def receive_json(self) -> Message:
-        message = await self.receive()
+    def precompile_on_startup(self, scope: Scope, receive: Receive) -> Receive:
+        """
+        Returns a receive channel that compiles plans for the app's routes as it starts up
 
-        if not self.should_unflatten:
+        """
+
+        async def receive_startup() -> Message:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                app = scope.get("app")
+                if app is not None:
+                    self.precompile_app(app)
             return message
 
-        body = message["body"]
-        more_body = message.get("more_body", False)
-        if more_body:
-            message = await self.receive()
-            if message["body"] != b"":
-                raise NotImplementedError(
-                    "Streaming the request body not supported yet."
-                )
+        return receive_startup
+
+    def precompile_app(self, app: Any) -> int:
+        """
+        Compiles and caches the plans for the body models of a FastAPI app's routes, returning
+        the number of shapes compiled
+
+        See rugged.warming for the keys derived from each model. Routes with their own options
+        share this middleware's caches, so are warmed with it.
+
+        """
+
+        from .warming import app_shapes
+
+        shapes = app_shapes(app)
+        self.warm(shapes)
+        return len(shapes)
+
+    def warm(self, shapes: Iterable[tuple[str, ...]]) -> None:
+        """
+        Parses the keys and compiles the plans of bodies with the given keys, in the order
+        they're sent, so that the first requests with them hit the caches
+
+        """
+
+        for shape in shapes:
+            get_plan(
+                shape,
+                key_cache=self.key_cache,
+                key_syntax=self.options.key_syntax,
+                plan_cache=self.plan_cache,
+            )
+
+    async def handle(
+        self, scope: Scope, receive: Receive, send: Send, options: MiddlewareOptions
+    ) -> None:
+        if options.flatten_responses and scope["type"] == "http":
+            send = FlatteningSender(
+                self, send, head=scope["method"] == "HEAD", options=options
+            )
+
+        if scope["type"] == "websocket" and options.websockets:
+            await self.app(scope, WebSocketReceiver(options, receive), send)
+            return
+
+        # Anything without a body is passed straight through
+        if scope["type"] != "http" or scope["method"] in BODILESS_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        content_type, content_length = scan_headers(scope)
+
+        form_parser = None
+        is_ndjson = False
+        if b"application/json" not in content_type:
+            if options.ndjson and content_type.startswith(b"application/x-ndjson"):
+                is_ndjson = True
+            elif options.forms:
+                form_parser = get_form_parser(content_type)
+
+            if form_parser is None and not is_ndjson:
+                await self.app(scope, receive, send)
+                return
 
-        data = json.loads(body)
-        unflattened = unflatten(data)
+        # Reject bodies we know are too large before reading them
+        if (
+            options.max_body_size is not None
+            and (content_length or 0) > options.max_body_size
+        ):
+            await self.reject_too_large(scope, receive, send)
+            return
 
-        message["body"] = json.dumps(unflattened).encode()
+        if form_parser is not None:
+            await self.handle_form(
+                scope, receive, send, options, form_parser, content_length
+            )
+            return
+
+        if is_ndjson:
+            await self.app(scope, NDJSONReceiver(self, receive, options), send)
+            return
+
+        # State for this request is kept in the receiver, not the middleware
+        receiver = self.receiver_class(self, receive, content_length, options=options)
+        scope["state"] = {**scope.get("state", {}), STATE_KEY: receiver}
+
+        await self.call_app(scope, receiver, send)
+
+    async def call_app(self, scope: Scope, receiver: JSONReceiver, send: Send) -> None:
+        if not isinstance(receiver, InstrumentedJSONReceiver):
+            await self.app(scope, receiver, send)
+            return
+
+        metrics = receiver.metrics
+        metrics.method = scope["method"]
+        metrics.path = scope["path"]
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and metrics.phases:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(metrics)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(
+                scope, receiver, send_with_timing if self.server_timing else send
+            )
+        finally:
+            for instrument in self.instruments:
+                instrument(metrics)
+
+    async def handle_form(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        options: MiddlewareOptions,
+        parser: FormParser,
+        content_length: int | None,
+    ) -> None:
+        """
+        Unflattens a form body as it is received, and passes it on to the app as JSON
+
+        Multipart bodies that contain files are passed on as they were sent.
+
+        """
+
+        started = time.perf_counter()
+        unflattener = Unflattener(
+            key_cache=self.key_cache,
+            key_syntax=options.key_syntax,
+            limits=options.limits,
+            sparse_lists=options.sparse_lists,
+            columns=options.columns,
+        )
+
+        # Multipart bodies are kept until we know they don't contain files
+        sent_body = None
+        if isinstance(parser, MultipartFieldParser):
+            sent_body = BodyBuffer(
+                content_length=content_length, spool_size=options.spool_size
+            )
+
+        size = 0
+        key_count = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return
+
+                chunk = message.get("body", b"")
+                more_body = message.get("more_body", False)
+
+                size += len(chunk)
+                if options.max_body_size is not None and size > options.max_body_size:
+                    await self.reject_too_large(scope, receive, send)
+                    return
+
+                if sent_body is not None:
+                    sent_body.write(chunk)
+
+                fields = parser.feed(chunk)
+                key_count += len(fields)
+                for key, value in fields:
+                    unflattener.add_pair(key, value)
+
+            fields = parser.close()
+            key_count += len(fields)
+            for key, value in fields:
+                unflattener.add_pair(key, value)
+
+            data = unflattener.result()
+        except LimitExceeded as exc:
+            await self.reject(scope, receive, send, exc.status_code, str(exc))
+            return
+        except FileFieldFound:
+            # The part read so far is replayed, and the rest of the body streamed to the app
+            assert sent_body is not None
+            receive = replay(
+                sent_body.chunks(),
+                receive,
+                more_body=more_body,
+                size=size,
+                max_body_size=options.max_body_size,
+            )
+            await self.app(scope, receive, send)
+            return
+
+        headers = [
+            (name, value)
+            for name, value in scope["headers"]
+            if name not in (b"content-type", b"content-length")
+        ]
+        headers.append((b"content-type", b"application/json"))
+
+        receiver = self.receiver_class(self, receive, None, data=data, options=options)
+        scope = {
+            **scope,
+            "headers": headers,
+            "state": {**scope.get("state", {}), STATE_KEY: receiver},
+        }
+
+        if isinstance(receiver, InstrumentedJSONReceiver):
+            receiver.metrics.record("read", started)
+            receiver.metrics.body_size = size
+            receiver.metrics.key_count = key_count
+
+        await self.call_app(scope, receiver, send)
+
+    async def reject_too_large(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        exc = BodyTooLarge()
+        await self.reject(scope, receive, send, exc.status_code, exc.detail)
+
+    async def reject(
+        self, scope: Scope, receive: Receive, send: Send, status_code: int, detail: str
+    ) -> None:
+        """
+        Responds to a request that can't be handled, before it reaches the app
+
+        """
+
+        response = PlainTextResponse(detail, status_code=status_code)
+        await response(scope, receive, send)
+
+
+def replay(
+    body: Iterable[bytes],
+    receive: Receive,
+    *,
+    more_body: bool = False,
+    size: int = 0,
+    max_body_size: int | None = None,
+) -> Receive:
+    """
+    Returns a receive channel that gives the app the part of a body that has already been read,
+    then the rest of the body from receive if more_body
+
+    size is the length of the part already read, so that BodyTooLarge is raised once the rest
+    of the body takes it over max_body_size.
+
+    """
+
+    chunks = iter(body)
+    chunk: bytes | None = next(chunks, b"")
+
+    async def receive_replay() -> Message:
+        nonlocal chunk, size
+        if chunk is not None:
+            message: Message = {"type": "http.request", "body": chunk}
+            chunk = next(chunks, None)
+            message["more_body"] = more_body or chunk is not None
+            return message
+
+        message = await receive()
+        size += len(message.get("body", b""))
+        if max_body_size is not None and size > max_body_size:
+            raise BodyTooLarge()
         return message
+
+    return receive_replay
@@ -0,0 +1,59 @@
+"""
+The options RuggedMiddleware handles requests with
+
+Options are frozen, so they can be shared by every request in flight. Routes with their own
+options (see rugged.routes) get a copy of the middleware's options with those replaced, while
+the app, caches and instruments stay with the middleware.
+
+"""
+
+from dataclasses import dataclass
+
+from .codecs import Codec
+from .keys import KeySyntax
+from .limits import Limits
+from .unflatteners import SparseLists
+
+__all__ = ["MiddlewareOptions"]
+
+
+@dataclass(frozen=True)
+class MiddlewareOptions:
+    # Decodes and re-encodes JSON bodies
+    codec: Codec
+
+    # Bodies that exceed these are rejected while they're unflattened
+    limits: Limits | None = None
+    # What numeric keys that are out of order or have gaps are unflattened into
+    sparse_lists: SparseLists = "object"
+    # Whether lists of objects are passed on to the app as an object of columns
+    columns: bool = False
+    # How keys are nested, e.g. address[city] or address.city, and whether malformed keys
+    # are rejected with a 400 response
+    key_syntax: KeySyntax | None = None
+    # Whether top-level keys repeated in a JSON body are collected into a list of values,
+    # as they are in forms, rather than the last value being kept
+    merge_duplicate_keys: bool = False
+
+    # Whether to unflatten form bodies, which are passed on to the app as JSON
+    forms: bool = False
+    # Whether to unflatten each line of newline-delimited JSON bodies
+    ndjson: bool = False
+    # Whether to unflatten each JSON text message received over WebSockets
+    websockets: bool = False
+    # Whether to flatten JSON responses from the app, and to flatten lists of objects into
+    # columns, e.g. items[][qty], rather than numbered keys
+    flatten_responses: bool = False
+    flatten_columns: bool = False
+
+    # Bodies larger than max_body_size are rejected, and bodies larger than
+    # spool_size are buffered on disk while they are received
+    max_body_size: int | None = None
+    spool_size: int = 1024 * 1024
+    # Streamed bodies larger than this are unflattened as they're received, without buffering
+    stream_size: int | None = None
+
+    # Bodies at least thread_size bytes are unflattened in a worker thread, and bodies at
+    # least process_size bytes in a worker process, so they don't block the event loop
+    thread_size: int | None = None
+    process_size: int | None = None
@@ -0,0 +1,333 @@
+from collections.abc import Iterable
+from typing import Literal
+
+from .caching import LRUCache
+from .keys import (
+    BRACKETS,
+    CachedParsedKey,
+    KeyCache,
+    KeySyntax,
+    index_position,
+    key_cache_for,
+    parse_key_cached,
+)
+from .limits import Limits
+
+
+class MapNode:
+    """
+    Creates an object from its children, or a list if its keys are sequential
+
+    """
+
+    __slots__ = ("as_list", "children", "ordered")
+
+    def __init__(self) -> None:
+        self.children: dict[str, PlanNode] = {}
+        self.as_list = False
+        # The children by list position, if every key is one but they aren't sequential
+        self.ordered: list[tuple[int, PlanNode]] | None = None
+
+
+class ValueNode:
+    """
+    Places the value at position `pos` in the flat body
+
+    """
+
+    __slots__ = ("pos",)
+
+    def __init__(self, pos: int):
+        self.pos = pos
+
+
+class ListNode:
+    """
+    Creates a list from the values of one or more `key[]` fields
+
+    """
+
+    __slots__ = ("sources",)
+
+    def __init__(self) -> None:
+        self.sources: list[int] = []
+
+
+class ObjectListNode:
+    """
+    Creates a list of objects from `key[][field]` fields, one column per field
+
+    """
+
+    __slots__ = ("as_list", "fields")
+
+    def __init__(self) -> None:
+        self.fields: dict[str, int] = {}
+        self.as_list = False
+
+
+PlanNode = MapNode | ValueNode | ListNode | ObjectListNode
+
+
+class UnflattenPlan:
+    """
+    A precomputed set of container creations and value placements
+
+    A plan is compiled from the keys of a flat body, and can be replayed with
+    the values of any body that has exactly the same keys in the same order.
+
+    So that limits can be checked without parsing every key again, a plan also
+    records its most deeply nested key, the key with the largest numeric index,
+    and the positions of the values that are added to each list.
+
+    Objects with numeric keys that are out of order or have gaps, e.g. users[3]
+    and users[1], are recorded in sparse with their number of keys and the
+    length of the list they'd fill, for the sparse list policy to be applied.
+
+    """
+
+    __slots__ = ("extremes", "keys", "lists", "root", "sparse")
+
+    def __init__(
+        self,
+        keys: tuple[str, ...],
+        root: MapNode,
+        extremes: list[tuple[str, CachedParsedKey]] | None = None,
+        lists: list[tuple[str, tuple[int, ...]]] | None = None,
+        sparse: list[tuple[str, int, int]] | None = None,
+    ):
+        self.keys = keys
+        self.root = root
+        self.extremes = extremes or []
+        self.lists = lists or []
+        self.sparse = sparse or []
+
+
+# Plans are cached by key signature - False marks a shape that can't be planned
+PlanCache = LRUCache[tuple[str, ...], UnflattenPlan | Literal[False]]
+
+# Shared by unflatten() calls that don't bring their own cache
+default_plan_cache: PlanCache = LRUCache(maxsize=256)
+# The same, for calls with other key syntaxes, as the same keys make different plans in each
+default_plan_caches: dict[KeySyntax, PlanCache] = {}
+
+
+def get_default_plan_cache(syntax: KeySyntax | None = None) -> PlanCache:
+    if syntax is None or syntax == BRACKETS:
+        return default_plan_cache
+    return default_plan_caches.setdefault(syntax, LRUCache(maxsize=256))
+
+
+# Keys nested deeper than this are derived instead, as plans are replayed recursively
+MAX_PLAN_DEPTH = 100
+
+
+class _Unplannable(Exception):
+    pass
+
+
+def compile_plan(
+    keys: Iterable[str],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    limits: Limits | None = None,
+) -> UnflattenPlan | None:
+    """
+    Compiles the keys of a flat body into a plan
+
+    Only well-formed shapes are planned. None is returned for shapes where
+    keys conflict with each other (e.g. `address` and `address[zipcode]`), or
+    that the unflattening rules don't support yet (e.g. `users[][name][title]`),
+    in which case unflatten() falls back to deriving the structure itself.
+
+    Each key is checked against the depth and index limits as it's parsed, so
+    keys that exceed them raise LimitExceeded before the plan is built.
+
+    """
+
+    keys = tuple(keys)
+    key_cache = key_cache_for(len(keys), key_cache, key_syntax)
+    root = MapNode()
+
+    deepest: tuple[str, CachedParsedKey] | None = None
+    largest: tuple[tuple[int, str], str, CachedParsedKey] | None = None
+
+    try:
+        for pos, key in enumerate(keys):
+            parsed = parse_key_cached(key, key_cache, key_syntax)
+            if limits is not None:
+                limits.check_key(key, parsed[1])
+            if len(parsed[1]) > MAX_PLAN_DEPTH:
+                raise _Unplannable(key)
+            _place(root, pos, key, parsed)
+
+            indexes = parsed[1]
+            if deepest is None or len(indexes) > len(deepest[1][1]):
+                deepest = (key, parsed)
+
+            for index in indexes:
+                if index is not None and index.isdecimal():
+                    # Compared by length first, so long indexes aren't converted
+                    digits = index.lstrip("0")
+                    if largest is None or (len(digits), digits) > largest[0]:
+                        largest = ((len(digits), digits), key, parsed)
+    except _Unplannable:
+        return None
+
+    # A body of only sequential keys ({"0": ..., "1": ...}) isn't an object
+    if _finalise(root):
+        return None
+    # Keys outside square brackets aren't list positions
+    root.ordered = None
+
+    extremes = [deepest] if deepest is not None else []
+    if largest is not None:
+        extremes.append(largest[1:])
+
+    lists: list[tuple[str, tuple[int, ...]]] = []
+    sparse: list[tuple[str, int, int]] = []
+    _collect_lists(root, lists, sparse)
+
+    return UnflattenPlan(keys, root, extremes, lists, sparse)
+
+
+def _place(root: MapNode, pos: int, key: str, parsed: CachedParsedKey) -> None:
+    root_key, indexes = parsed
+
+    # Invalid keys like `[address][postcode]` are placed as-is
+    if root_key is None or len(indexes) == 0:
+        name = key if root_key is None else root_key
+        if name in root.children:
+            raise _Unplannable(key)
+        root.children[name] = ValueNode(pos)
+        return
+
+    container = root
+    name = root_key
+    for idx, index in enumerate(indexes):
+        node = container.children.get(name)
+
+        if index is not None:
+            if node is None:
+                node = container.children[name] = MapNode()
+            elif not isinstance(node, MapNode):
+                raise _Unplannable(key)
+
+            container = node
+            name = index
+            continue
+
+        remaining = indexes[idx + 1 :]
+
+        # key[] => value
+        if len(remaining) == 0:
+            if node is None:
+                node = container.children[name] = ListNode()
+            elif not isinstance(node, ListNode):
+                raise _Unplannable(key)
+
+            node.sources.append(pos)
+            return
+
+        # key[][field] => value
+        if len(remaining) == 1 and remaining[0] is not None:
+            if node is None:
+                node = container.children[name] = ObjectListNode()
+            elif not isinstance(node, ObjectListNode):
+                raise _Unplannable(key)
+
+            if remaining[0] in node.fields:
+                raise _Unplannable(key)
+            node.fields[remaining[0]] = pos
+            return
+
+        # Deeper structures within lists aren't supported
+        raise _Unplannable(key)
+
+    if name in container.children:
+        raise _Unplannable(key)
+    container.children[name] = ValueNode(pos)
+
+
+def _finalise(root: MapNode) -> bool:
+    """
+    Marks objects with sequential keys to be created as lists
+
+    Objects whose keys are all list positions, but not in sequence, have their children
+    ordered by position instead. Returns whether root was marked.
+
+    Nodes are visited from a stack rather than recursively, as keys may be nested deeper than
+    the recursion limit.
+
+    """
+
+    stack: list[PlanNode] = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, MapNode):
+            stack.extend(node.children.values())
+            _order(node)
+        elif isinstance(node, ObjectListNode):
+            node.as_list = is_sequential(node.fields)
+
+    return root.as_list
+
+
+def _order(node: MapNode) -> None:
+    positions: list[int] = []
+    for name in node.children:
+        position = index_position(name)
+        if position is None:
+            return
+        positions.append(position)
+
+    node.as_list = positions == list(range(len(positions))) and bool(positions)
+    if positions and not node.as_list:
+        node.ordered = sorted(
+            zip(positions, node.children.values()), key=lambda item: item[0]
+        )
+
+
+def _collect_lists(
+    root: MapNode,
+    lists: list[tuple[str, tuple[int, ...]]],
+    sparse: list[tuple[str, int, int]],
+) -> None:
+    """
+    Collects the positions of the values that are added to each list in a plan, and the objects
+    with numeric keys that aren't in sequence
+
+    """
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        maps = []
+        for name, child in node.children.items():
+            if isinstance(child, MapNode):
+                if child.ordered is not None:
+                    sparse.append((name, len(child.ordered), child.ordered[-1][0] + 1))
+                maps.append(child)
+            elif isinstance(child, ListNode):
+                lists.append((name, tuple(child.sources)))
+            elif isinstance(child, ObjectListNode):
+                # Each field has a value for each object in the list
+                lists.extend((name, (pos,)) for pos in child.fields.values())
+
+        # Visited in the order they're set
+        stack.extend(reversed(maps))
+
+
+def is_sequential(keys: Iterable[str]) -> bool:
+    """
+    Whether keys are 0-indexed, sequential integers, i.e. "0", "1", "2"
+
+    """
+
+    count = 0
+    for count, key in enumerate(keys, start=1):
+        if key != str(count - 1):
+            return False
+
+    return count > 0
@@ -0,0 +1,656 @@
+"""
+Receive channels that unflatten the bodies of requests as the app receives them
+
+RuggedMiddleware wraps the receive channel of each request it handles in one of these. A
+JSONReceiver reads and unflattens the whole body, while an NDJSONReceiver unflattens one line at
+a time. Each reads its options from the route the request is to, and shares the caches of the
+middleware.
+
+"""
+
+import time
+from collections.abc import Callable
+from functools import cache
+from typing import TYPE_CHECKING, Any, TypeVar
+
+import anyio.to_process
+import anyio.to_thread
+from starlette.exceptions import HTTPException
+from starlette.requests import ClientDisconnect
+from starlette.types import Message, Receive
+
+from .bodies import BodyBuffer, BodyTooLarge
+from .codecs import Codec, decode_pairs, get_codec
+from .instrumentation import RequestMetrics
+from .keys import KeySyntax, has_nested_keys
+from .limits import LimitExceeded, Limits
+from .options import MiddlewareOptions
+from .streams import PairDecoder
+from .unflatteners import SparseLists, Unflattener, unflatten, unflatten_pairs
+
+if TYPE_CHECKING:
+    from .middleware import RuggedMiddleware
+
+_UNSET: Any = object()
+
+T = TypeVar("T")
+
+__all__ = [
+    "InstrumentedJSONReceiver",
+    "JSONReceiver",
+    "NDJSONReceiver",
+    "may_have_brackets",
+    "may_have_dots",
+    "may_have_nested_keys",
+    "pairs_need_unflattening",
+    "reencode",
+]
+
+
+def may_have_brackets(body: bytes | bytearray) -> bool:
+    """
+    Whether a JSON body contains a square bracket, literally or as a unicode escape
+
+    """
+
+    return b"[" in body or b"\\u005b" in body or b"\\u005B" in body
+
+
+def may_have_dots(body: bytes | bytearray) -> bool:
+    """
+    Whether a JSON body contains a dot, literally or as a unicode escape
+
+    """
+
+    return b"." in body or b"\\u002e" in body or b"\\u002E" in body
+
+
+def may_have_nested_keys(
+    body: bytes | bytearray, key_syntax: KeySyntax | None = None
+) -> bool:
+    """
+    Whether a JSON body may have keys to unflatten, in the given key syntax
+
+    """
+
+    notation = "brackets" if key_syntax is None else key_syntax.notation
+    if notation == "brackets":
+        return may_have_brackets(body)
+    if notation == "dotted":
+        return may_have_dots(body)
+    return may_have_brackets(body) or may_have_dots(body)
+
+
+def pairs_need_unflattening(
+    pairs: list[tuple[str, Any]], key_syntax: KeySyntax | None = None
+) -> bool:
+    """
+    Whether any of the keys of a body's pairs may be nested, or are repeated
+
+    """
+
+    keys = [key for key, _ in pairs]
+    return has_nested_keys(keys, key_syntax) or len(set(keys)) != len(keys)
+
+
+class JSONReceiver:
+    """
+    Wraps the receive channel of a single JSON request, to unflatten its body
+
+    The unflattened body is available to the app in two ways: re-encoded as the request body when
+    the app receives it, or as an object from json(), which skips re-encoding it. The receiver is
+    stored in scope["state"] under STATE_KEY for the latter.
+
+    """
+
+    def __init__(
+        self,
+        middleware: "RuggedMiddleware",
+        receive: Receive,
+        content_length: int | None,
+        data: Any = _UNSET,
+        options: MiddlewareOptions | None = None,
+    ):
+        self.middleware = middleware
+        # The options of the route the request is to, if it has its own
+        self.options = middleware.options if options is None else options
+        self.receive = receive
+        self.content_length = content_length
+
+        # The body as it was sent, once it has been read
+        self.body: bytes | bytearray | None = None
+        # Whether the app has received the body
+        self.delivered = False
+
+        self._data: Any = data
+        self._unflattened = False
+        # The top-level pairs of a body with duplicate keys, if they're merged
+        self._pairs: list[tuple[str, Any]] | None = None
+
+        # The body was unflattened as it was read, e.g. from a form
+        if data is not _UNSET:
+            self.body = b""
+            self._unflattened = True
+
+    async def __call__(self) -> Message:
+        if self.delivered:
+            return await self.receive()
+
+        if self.body is None:
+            message = await self.receive()
+            if message["type"] != "http.request":
+                return message
+            self.body = await self.read(message)
+
+        self.delivered = True
+        message = {"type": "http.request", "body": bytes(self.body), "more_body": False}
+
+        # Bodies without any square brackets can't have keys to unflatten, but may have keys
+        # to merge
+        options = self.options
+        if (
+            self._data is _UNSET
+            and not options.merge_duplicate_keys
+            and not may_have_nested_keys(self.body, options.key_syntax)
+        ):
+            return message
+
+        # Very large bodies are re-encoded in a worker process, if one is configured
+        process_size = options.process_size
+        if (
+            process_size is not None
+            and len(self.body) >= process_size
+            and self._data is _UNSET
+        ):
+            body = await self.reencode_in_process(self.body)
+            if body is not None:
+                message["body"] = body
+            return message
+
+        # Brackets may only be in values, in which case the body is forwarded as it was sent
+        data = await self.json()
+        if self._unflattened:
+            message["body"] = await self.offload(self.encode, data)
+
+        return message
+
+    async def json(self) -> Any:
+        """
+        Returns the unflattened body, reading it if the app hasn't received it yet
+
+        """
+
+        if self._data is not _UNSET:
+            return self._data
+
+        if self.body is None:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnect()
+            self.body = await self.read(message)
+
+            if self._data is not _UNSET:
+                return self._data
+
+        data, self._unflattened = await self.offload(self.process, self.body)
+
+        self._data = data
+        return data
+
+    async def offload(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Calls func in a worker thread if the body is large enough to block the event loop
+
+        """
+
+        thread_size = self.options.thread_size
+        if thread_size is None or self.body is None or len(self.body) < thread_size:
+            return func(*args)
+
+        return await anyio.to_thread.run_sync(func, *args)
+
+    async def reencode_in_process(self, body: bytes | bytearray) -> bytes | None:
+        options = self.options
+        try:
+            return await anyio.to_process.run_sync(
+                reencode,
+                bytes(body),
+                options.codec.name,
+                options.limits,
+                options.sparse_lists,
+                options.columns,
+                options.key_syntax,
+                options.merge_duplicate_keys,
+            )
+        except LimitExceeded as exc:
+            raise HTTPException(exc.status_code, str(exc)) from exc
+
+    def process(self, body: bytes | bytearray) -> tuple[Any, bool]:
+        """
+        Decodes and unflattens a body, returning it and whether it was unflattened
+
+        """
+
+        data = self.decode(body)
+
+        # Objects decoded as pairs are unflattened from them, to keep the values of repeated keys
+        pairs = self._pairs
+        if pairs is not None:
+            if pairs_need_unflattening(pairs, self.options.key_syntax):
+                return self.unflatten_pairs(pairs), True
+            return dict(pairs), False
+
+        if isinstance(data, dict) and has_nested_keys(data, self.options.key_syntax):
+            return self.unflatten(data), True
+
+        return data, False
+
+    def decode(self, body: bytes | bytearray) -> Any:
+        if self.options.merge_duplicate_keys:
+            data, self._pairs = decode_pairs(body)
+            return data
+
+        return self.options.codec.decode(body)
+
+    def unflatten_pairs(self, pairs: list[tuple[str, Any]]) -> Any:
+        middleware, options = self.middleware, self.options
+        try:
+            return unflatten_pairs(
+                pairs,
+                key_cache=middleware.key_cache,
+                key_syntax=options.key_syntax,
+                plan_cache=middleware.plan_cache,
+                limits=options.limits,
+                sparse_lists=options.sparse_lists,
+                columns=options.columns,
+            )
+        except LimitExceeded as exc:
+            raise HTTPException(exc.status_code, str(exc)) from exc
+
+    def unflatten(self, data: dict[str, Any]) -> Any:
+        middleware, options = self.middleware, self.options
+        try:
+            return unflatten(
+                data,
+                key_cache=middleware.key_cache,
+                key_syntax=options.key_syntax,
+                plan_cache=middleware.plan_cache,
+                limits=options.limits,
+                sparse_lists=options.sparse_lists,
+                columns=options.columns,
+            )
+        except LimitExceeded as exc:
+            raise HTTPException(exc.status_code, str(exc)) from exc
+
+    def encode(self, data: Any) -> bytes:
+        return self.options.codec.encode(data)
+
+    async def read(self, message: Message) -> bytes | bytearray:
+        """
+        Reads the request body, starting from the first message
+
+        Large streamed bodies are unflattened as they are read, instead of being kept.
+
+        """
+
+        stream_size = self.options.stream_size
+        if (
+            stream_size is not None
+            and message.get("more_body", False)
+            and (self.content_length is None or self.content_length > stream_size)
+        ):
+            await self.read_stream(message)
+            return b""
+
+        return await self.read_body(message)
+
+    async def read_stream(self, message: Message) -> int:
+        """
+        Unflattens the request body as it's received, starting from the first message, and returns
+        the size of the body
+
+        The body isn't kept, so the unflattened body is always re-encoded for the app.
+
+        """
+
+        middleware, options = self.middleware, self.options
+        max_body_size = options.max_body_size
+
+        decoder = PairDecoder()
+        unflattener = Unflattener(
+            key_cache=middleware.key_cache,
+            key_syntax=options.key_syntax,
+            limits=options.limits,
+            sparse_lists=options.sparse_lists,
+            columns=options.columns,
+        )
+        add = (
+            unflattener.add_pair
+            if options.merge_duplicate_keys
+            else unflattener.add_unique
+        )
+        key_syntax = options.key_syntax
+        nested = False
+        size = 0
+
+        try:
+            while True:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if max_body_size is not None and size > max_body_size:
+                    raise BodyTooLarge()
+
+                for key, value in decoder.feed(chunk):
+                    nested = nested or has_nested_keys((key,), key_syntax)
+                    add(key, value)
+
+                if not message.get("more_body", False):
+                    break
+
+                message = await self.receive()
+                if message["type"] == "http.disconnect":
+                    raise ClientDisconnect()
+
+            for key, value in decoder.close():
+                nested = nested or has_nested_keys((key,), key_syntax)
+                add(key, value)
+
+            if not decoder.is_object:
+                self._data = decoder.document
+            elif nested:
+                self._data = unflattener.result()
+            else:
+                # Keys without brackets were added as they are
+                self._data = unflattener.nested
+        except LimitExceeded as exc:
+            raise HTTPException(exc.status_code, str(exc)) from exc
+
+        self._unflattened = True
+        return size
+
+    async def read_body(self, message: Message) -> bytes | bytearray:
+        """
+        Reads the rest of the request body, starting from the first message
+
+        """
+
+        body = message.get("body", b"")
+        max_body_size = self.options.max_body_size
+
+        # Most bodies arrive in a single message
+        if not message.get("more_body", False):
+            if max_body_size is not None and len(body) > max_body_size:
+                raise BodyTooLarge()
+            return body
+
+        buffer = BodyBuffer(
+            content_length=self.content_length,
+            max_size=max_body_size,
+            spool_size=self.options.spool_size,
+        )
+        buffer.write(body)
+
+        while message.get("more_body", False):
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                buffer.close()
+                raise ClientDisconnect()
+            buffer.write(message.get("body", b""))
+
+        return buffer.getvalue()
+
+
+class InstrumentedJSONReceiver(JSONReceiver):
+    """
+    A JSONReceiver that records how long each phase of handling the request takes
+
+    Used in place of JSONReceiver when the middleware has instruments, so requests aren't timed
+    when they aren't reported.
+
+    """
+
+    def __init__(
+        self,
+        middleware: "RuggedMiddleware",
+        receive: Receive,
+        content_length: int | None,
+        data: Any = _UNSET,
+        options: MiddlewareOptions | None = None,
+    ):
+        super().__init__(middleware, receive, content_length, data, options)
+        self.metrics = RequestMetrics(method="", path="")
+
+    async def read(self, message: Message) -> bytes | bytearray:
+        start = time.perf_counter()
+        body = await super().read(message)
+        self.metrics.record("read", start)
+
+        if body:
+            self.metrics.body_size = len(body)
+        return body
+
+    async def read_stream(self, message: Message) -> int:
+        size = await super().read_stream(message)
+        self.metrics.body_size = size
+        return size
+
+    def decode(self, body: bytes | bytearray) -> Any:
+        start = time.perf_counter()
+        data = super().decode(body)
+        self.metrics.record("decode", start)
+
+        if self._pairs is not None:
+            self.metrics.key_count = len(self._pairs)
+        elif isinstance(data, dict):
+            self.metrics.key_count = len(data)
+        return data
+
+    def unflatten_pairs(self, pairs: list[tuple[str, Any]]) -> Any:
+        start = time.perf_counter()
+        result = super().unflatten_pairs(pairs)
+        self.metrics.record("unflatten", start)
+        return result
+
+    def unflatten(self, data: dict[str, Any]) -> Any:
+        key_cache = self.middleware.key_cache
+        hits, misses = key_cache.hits, key_cache.misses
+        self.metrics.plan_cache_hit = tuple(data) in self.middleware.plan_cache
+
+        start = time.perf_counter()
+        result = super().unflatten(data)
+        self.metrics.record("unflatten", start)
+
+        self.metrics.key_cache_hits = key_cache.hits - hits
+        self.metrics.key_cache_misses = key_cache.misses - misses
+        return result
+
+    def encode(self, data: Any) -> bytes:
+        start = time.perf_counter()
+        body = super().encode(data)
+        self.metrics.record("encode", start)
+        return body
+
+    async def reencode_in_process(self, body: bytes | bytearray) -> bytes | None:
+        start = time.perf_counter()
+        encoded = await super().reencode_in_process(body)
+        self.metrics.record("process", start)
+        return encoded
+
+
+class NDJSONReceiver:
+    """
+    Wraps the receive channel of a newline-delimited JSON request, to unflatten each line
+
+    Lines are passed on to the app as soon as they have been received and unflattened, so the
+    body is never held in memory as a whole, however many lines it has. Lines without keys to
+    unflatten, and lines that aren't valid JSON, are passed on as they were sent.
+
+    """
+
+    def __init__(
+        self,
+        middleware: "RuggedMiddleware",
+        receive: Receive,
+        options: MiddlewareOptions | None = None,
+    ):
+        self.middleware = middleware
+        self.options = middleware.options if options is None else options
+        self.receive = receive
+
+        # The start of a line that continues into the next chunk
+        self.pending: list[bytes] = []
+        self.size = 0
+        self.done = False
+
+    async def __call__(self) -> Message:
+        if self.done:
+            return await self.receive()
+
+        max_body_size = self.options.max_body_size
+
+        while True:
+            message = await self.receive()
+            if message["type"] != "http.request":
+                return message
+
+            chunk = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            self.size += len(chunk)
+            if max_body_size is not None and self.size > max_body_size:
+                raise BodyTooLarge()
+
+            # Wait for the end of a line
+            if more_body and b"\n" not in chunk:
+                self.pending.append(chunk)
+                continue
+
+            if self.pending:
+                chunk = b"".join([*self.pending, chunk])
+                self.pending = []
+
+            if more_body:
+                end = chunk.rfind(b"\n") + 1
+                chunk, rest = chunk[:end], chunk[end:]
+                if rest:
+                    self.pending.append(rest)
+            else:
+                self.done = True
+
+            return {
+                "type": "http.request",
+                "body": self.unflatten_lines(chunk),
+                "more_body": more_body,
+            }
+
+    def unflatten_lines(self, lines: bytes) -> bytes:
+        options = self.options
+        # Repeated keys are merged whether or not there are keys to unflatten
+        if not options.merge_duplicate_keys and not may_have_nested_keys(
+            lines, options.key_syntax
+        ):
+            return lines
+
+        return b"\n".join(self.unflatten_line(line) for line in lines.split(b"\n"))
+
+    def unflatten_line(self, line: bytes) -> bytes:
+        middleware, options = self.middleware, self.options
+        merge = options.merge_duplicate_keys
+        if not merge and not may_have_nested_keys(line, options.key_syntax):
+            return line
+
+        # Lines that aren't JSON, including blank ones, are passed on for the app to handle
+        try:
+            if merge:
+                data, pairs = decode_pairs(line)
+            else:
+                data, pairs = options.codec.decode(line), None
+        except ValueError:
+            return line
+
+        try:
+            if pairs is not None:
+                if not pairs_need_unflattening(pairs, options.key_syntax):
+                    return line
+                data = unflatten_pairs(
+                    pairs,
+                    key_cache=middleware.key_cache,
+                    key_syntax=options.key_syntax,
+                    plan_cache=middleware.plan_cache,
+                    limits=options.limits,
+                    sparse_lists=options.sparse_lists,
+                    columns=options.columns,
+                )
+            elif isinstance(data, dict) and has_nested_keys(data, options.key_syntax):
+                data = unflatten(
+                    data,
+                    key_cache=middleware.key_cache,
+                    key_syntax=options.key_syntax,
+                    plan_cache=middleware.plan_cache,
+                    limits=options.limits,
+                    sparse_lists=options.sparse_lists,
+                    columns=options.columns,
+                )
+            else:
+                return line
+        except LimitExceeded as exc:
+            raise HTTPException(exc.status_code, str(exc)) from exc
+
+        return options.codec.encode(data)
+
+
+@cache
+def get_process_codec(name: str) -> Codec:
+    return get_codec(name)
+
+
+def reencode(
+    body: bytes,
+    codec_name: str,
+    limits: Limits | None,
+    sparse_lists: SparseLists = "object",
+    columns: bool = False,
+    key_syntax: KeySyntax | None = None,
+    merge_duplicate_keys: bool = False,
+) -> bytes | None:
+    """
+    Decodes, unflattens and re-encodes a body, or returns None if it has no keys to unflatten
+
+    This is run in worker processes, which have their own codec and the default key and plan
+    caches, so only the bodies are sent between processes.
+
+    """
+
+    codec = get_process_codec(codec_name)
+
+    pairs = None
+    if merge_duplicate_keys:
+        data, pairs = decode_pairs(body)
+    else:
+        data = codec.decode(body)
+
+    if pairs is not None:
+        if not pairs_need_unflattening(pairs, key_syntax):
+            return None
+        return codec.encode(
+            unflatten_pairs(
+                pairs,
+                key_syntax=key_syntax,
+                limits=limits,
+                sparse_lists=sparse_lists,
+                columns=columns,
+            )
+        )
+
+    if not (isinstance(data, dict) and has_nested_keys(data, key_syntax)):
+        return None
+
+    return codec.encode(
+        unflatten(
+            data,
+            key_syntax=key_syntax,
+            limits=limits,
+            sparse_lists=sparse_lists,
+            columns=columns,
+        )
+    )
@@ -0,0 +1,134 @@
+"""
+Flattening JSON responses from the app
+
+"""
+
+from typing import TYPE_CHECKING
+
+from starlette.types import Message, Send
+
+from .flatteners import flatten, iter_flatten
+from .options import MiddlewareOptions
+
+if TYPE_CHECKING:
+    from .middleware import RuggedMiddleware
+
+# Flattened responses larger than this are sent in parts, each of about this many keys
+FLATTEN_STREAM_SIZE = 64 * 1024
+FLATTEN_BATCH_SIZE = 1024
+
+__all__ = ["FlatteningSender", "is_json_response"]
+
+
+class FlatteningSender:
+    """
+    Wraps the send channel of a request, to flatten JSON responses from the app
+
+    Successful responses that are JSON objects are flattened into bracket keys (see flatten()),
+    e.g. to pre-populate a form. Error responses, such as validation errors, are left as they
+    are for clients that parse them. Large responses are flattened, encoded and sent in parts, so the flat
+    response is never held in memory as a whole. Other responses are sent as they were.
+
+    Responses to HEAD requests are flattened the same way. Apps usually send them without a
+    body, in which case the length of the flattened body isn't known, so it's left out.
+
+    """
+
+    def __init__(
+        self,
+        middleware: "RuggedMiddleware",
+        send: Send,
+        head: bool = False,
+        options: MiddlewareOptions | None = None,
+    ):
+        self.middleware = middleware
+        self.options = middleware.options if options is None else options
+        self.send = send
+        self.head = head
+
+        # The start of a JSON response, held until its body has been flattened
+        self.start: Message | None = None
+        self.body: list[bytes] = []
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            if 200 <= message["status"] < 300 and is_json_response(message):
+                self.start = message
+                return
+
+        elif message["type"] == "http.response.body" and self.start is not None:
+            self.body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                await self.send_flattened(b"".join(self.body))
+            return
+
+        await self.send(message)
+
+    async def send_flattened(self, body: bytes) -> None:
+        assert self.start is not None
+        middleware, options = self.middleware, self.options
+        codec = options.codec
+
+        headers = [
+            (name, value)
+            for name, value in self.start.get("headers", [])
+            if name.lower() != b"content-length"
+        ]
+
+        if self.head and not body:
+            await self.send({**self.start, "headers": headers})
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            data = codec.decode(body)
+        except ValueError:
+            data = None
+
+        if not isinstance(data, dict):
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        if len(body) <= FLATTEN_STREAM_SIZE:
+            flat = flatten(
+                data,
+                columns=options.flatten_columns,
+                name_cache=middleware.name_cache,
+            )
+            body = codec.encode(flat)
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+
+            await self.send({**self.start, "headers": headers})
+            await self.send({"type": "http.response.body", "body": body})
+            return
+
+        # Each batch of keys is encoded as an object, and joined into one without its braces
+        await self.send({**self.start, "headers": headers})
+
+        opening = b"{"
+        for batch in iter_flatten(
+            data,
+            columns=options.flatten_columns,
+            name_cache=middleware.name_cache,
+            batch_size=FLATTEN_BATCH_SIZE,
+        ):
+            encoded = codec.encode(batch).strip()
+            await self.send(
+                {
+                    "type": "http.response.body",
+                    "body": opening + encoded[1:-1],
+                    "more_body": True,
+                }
+            )
+            opening = b","
+
+        closing = b"{}" if opening == b"{" else b"}"
+        await self.send({"type": "http.response.body", "body": closing})
+
+
+def is_json_response(message: Message) -> bool:
+    for name, value in message.get("headers", []):
+        if name.lower() == b"content-type":
+            return b"application/json" in value
+    return False
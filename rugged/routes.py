@@ -0,0 +1,110 @@
+"""
+Choosing which requests RuggedMiddleware handles, by the path of the request
+
+Route patterns are paths, where {name} matches one segment of the path and * matches the rest of
+it, e.g. /users/{id}/address or /forms/*. The patterns of a middleware are compiled into a single
+regular expression, so each request is matched with one pass over its path, however many
+patterns there are.
+
+"""
+
+import re
+from collections.abc import Sequence
+from typing import Any, Generic, TypeVar
+
+T = TypeVar("T")
+
+# Options of RuggedMiddleware that can be set for the requests to a route
+ROUTE_OPTIONS = frozenset(
+    {
+        "limits",
+        "sparse_lists",
+        "columns",
+        "forms",
+        "ndjson",
+        "websockets",
+        "flatten_responses",
+        "flatten_columns",
+        "max_body_size",
+        "stream_size",
+        "merge_duplicate_keys",
+    }
+)
+
+_WILDCARD = re.compile(r"\{[^{}/]*\}|\*")
+
+__all__ = ["ROUTE_OPTIONS", "Route", "RouteMatcher", "compile_pattern"]
+
+
+class Route:
+    """
+    A route pattern, with the options to handle its requests with
+
+    Options not given are those of the middleware, e.g.
+
+        Route("/import/*", limits=Limits(max_keys=100_000), columns=True)
+
+    """
+
+    __slots__ = ("options", "pattern")
+
+    def __init__(self, pattern: str, **options: Any):
+        unknown = options.keys() - ROUTE_OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown route options: {', '.join(sorted(unknown))}")
+
+        compile_pattern(pattern)
+        self.pattern = pattern
+        self.options = options
+
+    def __repr__(self) -> str:
+        options = "".join(f", {name}={value!r}" for name, value in self.options.items())
+        return f"Route({self.pattern!r}{options})"
+
+
+def compile_pattern(pattern: str) -> str:
+    """
+    Returns the regular expression for a route pattern, which must match a whole path
+
+    """
+
+    if not pattern.startswith("/"):
+        raise ValueError(f"Route pattern {pattern!r} must start with /")
+
+    parts = []
+    pos = 0
+    for match in _WILDCARD.finditer(pattern):
+        parts.append(re.escape(pattern[pos : match.start()]))
+        parts.append(".*" if match.group() == "*" else "[^/]+")
+        pos = match.end()
+    parts.append(re.escape(pattern[pos:]))
+
+    return "".join(parts)
+
+
+class RouteMatcher(Generic[T]):
+    """
+    Finds the target of the first of a list of route patterns that matches a path
+
+    """
+
+    def __init__(self, routes: Sequence[tuple[str, T]]):
+        # Each pattern is a named group, so the match says which pattern it was
+        self.targets: dict[str, T] = {}
+        groups = []
+        for idx, (pattern, target) in enumerate(routes):
+            name = f"r{idx}"
+            groups.append(f"(?P<{name}>{compile_pattern(pattern)})")
+            self.targets[name] = target
+
+        self.regex = re.compile("|".join(groups)) if groups else None
+
+    def match(self, path: str, default: T) -> T:
+        if self.regex is None:
+            return default
+
+        match = self.regex.fullmatch(path)
+        if match is None or match.lastgroup is None:
+            return default
+
+        return self.targets[match.lastgroup]
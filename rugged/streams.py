@@ -0,0 +1,221 @@
+"""
+Incremental decoding of JSON bodies into an Unflattener
+
+A large body is usually sent in many chunks. Rather than holding the body, the decoded flat
+dictionary and the unflattened result in memory at once, the top-level pairs of the body are
+decoded as soon as they arrive and added to an Unflattener, so only the result is kept.
+
+"""
+
+import codecs
+import json
+import re
+from collections.abc import AsyncIterable
+from typing import Any
+
+from .columns import ColumnsMode
+from .keys import KeyCache, KeySyntax
+from .unflatteners import SparseLists, Unflattener
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_START = frozenset("-0123456789")
+NUMBER_CHARS = frozenset("+-.0123456789eE")
+
+# What the decoder expects next
+_START = 0
+_FIRST_KEY = 1
+_KEY = 2
+_COLON = 3
+_VALUE = 4
+_COMMA = 5
+_END = 6
+_DOCUMENT = 7
+
+
+class PairDecoder:
+    """
+    Decodes the top-level key/value pairs of a JSON object from the chunks of a body
+
+    Each value is decoded once it is complete, so a value split across chunks waits for the rest of
+    it. Values that fail to decode are only retried once the body received since has doubled in
+    size, so a large value isn't decoded again for every chunk.
+
+    Bodies that aren't objects are decoded whole when the decoder is closed, and kept in document.
+
+    """
+
+    def __init__(self, encoding: str = "utf-8"):
+        self.document: Any = None
+
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder(encoding)()
+        self._state = _START
+        self._key = ""
+
+        # Text that hasn't been decoded yet, and text received since it was last decoded
+        self._buffer = ""
+        self._pending: list[str] = []
+        self._pending_size = 0
+        # How much text is needed before trying to decode again
+        self._retry_size = 0
+
+    @property
+    def is_object(self) -> bool:
+        return self._state != _DOCUMENT
+
+    def feed(self, chunk: bytes) -> list[tuple[str, Any]]:
+        text = self._text.decode(chunk)
+        if text:
+            self._pending.append(text)
+            self._pending_size += len(text)
+
+        # Bodies that aren't objects are only decoded once they're complete
+        if self._state == _DOCUMENT:
+            return []
+
+        if len(self._buffer) + self._pending_size < self._retry_size:
+            return []
+
+        return self._parse(final=False)
+
+    def close(self) -> list[tuple[str, Any]]:
+        text = self._text.decode(b"", final=True)
+        if text:
+            self._pending.append(text)
+
+        pairs = self._parse(final=True)
+
+        if self._state == _DOCUMENT:
+            self.document, end = self._decoder.raw_decode(self._buffer)
+            end = WHITESPACE.match(self._buffer, end).end()  # type: ignore[union-attr]
+            if end != len(self._buffer):
+                raise json.JSONDecodeError("Extra data", self._buffer, end)
+        elif self._state != _END:
+            raise json.JSONDecodeError(
+                "Unexpected end of body", self._buffer, len(self._buffer)
+            )
+
+        return pairs
+
+    def _parse(self, final: bool) -> list[tuple[str, Any]]:
+        buffer = self._buffer + "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._retry_size = 0
+
+        pairs = []
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()  # type: ignore[union-attr]
+            if pos == len(buffer) or self._state == _DOCUMENT:
+                break
+
+            char = buffer[pos]
+            state = self._state
+
+            if state == _START:
+                if char == "{":
+                    self._state = _FIRST_KEY
+                    pos += 1
+                else:
+                    self._state = _DOCUMENT
+
+            elif state == _FIRST_KEY and char == "}":
+                self._state = _END
+                pos += 1
+
+            elif state == _FIRST_KEY or state == _KEY:
+                if char != '"':
+                    raise json.JSONDecodeError(
+                        "Expecting property name enclosed in double quotes", buffer, pos
+                    )
+
+                try:
+                    self._key, pos = self._decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    self._retry_size = 2 * (len(buffer) - pos)
+                    break
+
+                self._state = _COLON
+
+            elif state == _COLON:
+                if char != ":":
+                    raise json.JSONDecodeError("Expecting ':' delimiter", buffer, pos)
+                self._state = _VALUE
+                pos += 1
+
+            elif state == _VALUE:
+                try:
+                    value, end = self._decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    self._retry_size = 2 * (len(buffer) - pos)
+                    break
+
+                # Numbers may continue in the next chunk, e.g. 12 then .5
+                if (
+                    not final
+                    and buffer[pos] in NUMBER_START
+                    and (end == len(buffer) or buffer[end] in NUMBER_CHARS)
+                ):
+                    break
+
+                pairs.append((self._key, value))
+                self._state = _COMMA
+                pos = end
+
+            elif state == _COMMA:
+                if char == ",":
+                    self._state = _KEY
+                elif char == "}":
+                    self._state = _END
+                else:
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos += 1
+
+            else:
+                raise json.JSONDecodeError("Extra data", buffer, pos)
+
+        self._buffer = buffer[pos:]
+        return pairs
+
+
+async def unflatten_stream(
+    chunks: AsyncIterable[bytes],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> Any:
+    """
+    Unflattens a JSON object from the chunks of a body as they arrive
+
+    The result is the same as unflatten(json.loads(body)), including for repeated keys, where
+    the last value is kept, but the body is never held in memory. Bodies that aren't objects are
+    returned as they were decoded.
+
+    """
+
+    decoder = PairDecoder()
+    unflattener = Unflattener(
+        key_cache=key_cache,
+        key_syntax=key_syntax,
+        sparse_lists=sparse_lists,
+        columns=columns,
+    )
+
+    async for chunk in chunks:
+        for key, value in decoder.feed(chunk):
+            unflattener.add_unique(key, value)
+
+    for key, value in decoder.close():
+        unflattener.add_unique(key, value)
+
+    if not decoder.is_object:
+        return decoder.document
+
+    return unflattener.result()
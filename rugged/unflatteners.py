@@ -1,40 +1,118 @@
-import copy
-from collections.abc import Mapping
-import re
-from typing import Any, Iterable, TypeVar
-
-key_pattern = re.compile(r"\[([^\]]*)\]")
-
-ParsedKey = tuple[str | None, list[str | None]]
-ValidParsedKey = tuple[str, list[str | None]]
-
-
-def parse_key(key: str) -> ParsedKey:
-    """
-    Finds paired square brackets in a key, and returns the inner values
-
-    For example, results[0][name] will return 'results', ['0', 'name']
-
-    When no bracket pairs are present, an empty list is returned.
-
-    Empty square brackets, to represent auto-numbering of list indices, are represented as None
-
-    When no root key is given (e.g. [0][name]), the root key will be None.
-
-    """
-
-    key_pairs = key_pattern.findall(key)
-
-    # If there was a matched key, use the text before as the prefix
-    prefix: str | None = key
-    if len(key_pairs) > 0:
-        prefix = key.split(f"[{key_pairs[0]}]", 1)[0]
-    prefix = prefix if prefix else None
-
-    return prefix, [sub_key if len(sub_key) > 0 else None for sub_key in key_pairs]
-
-
-def unflatten(data: dict[str, Any]) -> dict[str, Any] | list[Any]:
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from typing import Any, Literal, TypeVar, cast, overload
+
+from .columns import Columns, ColumnsMode, to_arrays
+from .keys import (
+    CachedParsedKey,
+    KeyCache,
+    KeySyntax,
+    ParsedKey,
+    ValidParsedKey,
+    default_key_cache,
+    get_default_key_cache,
+    index_position,
+    key_cache_for,
+    no_key_cache,
+    parse_key,
+    parse_key_cached,
+)
+from .lazy import LazyUnflattened, group_by_root
+from .limits import KeyConflict, LimitExceeded, Limits
+from .plans import (
+    ListNode,
+    MapNode,
+    PlanCache,
+    PlanNode,
+    UnflattenPlan,
+    ValueNode,
+    compile_plan,
+    get_default_plan_cache,
+    is_sequential,
+)
+
+# What to do with numeric keys that are out of order or have gaps, e.g. users[3] and users[1]
+SparseLists = Literal["object", "compact", "pad", "reject"]
+
+# The longest list sparse_lists="pad" fills in, unless limits allow longer ones
+MAX_PADDED_LENGTH = 10_000
+
+__all__ = [
+    "MAX_PADDED_LENGTH",
+    "CachedParsedKey",
+    "KeyCache",
+    "KeySyntax",
+    "ParsedKey",
+    "SparseLists",
+    "Unflattener",
+    "ValidParsedKey",
+    "all_equal",
+    "apply_plan",
+    "default_key_cache",
+    "derive",
+    "get_plan",
+    "parse_key",
+    "parse_key_cached",
+    "restructure_list",
+    "sequential_keys_to_list",
+    "unflatten",
+    "unflatten_many",
+    "unflatten_pairs",
+]
+
+
+@overload
+def unflatten(
+    data: dict[str, Any],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+    lazy: Literal[False] = False,
+) -> dict[str, Any] | list[Any]: ...
+
+
+@overload
+def unflatten(
+    data: dict[str, Any],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+    lazy: Literal[True],
+) -> LazyUnflattened: ...
+
+
+@overload
+def unflatten(
+    data: dict[str, Any],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+    lazy: bool = False,
+) -> dict[str, Any] | list[Any] | LazyUnflattened: ...
+
+
+def unflatten(
+    data: dict[str, Any],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+    lazy: bool = False,
+) -> dict[str, Any] | list[Any] | LazyUnflattened:
     """
     Unflatten a flat dictionary into a nested dictionary
 
@@ -65,7 +143,24 @@ def unflatten(data: dict[str, Any]) -> dict[str, Any] | list[Any]:
     => { "users[][id]": [1, 2], "users[][name]": ["foo", "bar"] }
     <= { "users": [{ "id": 1, "name": "foo" }, { "id": 2, "name": "bar" }] }
 
-    5. TODO: Currently, keys with numbered square brackets are treated as rule 2, but will be treated more like rule 4 in future.
+    Objects in lists may be nested further, e.g. users[][name][given_name].
+
+    With columns, lists of objects are returned as a Columns instead, a dictionary of the list
+    of values for each field, without building an object for each row. Lists of objects nested
+    further are still returned as lists. With columns="numpy", each column is a NumPy array.
+
+    <= { "users": Columns({ "id": [1, 2], "name": ["foo", "bar"] }) }
+
+    5. Keys with numbered square brackets are treated as lists, when the numbers are sequential:
+
+    => { "users[0][name]": "Foo", "users[1][name]": "Bar" }
+    <= { "users": [{ "name": "Foo" }, { "name": "Bar" }] }
+
+    Numbers that are out of order or have gaps are treated as rule 2 by default. sparse_lists
+    can instead be "compact", to list the values in order of their numbers, "pad", to place
+    each value at its number with None in the gaps, or "reject" to raise LimitExceeded for
+    numbers with gaps. Padded lists are limited to max_list_length, or max_index, of limits,
+    or else to MAX_PADDED_LENGTH items. Numbers out of order but without gaps are listed in order by all three.
 
     6. Any keys that do not conform to these rules are returned as-is.
 
@@ -75,132 +170,815 @@ def unflatten(data: dict[str, Any]) -> dict[str, Any] | list[Any]:
         - A None index is used as a marker for a list
     - a "path" is an address to a nested value, including the root key and indexes, e.g. users[][name] => ("users", None, "name")
 
+    Keys are read with square brackets by default, or with the notation of key_syntax, which
+    can also reject malformed keys rather than keeping them as they are (see parse_key). Parsed
+    keys are memoised in key_cache, or a shared module-level cache if none is given.
+
+    The structure derived from the keys is compiled into a plan (see compile_plan), and cached
+    in plan_cache by the keys of the body. Later bodies with the same keys in the same order
+    are unflattened by replaying the plan with their values.
+
+    Bodies that exceed limits raise LimitExceeded, before they are unflattened. Keys that
+    conflict with each other, e.g. a and a[b], raise KeyConflict.
+
+    With lazy, a read-only LazyUnflattened mapping is returned instead, which only unflattens
+    the keys of each root key when it's first read, and keeps the result. Limits other than
+    the number of keys are checked as each is read. Bodies whose root keys make a list are
+    unflattened straight away.
+
+    """
+
+    if limits is not None:
+        limits.check_key_count(len(data))
+
+    if lazy:
+        groups = group_by_root(data, key_cache, key_syntax)
+        if not is_sequential(groups):
+
+            def build(root: str, group: dict[str, Any]) -> Any:
+                result = unflatten(
+                    group,
+                    key_cache=key_cache,
+                    key_syntax=key_syntax,
+                    plan_cache=plan_cache,
+                    limits=limits,
+                    sparse_lists=sparse_lists,
+                    columns=columns,
+                )
+                # A lone root key of 0 is unflattened into a list
+                return result[0] if isinstance(result, list) else result[root]
+
+            return LazyUnflattened(groups, build)
+
+    plan = get_plan(
+        tuple(data),
+        key_cache=key_cache,
+        key_syntax=key_syntax,
+        plan_cache=plan_cache,
+        limits=limits,
+    )
+    if plan is not False:
+        return apply_plan(
+            plan, data, limits=limits, sparse_lists=sparse_lists, columns=columns
+        )
+
+    # Shapes that can't be planned are derived key by key
+    return derive(
+        data,
+        key_cache=key_cache,
+        key_syntax=key_syntax,
+        limits=limits,
+        sparse_lists=sparse_lists,
+        columns=columns,
+    )
+
+
+def unflatten_many(
+    records: Iterable[dict[str, Any]],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> Iterator[dict[str, Any] | list[Any]]:
+    """
+    Unflatten each of a sequence of flat dictionaries, e.g. the lines of an NDJSON file
+
+    Results are yielded as each record is unflattened, so records can be read lazily. Records
+    usually have the same keys as the one before, in which case its plan is replayed without
+    looking it up in plan_cache again.
+
+    """
+
+    last_signature: tuple[str, ...] | None = None
+    plan: UnflattenPlan | Literal[False] = False
+
+    for record in records:
+        if limits is not None:
+            limits.check_key_count(len(record))
+
+        signature = tuple(record)
+        if signature != last_signature:
+            plan = get_plan(
+                signature,
+                key_cache=key_cache,
+                key_syntax=key_syntax,
+                plan_cache=plan_cache,
+                limits=limits,
+            )
+            last_signature = signature
+
+        if plan is not False:
+            yield apply_plan(
+                plan, record, limits=limits, sparse_lists=sparse_lists, columns=columns
+            )
+        else:
+            yield derive(
+                record,
+                key_cache=key_cache,
+                key_syntax=key_syntax,
+                limits=limits,
+                sparse_lists=sparse_lists,
+                columns=columns,
+            )
+
+
+def get_plan(
+    signature: tuple[str, ...],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+) -> UnflattenPlan | Literal[False]:
+    """
+    Returns the plan for a body with the given keys, compiling it if it isn't cached
+
+    False is returned for shapes that can't be planned. Keys are checked against limits when
+    the plan is compiled.
+
+    """
+
+    if plan_cache is None:
+        plan_cache = get_default_plan_cache(key_syntax)
+
+    plan = plan_cache.get(signature)
+    if plan is None:
+        plan = compile_plan(
+            signature, key_cache=key_cache, key_syntax=key_syntax, limits=limits
+        )
+        if plan is None:
+            plan = False
+        plan_cache.set(signature, plan)
+
+    return plan
+
+
+def apply_plan(
+    plan: UnflattenPlan,
+    data: Mapping[str, Any],
+    *,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> dict[str, Any]:
+    """
+    Unflatten a body by replaying a plan compiled from its keys
+
+    The body must have the same keys, in the same order, as the plan was compiled from.
+
+    """
+
+    return _replay(
+        plan,
+        list(data.values()),
+        limits=limits,
+        sparse_lists=sparse_lists,
+        columns=columns,
+    )
+
+
+def _replay(
+    plan: UnflattenPlan,
+    values: list[Any],
+    *,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> dict[str, Any]:
+    if limits is not None:
+        for key, (_, indexes) in plan.extremes:
+            limits.check_key(key, indexes)
+
+        for name, sources in plan.lists:
+            length = 0
+            for pos in sources:
+                value = values[pos]
+                length += len(value) if isinstance(value, list) else 1
+            limits.check_list_length(name, length)
+
+    if sparse_lists != "object":
+        for name, count, length in plan.sparse:
+            _check_sparse(name, count, length, sparse_lists, limits)
+
+    result = _build(plan.root, values, sparse_lists, columns)
+    assert isinstance(result, dict)
+    return result
+
+
+def _build(
+    node: PlanNode, values: list[Any], sparse_lists: SparseLists, columns: ColumnsMode
+) -> Any:
+    if isinstance(node, ValueNode):
+        return _keys_to_list(values[node.pos])
+
+    if isinstance(node, MapNode):
+        if node.as_list:
+            return [
+                _build(child, values, sparse_lists, columns)
+                for child in node.children.values()
+            ]
+
+        if node.ordered is not None and sparse_lists != "object":
+            if sparse_lists == "pad":
+                items: list[Any] = [None] * (node.ordered[-1][0] + 1)
+                for position, child in node.ordered:
+                    items[position] = _build(child, values, sparse_lists, columns)
+                return items
+
+            return [
+                _build(child, values, sparse_lists, columns)
+                for _, child in node.ordered
+            ]
+
+        return {
+            name: _build(child, values, sparse_lists, columns)
+            for name, child in node.children.items()
+        }
+
+    if isinstance(node, ListNode):
+        sources: list[Any] = []
+        for pos in node.sources:
+            value = values[pos]
+            sources.extend(value) if isinstance(value, list) else sources.append(value)
+
+        return [_keys_to_list(item) for item in restructure_list(sources)]
+
+    # Each field is a column of values, one per object in the list
+    field_values = []
+    for pos in node.fields.values():
+        value = values[pos]
+        field_values.append(value if isinstance(value, list) else [value])
+
+    if not all_equal([len(column) for column in field_values]):
+        raise KeyConflict("objects in list have mismatching item counts")
+
+    if columns and not node.as_list:
+        return _make_columns(dict(zip(node.fields, field_values)), columns)
+
+    fields = tuple(node.fields)
+    objs: list[Any] = []
+    for row in zip(*field_values):
+        row_values = [_keys_to_list(value) for value in row]
+        objs.append(row_values if node.as_list else dict(zip(fields, row_values)))
+
+    return objs
+
+
+# Values that are never unflattened further, so columns of them can be copied as they are
+_PLAIN_TYPES = frozenset({str, int, float, bool, type(None)})
+
+
+def _make_columns(field_values: dict[str, list[Any]], mode: ColumnsMode) -> Columns:
+    columns = {}
+    for field, values in field_values.items():
+        if set(map(type, values)) <= _PLAIN_TYPES:
+            columns[field] = list(values)
+        else:
+            columns[field] = [_keys_to_list(value) for value in values]
+
+    length = len(next(iter(columns.values()), []))
+    result = Columns(columns, length)
+    return to_arrays(result) if mode == "numpy" else result
+
+
+def _check_sparse(
+    name: str,
+    count: int,
+    length: int,
+    sparse_lists: SparseLists,
+    limits: Limits | None,
+) -> None:
     """
+    Checks an object with count numeric keys can be made into a list under the sparse policy
 
-    # The nested dictionary we're building
-    nested: dict[str, Any] = {}
+    """
+
+    # Keys that are only out of order are listed in order, whatever the policy
+    if count == length:
+        return
+
+    if sparse_lists == "reject":
+        raise LimitExceeded(f"{name!r} has gaps in its numeric indexes")
+    if sparse_lists == "pad":
+        # A single large index would otherwise allocate a list of that length
+        max_length = MAX_PADDED_LENGTH
+        if limits is not None and limits.max_list_length is not None:
+            max_length = limits.max_list_length
+        elif limits is not None and limits.max_index is not None:
+            max_length = limits.max_index + 1
+
+        if length > max_length:
+            raise LimitExceeded(
+                f"{name!r} would be padded to more than {max_length} items",
+                status_code=413,
+            )
+
+
+def derive(
+    data: dict[str, Any],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> dict[str, Any] | list[Any]:
+    """
+    Unflatten a flat dictionary by deriving the structure from each key in turn
 
-    # A list of paths
-    list_paths: list[tuple[str]] = []
+    This follows the same rules as unflatten(), without compiling or consulting a plan.
 
+    """
+
+    unflattener = Unflattener(
+        key_cache=key_cache_for(len(data), key_cache, key_syntax),
+        key_syntax=key_syntax,
+        limits=limits,
+        sparse_lists=sparse_lists,
+        columns=columns,
+    )
     for key, value in data.items():
-        # Get the root key (before square brackets) and indices
-        root_key, indexes = parse_key(key)
+        unflattener.add(key, value)
 
-        # Return invalid keys like `[address][postcode]` as-is
-        # TODO: boot these out in parse_keys
-        if root_key is None:
-            nested[key] = value
-            continue
+    return unflattener.result()
 
-        # root is used as a reference to the part of the nested dictionary we're building
-        root = nested
-        # Marks when we have replaced root with a list
-        root_is_list = False
 
-        # Simple key => value items
-        if len(indexes) == 0:
-            root[root_key] = value
-            continue
+def unflatten_pairs(
+    pairs: Sequence[tuple[str, Any]],
+    *,
+    key_cache: KeyCache | None = None,
+    key_syntax: KeySyntax | None = None,
+    plan_cache: PlanCache | None = None,
+    limits: Limits | None = None,
+    sparse_lists: SparseLists = "object",
+    columns: ColumnsMode = False,
+) -> dict[str, Any] | list[Any]:
+    """
+    Unflatten key/value pairs in which keys may be repeated, e.g. as decoded from a JSON body
 
-        # Set root
-        if root_key not in root:
-            root[root_key] = {}
+    Values for a repeated key are collected into a list, as HTTP clients send repeated fields
+    (see Unflattener.add_pair), rather than the last value replacing the others.
 
-        # parent is used to replace a root with a list later on
-        parent = root
-        root = root[root_key]
+    Pairs without repeated keys are unflattened by the plan for their keys, the same as their
+    dictionary would be by unflatten(), without building the dictionary.
 
-        for idx, index in enumerate(indexes):
-            # Setup some contextual vars
-            prev_idx = indexes[idx - 1] if idx > 0 else root_key
-            is_last = idx == len(indexes) - 1
-            path = (root_key, *indexes[: idx + 1])
-            is_list = index is None
-
-            # Empty-square-bracket cases, item[] => value
-            if is_list:
-                # Replace previous item with a list
-                # TODO: If root was set to a value/map earlier, this will overwrite root. Unsure how to handle - error?
-                if not isinstance(root, list):
-                    root = parent
-                    assert prev_idx is not None
-                    root[prev_idx] = []
-                    # Capture path for restructuring later
-                    list_paths.append(path[:-1])  # type: ignore[arg-type]
-
-                # Don't change parent as we've replaced it
-                root = parent[prev_idx]
-                root_is_list = True
-
-                # Handle root_key[...][] = value
-                if is_last:
-                    assert isinstance(root, list) and root_is_list
-                    root.extend(value) if isinstance(value, list) else root.append(
-                        value
-                    )
+    """
 
-                continue
+    if limits is not None:
+        limits.check_key_count(len(pairs))
+    if plan_cache is None:
+        plan_cache = get_default_plan_cache(key_syntax)
+
+    # Plans are only compiled for keys that aren't repeated, so a cached plan means they aren't
+    signature = tuple(key for key, _ in pairs)
+    plan = plan_cache.get(signature)
+    if plan is None and len(set(signature)) == len(signature):
+        plan = compile_plan(
+            signature, key_cache=key_cache, key_syntax=key_syntax, limits=limits
+        )
+        if plan is None:
+            plan = False
+        plan_cache.set(signature, plan)
+
+    if plan is not None and plan is not False:
+        return _replay(
+            plan,
+            [value for _, value in pairs],
+            limits=limits,
+            sparse_lists=sparse_lists,
+            columns=columns,
+        )
+
+    unflattener = Unflattener(
+        key_cache=key_cache,
+        key_syntax=key_syntax,
+        limits=limits,
+        sparse_lists=sparse_lists,
+        columns=columns,
+    )
+    for key, value in pairs:
+        unflattener.add_pair(key, value)
+
+    return unflattener.result()
+
+
+class _ListSite:
+    """
+    A list created from empty square brackets, e.g. emails[] or users[][name]
+
+    """
 
-            assert index is not None
+    __slots__ = ("adopted", "columns", "container", "items", "name", "rows", "values")
+
+    def __init__(
+        self, container: dict[str, Any], name: str, items: list[Any], adopted: bool
+    ):
+        # The list in the nested structure, and where it was set
+        self.container = container
+        self.name = name
+        self.items = items
+        # Whether the list was given as a value, rather than created from a key
+        self.adopted = adopted
+        # The number of values received for each field of users[][field]
+        self.columns: dict[tuple[str, ...], int] = {}
+        # Objects created for users[][field], in the order they were added to items
+        self.rows: list[dict[str, Any]] = []
+        # The values of each field of users[][field], while they're kept as columns
+        self.values: dict[str, list[Any]] | None = None
+
+
+class Unflattener:
+    """
+    Builds a nested structure from flat key/value pairs in a single pass
+
+    Lists and objects are created in their final positions as each key is added, so there is no
+    intermediate structure to restructure or copy afterwards. Only the objects created from keys,
+    and values that are objects or lists themselves, are revisited by result() to turn those with
+    sequential keys into lists.
 
-            # Named square-bracket cases, item[...][key] => value
-            if root_is_list and is_last:
-                # Create mapping to append to list
-                obj = {}
+    The same rules as unflatten() apply, and limits are checked as each key is added.
 
-                # Wrap item in a list here, for consistency when restructuring
-                if not isinstance(value, list):
-                    value = [value]
+    """
 
-                obj[index] = value
-                assert isinstance(root, list) and root_is_list
-                root.append(obj)
+    def __init__(
+        self,
+        *,
+        key_cache: KeyCache | None = None,
+        key_syntax: KeySyntax | None = None,
+        limits: Limits | None = None,
+        sparse_lists: SparseLists = "object",
+        columns: ColumnsMode = False,
+    ):
+        if key_cache is None:
+            key_cache = get_default_key_cache(key_syntax)
+        self.key_cache = key_cache
+        self.key_syntax = key_syntax
+        self.limits = limits
+        self.sparse_lists = sparse_lists
+        self.columns = columns
+        # Keys are no longer cached once there are more than the cache holds
+        self._parsed = 0
+
+        # The pairs given to add_unique(), and the keys of them that added to lists
+        self._pairs: dict[str, Any] = {}
+        self._listed: set[str] = set()
+        # Whether a key that added to a list was repeated, so the result is built from _pairs
+        self._rebuild = False
+
+        self._reset()
+
+    def _reset(self) -> None:
+        self.key_count = 0
+
+        # The nested dictionary we're building
+        self.nested: dict[str, Any] = {}
+
+        # Objects created from named indexes, with the container and key they were set at
+        self._maps: list[tuple[dict[str, Any], str, dict[str, Any]]] = []
+        self._map_ids: set[int] = set()
+        # The list position of each index seen, so each is only converted once
+        self._positions: dict[str, int | None] = {}
+        # Lists created from empty indexes, by the id of the list
+        self._lists: dict[int, _ListSite] = {}
+        # Values that are objects or lists, with the container and key they were set at
+        self._values: list[tuple[dict[str, Any], str, Any]] = []
+        # Where values for keys given to add_pair() were set, and whether they are a list yet
+        self._repeated: dict[str, tuple[dict[str, Any], str, bool]] = {}
+
+    def add(self, key: str, value: Any) -> None:
+        self._add(key, value)
+
+    def add_unique(self, key: str, value: Any) -> None:
+        """
+        Adds a key of a JSON object, replacing the value of the same key added before, as
+        json.loads() does with repeated keys
+
+        Values added to a list, e.g. for emails[], can't be taken back out, so the pairs are kept
+        (sharing their values), and if a key like that is repeated, the result is built from the
+        last value of each key instead.
+
+        """
+
+        pairs = self._pairs
+        repeated = key in pairs
+        pairs[key] = value
+
+        if self._rebuild:
+            if self.limits is not None:
+                self.limits.check_key_count(len(pairs))
+            return
+
+        if repeated and key in self._listed:
+            self._rebuild = True
+            return
+
+        if self._add(key, value) is None:
+            self._listed.add(key)
+
+    def add_pair(self, key: str, value: Any) -> None:
+        """
+        Adds a key that may be repeated, as sent by HTTP form encoders
+
+        Values for a repeated key are collected into a list, the same as they would be given to
+        unflatten(). Repeated list keys like emails[] and users[][name] add to the list.
+
+        """
+
+        repeated = self._repeated.get(key)
+        if repeated is None:
+            location = self._add(key, value)
+            if location is not None:
+                self._repeated[key] = (*location, False)
+            return
+
+        container, name, is_list = repeated
+        if self.limits is not None:
+            self.key_count += 1
+            self.limits.check_key_count(self.key_count)
+            self.limits.check_list_length(
+                key, len(container[name]) + 1 if is_list else 2
+            )
+
+        if is_list:
+            container[name].append(value)
+        else:
+            self._set(container, name, [container[name], value])
+            self._repeated[key] = (container, name, True)
+
+    def _add(self, key: str, value: Any) -> tuple[dict[str, Any], str] | None:
+        """
+        Adds a key, returning where its value was set, unless it was added to a list
+
+        """
+
+        self._parsed += 1
+        if self._parsed > self.key_cache.maxsize:
+            self.key_cache = no_key_cache
 
-                continue
+        # Get the root key (before square brackets) and indices
+        root_key, indexes = parse_key_cached(key, self.key_cache, self.key_syntax)
+
+        limits = self.limits
+        if limits is not None:
+            self.key_count += 1
+            limits.check_key_count(self.key_count)
+            limits.check_key(key, indexes)
+
+        # Return invalid keys like `[address][postcode]` as-is
+        if root_key is None:
+            self._set(self.nested, key, value)
+            return self.nested, key
 
-            # Create a new map
-            if index not in root:
-                root[index] = {}
+        container = self.nested
+        name = root_key
+        for idx, index in enumerate(indexes):
+            # Empty-square-bracket cases, item[] => value and item[][key] => value
+            if index is None:
+                site = self._list(container, name)
+                fields = indexes[idx + 1 :]
+
+                if len(fields) == 0:
+                    self._to_rows(site)
+                    if limits is not None:
+                        added = len(value) if isinstance(value, list) else 1
+                        limits.check_list_length(name, len(site.items) + added)
+
+                    if isinstance(value, list):
+                        site.items.extend(value)
+                    else:
+                        site.items.append(value)
+                    return None
+
+                if None in fields:
+                    raise KeyConflict(
+                        f"{key!r} has a list within a list, which is not supported"
+                    )
 
-            # Use the map going forward
-            if not is_last:
-                parent = root
-                root = root[index]
+                self._add_column(site, cast(tuple[str, ...], fields), value)
+                return None
+
+            # Named square-bracket cases, item[key] => value
+            container = self._map(container, name)
+            name = index
+
+        # Simple key => value, or item[key] = value
+        self._set(container, name, value)
+        return container, name
+
+    def result(self) -> dict[str, Any] | list[Any]:
+        if self._rebuild:
+            self._rebuild = False
+            self._reset()
+            for key, value in self._pairs.items():
+                self._add(key, value)
+
+        # Lists of lists, e.g. grid[][0], aren't kept as columns
+        for site in self._lists.values():
+            if site.values is not None and is_sequential(site.values):
+                self._to_rows(site)
+
+        # Skip lists that were replaced by a later key
+        sites = [
+            site
+            for site in self._lists.values()
+            if site.container.get(site.name) is site.items
+        ]
+
+        # Objects in lists, i.e. users[][name], must have a value for each field
+        for site in sites:
+            if not all_equal(site.columns.values()):
+                raise KeyConflict(
+                    f"objects in {site.name!r} have mismatching item counts"
+                )
+
+            # Placed before objects that contain them may be turned into lists
+            if site.values is not None:
+                site.container[site.name] = _make_columns(site.values, self.columns)
+
+        for container, name, value in self._values:
+            if container.get(name) is value:
+                container[name] = _keys_to_list(value)
+
+        for site in sites:
+            if not site.rows:
+                # Lists of values may contain objects or lists themselves
+                if any(isinstance(item, (Mapping, list)) for item in site.items):
+                    items = site.items if site.adopted else restructure_list(site.items)
+                    site.items[:] = [_keys_to_list(item) for item in items]
                 continue
 
-            # Set the map value, item[key] = value
-            root[index] = value
-
-    # Restructure lists of objects into multiple objects
-    for path in list_paths:
-        # Get the list of objects from the nested dictionary
-        nested_root: dict[str, Any] = nested
-        target: list[dict[str, Any]]
-        # Container is the object that contains this list, and the key it is set to
-        # TODO: This probably doesn't work with root[][][key] paths (but should it?)
-        container: dict[str, Any] = {}
-        container_key: str = ""
-        for idx, part in enumerate(path):
-            # Capture container
-            if idx == len(path) - 1:
-                container = nested_root
-                container_key = part
-            nested_root = nested_root[part]
-
-        if not isinstance(nested_root, list):
-            # TODO: Raise warning
-            continue
+            # Values added to the same list as objects, e.g. emails[] and emails[][address]
+            if len(site.rows) < len(site.items):
+                rows = {id(row) for row in site.rows}
+                site.items[:] = [
+                    item if id(item) in rows else _keys_to_list(item)
+                    for item in site.items
+                ]
+
+        # Convert objects with numeric keys to lists, innermost first
+        for container, name, node in reversed(self._maps):
+            if container.get(name) is node:
+                as_list = self._map_to_list(name, node)
+                if as_list is not None:
+                    container[name] = as_list
+
+        for site in sites:
+            # Each object has the same fields, so checking the first is enough
+            if site.rows and is_sequential(site.rows[0]):
+                rows = {id(row) for row in site.rows}
+                site.items[:] = [
+                    list(item.values()) if id(item) in rows else item
+                    for item in site.items
+                ]
+
+        if is_sequential(self.nested):
+            return list(self.nested.values())
+
+        return self.nested
+
+    def _set(self, container: dict[str, Any], name: str, value: Any) -> None:
+        container[name] = value
+
+        if isinstance(value, (dict, list)):
+            self._values.append((container, name, value))
+
+    def _map_to_list(self, name: str, node: dict[str, Any]) -> list[Any] | None:
+        """
+        Returns the list an object created from indexes makes, if its keys are all numeric
+
+        """
+
+        positions = []
+        sequential = True
+        for count, key in enumerate(node):
+            position = self._position(key)
+            if position is None:
+                return None
+            sequential = sequential and position == count
+            positions.append(position)
+
+        if not positions:
+            return None
+        if sequential:
+            return list(node.values())
+
+        # Numeric keys that are out of order or have gaps follow the sparse list policy
+        if self.sparse_lists == "object":
+            return None
+
+        length = max(positions) + 1
+        _check_sparse(name, len(positions), length, self.sparse_lists, self.limits)
+
+        if self.sparse_lists == "pad":
+            items: list[Any] = [None] * length
+            for position, value in zip(positions, node.values()):
+                items[position] = value
+            return items
+
+        ordered = sorted(zip(positions, node.values()), key=lambda item: item[0])
+        return [value for _, value in ordered]
+
+    def _position(self, index: str) -> int | None:
+        try:
+            return self._positions[index]
+        except KeyError:
+            position = self._positions[index] = index_position(index)
+            return position
+
+    def _map(self, container: dict[str, Any], name: str) -> dict[str, Any]:
+        node = container.get(name)
+
+        if isinstance(node, dict) and id(node) in self._map_ids:
+            return node
 
-        target = nested_root
+        if node is not None and not isinstance(node, dict):
+            raise KeyConflict(
+                f"cannot set keys on {name!r}, it is already a value or list"
+            )
 
-        # Restructure the list into a list of objects
-        container[container_key] = restructure_list(target)
+        new_node: dict[str, Any] = {}
+        container[name] = new_node
+        self._maps.append((container, name, new_node))
+        self._map_ids.add(id(new_node))
 
-    # Post-process the data to convert sequential 0-indexed integer keys to list
-    nested = sequential_keys_to_list(nested)
+        # An object given as a value, e.g. `address` before `address[city]`, is extended
+        if node is not None:
+            for key, value in node.items():
+                self._set(new_node, key, value)
 
-    return nested
+        return new_node
+
+    def _list(self, container: dict[str, Any], name: str) -> _ListSite:
+        node = container.get(name)
+
+        if isinstance(node, list):
+            site = self._lists.get(id(node))
+            if site is not None:
+                return site
+
+        # A list given as a value, e.g. `emails` before `emails[]`, is extended, and
+        # anything else at this key is replaced with a list
+        if isinstance(node, list):
+            site = _ListSite(container, name, list(node), adopted=True)
+        else:
+            site = _ListSite(container, name, [], adopted=False)
+        container[name] = site.items
+        self._lists[id(site.items)] = site
+        return site
+
+    def _add_column(self, site: _ListSite, fields: tuple[str, ...], value: Any) -> None:
+        values = value if isinstance(value, list) else [value]
+
+        start = site.columns.get(fields, 0)
+        if self.limits is not None:
+            self.limits.check_list_length(site.name, start + len(values))
+
+        # With columns, values are kept by field unless the list turns out to need objects
+        if self.columns and len(fields) == 1:
+            if site.values is None and not site.items:
+                site.values = {}
+            if site.values is not None:
+                site.values.setdefault(fields[0], []).extend(values)
+                site.columns[fields] = start + len(values)
+                return
+
+        self._to_rows(site)
+        self._add_rows(site, fields, values, start)
+
+    def _to_rows(self, site: _ListSite) -> None:
+        """
+        Creates the objects for values that were kept as columns
+
+        """
+
+        if site.values is None:
+            return
+
+        field_values = site.values
+        site.values = None
+        for field, values in field_values.items():
+            self._add_rows(site, (field,), values, 0)
+
+    def _add_rows(
+        self, site: _ListSite, fields: tuple[str, ...], values: list[Any], start: int
+    ) -> None:
+        for idx, item in enumerate(values, start=start):
+            # Create an object when a field has more values than there are objects
+            if idx == len(site.rows):
+                row: dict[str, Any] = {}
+                site.rows.append(row)
+                site.items.append(row)
+
+            # Set the value at users[][name][title] => row["name"]["title"]
+            container = site.rows[idx]
+            for field in fields[:-1]:
+                container = self._map(container, field)
+            self._set(container, fields[-1], item)
+
+        site.columns[fields] = start + len(values)
 
 
 def sequential_keys_to_list(data: dict[str, Any]) -> dict[str, Any]:
@@ -234,67 +1012,78 @@ def sequential_keys_to_list(data: dict[str, Any]) -> dict[str, Any]:
 
     """
 
-    def walk(node_: Any) -> Any:
-        node = copy.copy(node_)
-
-        if isinstance(node, dict):
-            # If all keys are 0-indexed, sequential integers, convert to list
-            is_digits = all(k.isdigit() for k in node.keys())
-            is_0_indexed = len(node.keys()) and list(node.keys())[0] == "0"
-            is_sequential = list(node.keys()) == list(map(str, range(len(node.keys()))))
-
-            if all([is_digits, is_0_indexed, is_sequential]):
-                return list(walk(list(node.values())))
+    result = _keys_to_list(data)
+    assert isinstance(result, dict)
+    return result
 
-            for k, v in node.items():
-                node[k] = walk(v)
 
-            return node
+def _keys_to_list(node: Any) -> Any:
+    """
+    Converts the objects within node that have sequential numeric keys into lists
 
-        if isinstance(node, list):
-            return [walk(v) for v in node]
+    Objects and lists are only rebuilt if something within them is converted, otherwise they're
+    returned as they are, so values without numeric keys aren't copied.
 
-        return node
+    """
 
-    result = walk(data)
-    assert isinstance(result, dict)
-    return result
+    if isinstance(node, dict):
+        # If all keys are 0-indexed, sequential integers, convert to list
+        if is_sequential(node):
+            return [_keys_to_list(v) for v in node.values()]
+
+        result = node
+        for k, v in node.items():
+            converted = _keys_to_list(v)
+            if converted is not v:
+                if result is node:
+                    result = dict(node)
+                result[k] = converted
+        return result
+
+    if isinstance(node, list):
+        items = node
+        for idx, v in enumerate(node):
+            converted = _keys_to_list(v)
+            if converted is not v:
+                if items is node:
+                    items = list(node)
+                items[idx] = converted
+        return items
+
+    return node
 
 
 def restructure_list(target: list[Any]) -> list[dict[str, Any]]:
-    # If this is a list of scalar values, we don't need to restructure
-    if not all(isinstance(obj, Mapping) for obj in target):
+    # If this is empty, or a list of scalar values, we don't need to restructure
+    if not target or not all(isinstance(obj, Mapping) for obj in target):
         return target
 
     # Each obj in target will be an map with one key and a list of values
 
+    # Check that all lists are the same length, before building them
+    counts: dict[str, int] = {}
+    for obj in target:
+        for key, value in obj.items():
+            try:
+                counts[key] = counts.get(key, 0) + len(value)
+            except TypeError:
+                raise KeyConflict(
+                    f"objects in list must have a list of values for {key!r}"
+                ) from None
+
+    if not all_equal(counts.values()):
+        raise KeyConflict("objects in list have mismatching item counts")
+
     # Compose each obj into a single map
     # Duplicates are supported, but shouldn't be common
-    key_values: dict[str, list[str]] = {}
+    key_values: dict[str, list[Any]] = {key: [] for key in counts}
     for obj in target:
         for key, value in obj.items():
-            if key not in key_values:
-                key_values[key] = []
             key_values[key].extend(value)
 
-    # Sanity check that all lists are the same length
-    # TODO: Raise error?
-    assert all_equal(
-        [len(values) for values in key_values.values()]
-    ), "objects in list have mismatching item counts"
-
-    # Get the number of resulting objects
-    item_count = len(list(key_values.values())[0])
-
     # Create a new object with its associated keys
-    objs = []
-    for idx in range(item_count):
-        obj = {}
-        for key, values in key_values.items():
-            obj[key] = values[idx]
-        objs.append(obj)
-
-    return objs
+    keys = list(key_values)
+    return [dict(zip(keys, row)) for row in zip(*key_values.values())]
 
 
 T = TypeVar("T")
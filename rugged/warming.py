@@ -0,0 +1,176 @@
+"""
+Precompiling unflatten plans for the body models of a FastAPI app
+
+The first request with a new shape of body pays for parsing its keys and compiling its plan.
+After a deploy, every shape is new, so the keys a route's body model expects are derived from
+the model instead, and compiled before the first request arrives:
+
+-   fields are named keys, e.g. title
+-   nested models are named square brackets, e.g. address[city]
+-   lists of values are postfix empty square brackets, e.g. emails[]
+-   lists of models are prefix empty square brackets, e.g. items[][qty]
+
+Clients that send the fields of a model in the order they're declared then hit the caches on
+their first request.
+
+Requires fastapi to be installed.
+
+"""
+
+import types
+from collections.abc import Iterator, Sequence
+from typing import Annotated, Any, Union, get_args, get_origin
+
+from fastapi import FastAPI
+from fastapi.dependencies.models import Dependant
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from .dependencies import dependency_models
+
+# Models nested deeper than this, e.g. by referring to themselves, are left out
+MAX_DEPTH = 8
+
+_LISTS = (list, tuple, set, frozenset, Sequence)
+
+__all__ = ["app_body_models", "app_shapes", "model_keys", "model_shapes"]
+
+
+def app_shapes(app: FastAPI) -> list[tuple[str, ...]]:
+    """
+    Returns the flat keys expected by the body models of each route of app
+
+    """
+
+    shapes: dict[tuple[str, ...], None] = {}
+    for model in app_body_models(app):
+        for shape in model_shapes(model):
+            shapes[shape] = None
+    return list(shapes)
+
+
+def app_body_models(app: FastAPI) -> list[type[BaseModel]]:
+    """
+    Returns the models of the body parameters, and Unflattened[Model] dependencies, of each
+    route of app
+
+    """
+
+    models: dict[type[BaseModel], None] = {}
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+
+        if route.body_field is not None:
+            model = _unwrap(route.body_field.field_info.annotation)
+            if _is_model(model):
+                models[model] = None
+
+        for model in _dependency_models(route.dependant):
+            models[model] = None
+
+    return list(models)
+
+
+def _dependency_models(dependant: Dependant) -> Iterator[type[BaseModel]]:
+    for dependency in dependant.dependencies:
+        model = dependency_models.get(dependency.call) if dependency.call else None
+        if model is not None and _is_model(_unwrap(model)):
+            yield _unwrap(model)
+        yield from _dependency_models(dependency)
+
+
+def model_shapes(model: type[BaseModel]) -> list[tuple[str, ...]]:
+    """
+    Returns the flat keys of a body for model: with every field, and with only the required
+    fields if there are optional ones
+
+    """
+
+    shapes = [tuple(model_keys(model))]
+    required = tuple(model_keys(model, required=True))
+    if required and required != shapes[0]:
+        shapes.append(required)
+    return shapes
+
+
+def model_keys(
+    model: type[BaseModel], prefix: str = "", *, required: bool = False
+) -> list[str]:
+    """
+    Returns the flat keys of a body for model, e.g. ["title", "items[][item]"]
+
+    Fields that can't be sent as flat keys, such as dictionaries and lists within lists of
+    models, are left out.
+
+    """
+
+    keys: list[str] = []
+    _add_model(keys, model, prefix, required, in_list=False, depth=0)
+    return keys
+
+
+def _add_model(
+    keys: list[str],
+    model: type[BaseModel],
+    prefix: str,
+    required: bool,
+    in_list: bool,
+    depth: int,
+) -> None:
+    if depth > MAX_DEPTH:
+        return
+
+    for name, field in model.model_fields.items():
+        if required and not field.is_required():
+            continue
+
+        name = field.alias or name
+        key = f"{prefix}[{name}]" if prefix or in_list else name
+        annotation = _unwrap(field.annotation)
+
+        if _is_model(annotation):
+            _add_model(keys, annotation, key, required, in_list, depth + 1)
+            continue
+
+        origin = get_origin(annotation)
+        if origin is dict or annotation is dict:
+            continue
+
+        if origin in _LISTS or annotation in _LISTS:
+            # Lists within lists of models can't be sent as flat keys
+            if in_list:
+                continue
+
+            args = get_args(annotation)
+            item = _unwrap(args[0]) if args else Any
+            if _is_model(item):
+                _add_model(keys, item, f"{key}[]", required, True, depth + 1)
+            else:
+                keys.append(f"{key}[]")
+            continue
+
+        keys.append(key)
+
+
+def _unwrap(annotation: Any) -> Any:
+    """
+    Returns the type within Annotated and Optional annotations
+
+    """
+
+    while True:
+        origin = get_origin(annotation)
+        if origin is Annotated:
+            annotation = get_args(annotation)[0]
+        elif origin is Union or origin is types.UnionType:
+            args = [arg for arg in get_args(annotation) if arg is not type(None)]
+            if len(args) != 1:
+                return annotation
+            annotation = args[0]
+        else:
+            return annotation
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
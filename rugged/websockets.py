@@ -0,0 +1,118 @@
+"""
+Unflattening JSON messages received over WebSockets
+
+"""
+
+from typing import Any, Literal
+
+from starlette.exceptions import WebSocketException
+from starlette.types import Message, Receive
+
+from .caching import LRUCache
+from .keys import KeyCache, has_nested_keys
+from .limits import LimitExceeded
+from .options import MiddlewareOptions
+from .plans import PlanCache, UnflattenPlan
+from .receivers import may_have_nested_keys
+from .unflatteners import apply_plan, derive, get_plan
+
+# The sizes of the caches kept for each WebSocket connection
+WEBSOCKET_KEY_CACHE_SIZE = 256
+WEBSOCKET_PLAN_CACHE_SIZE = 16
+
+# WebSocket close codes for messages that are too large, or have keys that aren't allowed
+WS_1008_POLICY_VIOLATION = 1008
+WS_1009_MESSAGE_TOO_BIG = 1009
+
+__all__ = ["WebSocketReceiver"]
+
+
+class WebSocketReceiver:
+    """
+    Wraps the receive channel of a WebSocket connection, to unflatten each JSON text message
+
+    A connection usually sends messages of the same shape over and over, e.g. the same form
+    submitted by the htmx ws extension, so each connection keeps its own caches of parsed keys
+    and plans, and reuses the plan of the last message while the keys stay the same. Messages
+    that aren't JSON objects with keys to unflatten are passed on as they were sent.
+
+    Messages that exceed the limits in options close the connection, by raising a
+    WebSocketException to the app.
+
+    """
+
+    def __init__(self, options: MiddlewareOptions, receive: Receive):
+        self.options = options
+        self.receive = receive
+
+        self.key_cache: KeyCache = LRUCache(maxsize=WEBSOCKET_KEY_CACHE_SIZE)
+        self.plan_cache: PlanCache = LRUCache(maxsize=WEBSOCKET_PLAN_CACHE_SIZE)
+        self.signature: tuple[str, ...] | None = None
+        self.plan: UnflattenPlan | Literal[False] = False
+
+    async def __call__(self) -> Message:
+        message = await self.receive()
+        if message["type"] != "websocket.receive" or message.get("text") is None:
+            return message
+
+        text = message["text"].encode()
+        options = self.options
+        if options.max_body_size is not None and len(text) > options.max_body_size:
+            raise WebSocketException(WS_1009_MESSAGE_TOO_BIG, "Message too large")
+
+        if not may_have_nested_keys(text, options.key_syntax):
+            return message
+
+        try:
+            data = options.codec.decode(text)
+        except ValueError:
+            return message
+
+        if not (isinstance(data, dict) and has_nested_keys(data, options.key_syntax)):
+            return message
+
+        try:
+            data = self.unflatten(data)
+        except LimitExceeded as exc:
+            code = (
+                WS_1009_MESSAGE_TOO_BIG
+                if exc.status_code == 413
+                else WS_1008_POLICY_VIOLATION
+            )
+            raise WebSocketException(code, str(exc)) from exc
+
+        return {**message, "text": options.codec.encode(data).decode()}
+
+    def unflatten(self, data: dict[str, Any]) -> Any:
+        options = self.options
+        if options.limits is not None:
+            options.limits.check_key_count(len(data))
+
+        signature = tuple(data)
+        if signature != self.signature:
+            self.plan = get_plan(
+                signature,
+                key_cache=self.key_cache,
+                key_syntax=options.key_syntax,
+                plan_cache=self.plan_cache,
+                limits=options.limits,
+            )
+            self.signature = signature
+
+        if self.plan is not False:
+            return apply_plan(
+                self.plan,
+                data,
+                limits=options.limits,
+                sparse_lists=options.sparse_lists,
+                columns=options.columns,
+            )
+
+        return derive(
+            data,
+            key_cache=self.key_cache,
+            key_syntax=options.key_syntax,
+            limits=options.limits,
+            sparse_lists=options.sparse_lists,
+            columns=options.columns,
+        )
@@ -0,0 +1,45 @@
+import pytest
+
+from rugged.bodies import BodyBuffer, BodyTooLarge
+
+
+def test_body_buffer_fills_content_length() -> None:
+    buffer = BodyBuffer(content_length=10)
+
+    buffer.write(b"01234")
+    buffer.write(b"56789")
+
+    assert buffer.getvalue() == b"0123456789"
+
+
+def test_body_buffer_shorter_than_content_length() -> None:
+    buffer = BodyBuffer(content_length=10)
+
+    buffer.write(b"01234")
+
+    assert buffer.getvalue() == b"01234"
+
+
+@pytest.mark.parametrize("content_length", [None, 100])
+def test_body_buffer_spools_large_bodies(content_length: int | None) -> None:
+    buffer = BodyBuffer(content_length=content_length, spool_size=16)
+
+    for _ in range(10):
+        buffer.write(b"0123456789")
+
+    assert buffer.getvalue() == b"0123456789" * 10
+    # The spool is closed once it has been read
+    assert buffer._spool is not None and buffer._spool.closed
+
+
+def test_body_buffer_rejects_content_length_over_max_size() -> None:
+    with pytest.raises(BodyTooLarge):
+        BodyBuffer(content_length=101, max_size=100)
+
+
+def test_body_buffer_rejects_writes_over_max_size() -> None:
+    buffer = BodyBuffer(max_size=15, spool_size=4)
+
+    buffer.write(b"0123456789")
+    with pytest.raises(BodyTooLarge):
+        buffer.write(b"0123456789")
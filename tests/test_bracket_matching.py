@@ -1,4 +1,7 @@
-from rugged.unflatteners import parse_key
+import pytest
+
+from rugged.limits import LimitExceeded
+from rugged.unflatteners import KeySyntax, parse_key
 
 
 def test_find_square_bracket_pairs() -> None:
@@ -15,3 +18,46 @@ def test_broken_brackets() -> None:
     assert parse_key("address[road") == ("address[road", [])
     assert parse_key("address]city[") == ("address]city[", [])
     assert parse_key("[address][postcode]") == (None, ["address", "postcode"])
+
+
+def test_malformed_brackets() -> None:
+    assert parse_key("address[city]road") == ("address[city]road", [])
+    assert parse_key("address[home[city]") == ("address[home[city]", [])
+    assert parse_key("address[city][") == ("address[city][", [])
+    assert parse_key("address]home[city]") == ("address]home[city]", [])
+    # Closing brackets are only unmatched if the key has square brackets
+    assert parse_key("address]home") == ("address]home", [])
+
+
+def test_dotted_keys() -> None:
+    syntax = KeySyntax("dotted")
+
+    assert parse_key("results.0.name", syntax) == ("results", ["0", "name"])
+    assert parse_key("created_at", syntax) == ("created_at", [])
+    assert parse_key("contacts[name]", syntax) == ("contacts[name]", [])
+    assert parse_key("results..name", syntax) == ("results..name", [])
+    assert parse_key("results.", syntax) == ("results.", [])
+
+
+def test_mixed_keys() -> None:
+    syntax = KeySyntax("mixed")
+
+    assert parse_key("results[0].name", syntax) == ("results", ["0", "name"])
+    assert parse_key("results.0[name]", syntax) == ("results", ["0", "name"])
+    assert parse_key("contacts[].name", syntax) == ("contacts", [None, "name"])
+    assert parse_key("domains[example.com]", syntax) == ("domains", ["example.com"])
+    assert parse_key("results[0]name", syntax) == ("results[0]name", [])
+    assert parse_key("results.[0]", syntax) == ("results.[0]", [])
+    assert parse_key("results]0[name]", syntax) == ("results]0[name]", [])
+
+
+@pytest.mark.parametrize(
+    "key", ["address]city[", "address]home[city]", "[address][postcode]", "a..b"]
+)
+def test_reject_malformed_keys(key: str) -> None:
+    syntax = KeySyntax("mixed", reject_malformed=True)
+
+    with pytest.raises(LimitExceeded) as exc:
+        parse_key(key, syntax)
+
+    assert exc.value.status_code == 400
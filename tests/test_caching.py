@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+
+from rugged.caching import LRUCache
+from rugged.unflatteners import parse_key_cached, unflatten
+
+
+def test_lru_cache_counts_hits_and_misses() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 1, 0)
+    assert (stats.size, stats.maxsize) == (1, 2)
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Touch "a" so "b" becomes the oldest entry
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.stats().evictions == 1
+
+
+def test_lru_cache_disabled_with_zero_size() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=0)
+
+    cache.set("a", 1)
+
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_lru_cache_rejects_negative_size() -> None:
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=-1)
+
+
+def test_lru_cache_is_thread_safe() -> None:
+    cache: LRUCache[int, int] = LRUCache(maxsize=64)
+
+    def work(n: int) -> None:
+        for i in range(1000):
+            cache.set((n * i) % 200, i)
+            cache.get(i % 200)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+
+    stats = cache.stats()
+    assert stats.size <= 64
+    assert stats.hits + stats.misses == 8000
+
+
+def test_parse_key_cached_interns_results() -> None:
+    cache: LRUCache[str, tuple[str | None, tuple[str | None, ...]]] = LRUCache()
+
+    first = parse_key_cached("items[][qty]", cache)
+    second = parse_key_cached("items[][qty]", cache)
+
+    assert first == ("items", (None, "qty"))
+    assert first is second
+    assert cache.stats().hits == 1
+
+
+def test_unflatten_uses_given_key_cache() -> None:
+    cache: LRUCache[str, tuple[str | None, tuple[str | None, ...]]] = LRUCache()
+    d = {"address[zipcode]": "90210", "emails[]": ["foo@example.com"]}
+
+    # Skip plans, so that keys are parsed every time
+    no_plans: LRUCache[tuple[str, ...], Any] = LRUCache(maxsize=0)
+
+    assert unflatten(d, key_cache=cache, plan_cache=no_plans) == unflatten(
+        d, key_cache=cache, plan_cache=no_plans
+    )
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (2, 2)
+
+
+def test_keys_of_bodies_larger_than_the_key_cache_are_not_cached() -> None:
+    cache: LRUCache[str, tuple[str | None, tuple[str | None, ...]]] = LRUCache(
+        maxsize=4
+    )
+    no_plans: LRUCache[tuple[str, ...], Any] = LRUCache(maxsize=0)
+
+    unflatten({"a[b]": 1, "c[d]": 2}, key_cache=cache, plan_cache=no_plans)
+    unflatten(
+        {f"items[{i}][name]": i for i in range(10)},
+        key_cache=cache,
+        plan_cache=no_plans,
+    )
+
+    # The keys of the smaller body weren't evicted by those of the larger one
+    assert "a[b]" in cache and "c[d]" in cache
+    assert len(cache) == 2
@@ -0,0 +1,81 @@
+import json
+import math
+
+import pytest
+
+from rugged.codecs import CODECS, StdlibCodec, decode_pairs, get_codec
+
+DATA = {
+    "title": "Sofrito time",
+    "items": [{"item": "carrots", "qty": 1}, {"item": "célery", "qty": 1.5}],
+    "notes": None,
+}
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_codec_round_trip(name: str) -> None:
+    if name != "json":
+        pytest.importorskip(name)
+
+    codec = get_codec(name)
+    encoded = codec.encode(DATA)
+
+    assert isinstance(encoded, bytes)
+    assert codec.decode(encoded) == DATA
+    assert codec.decode(bytearray(encoded)) == DATA
+
+
+def test_auto_codec_prefers_installed_libraries() -> None:
+    codec = get_codec("auto")
+
+    for name in ("orjson", "msgspec"):
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+
+        assert codec.name == name
+        return
+
+    assert isinstance(codec, StdlibCodec)
+
+
+def test_default_codec_is_stdlib() -> None:
+    assert isinstance(get_codec(), StdlibCodec)
+
+
+def test_default_codec_keeps_big_ints_and_nan() -> None:
+    codec = get_codec()
+    data = codec.decode(b'{"id": 123456789012345678901234567890, "score": NaN}')
+
+    assert data["id"] == 123456789012345678901234567890
+    assert math.isnan(data["score"])
+    assert codec.encode(data) == b'{"id":123456789012345678901234567890,"score":NaN}'
+
+
+def test_unknown_codec() -> None:
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+def test_decode_pairs() -> None:
+    body = b'{"emails[]": "foo", "meta": {"a": 1, "a": 2}, "emails[]": "bar"}'
+
+    assert decode_pairs(body) == (
+        None,
+        [("emails[]", "foo"), ("meta", {"a": 2}), ("emails[]", "bar")],
+    )
+
+
+def test_decode_pairs_without_duplicates() -> None:
+    body = b'{"a": 1, "b": {"c": 1, "c": 2}, "d": [{"e": {}}]}'
+
+    assert decode_pairs(body) == (None, [("a", 1), ("b", {"c": 2}), ("d", [{"e": {}}])])
+
+
+@pytest.mark.parametrize("body", [b'[{"a": 1, "a": 2}, {"b": {}}]', b"1", b"null"])
+def test_decode_pairs_of_other_bodies(body: bytes) -> None:
+    data, pairs = decode_pairs(body)
+
+    assert data == json.loads(body)
+    assert pairs is None
@@ -0,0 +1,103 @@
+from typing import Any
+
+import pytest
+
+from rugged.columns import Columns
+from rugged.unflatteners import Unflattener, derive, unflatten
+
+
+def test_unflatten_columns() -> None:
+    result = unflatten(
+        {"users[][id]": [1, 2], "users[][name]": ["foo", "bar"]}, columns=True
+    )
+
+    assert isinstance(result, dict)
+    assert isinstance(result["users"], Columns)
+    assert result == {"users": {"id": [1, 2], "name": ["foo", "bar"]}}
+    assert result["users"].length == 2
+    assert result["users"].to_list() == [
+        {"id": 1, "name": "foo"},
+        {"id": 2, "name": "bar"},
+    ]
+
+
+def test_columns_rows() -> None:
+    columns = Columns({"id": [1, 2, 3], "name": ["foo", "bar", "baz"]}, 3)
+    rows = columns.rows
+
+    assert len(rows) == 3
+    assert rows[0] == {"id": 1, "name": "foo"}
+    assert rows[-1] == {"id": 3, "name": "baz"}
+    assert rows[1:] == [{"id": 2, "name": "bar"}, {"id": 3, "name": "baz"}]
+    assert list(rows) == columns.to_list()
+
+    with pytest.raises(IndexError):
+        rows[3]
+
+
+def test_columns_of_nested_lists() -> None:
+    result = unflatten(
+        {"reports[daily][rows][][n]": [1, 2], "reports[daily][to][]": ["a"]},
+        columns=True,
+    )
+
+    assert result == {"reports": {"daily": {"rows": {"n": [1, 2]}, "to": ["a"]}}}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # Lists of lists are still lists
+        {"grid[][0]": ["a", "b"], "grid[][1]": ["c", "d"]},
+        # Lists of scalar values are still lists
+        {"emails[]": ["foo@example.com", "bar@example.com"]},
+        # Objects with nested fields are still built row by row
+        {"rows[][n]": [1, 2], "rows[][meta][0]": ["a", "b"]},
+    ],
+)
+def test_columns_only_for_objects(data: dict[str, Any]) -> None:
+    assert unflatten(data, columns=True) == unflatten(data)
+
+
+def test_incremental_columns() -> None:
+    unflattener = Unflattener(columns=True)
+    unflattener.add("items[][item]", ["carrots"])
+    unflattener.add("items[][qty]", [1])
+    unflattener.add("items[][item]", "celery")
+    unflattener.add("items[][qty]", 2)
+
+    result = unflattener.result()
+
+    assert isinstance(result, dict)
+    assert isinstance(result["items"], Columns)
+    assert result == {"items": {"item": ["carrots", "celery"], "qty": [1, 2]}}
+
+
+def test_incremental_columns_fall_back_to_rows() -> None:
+    # Values added to a list of objects as a whole need the rows to be built
+    unflattener = Unflattener(columns=True)
+    unflattener.add("items[][item]", ["carrots", "celery"])
+    unflattener.add("items[]", {"item": "leeks"})
+
+    assert unflattener.result() == {
+        "items": [{"item": "carrots"}, {"item": "celery"}, {"item": "leeks"}]
+    }
+
+
+def test_columns_in_numbered_lists() -> None:
+    data = {"b[0][][y]": [1, 2], "b[1]": "v"}
+
+    assert derive(data, columns=True) == unflatten(data, columns=True)
+    assert unflatten(data, columns=True) == {"b": [{"y": [1, 2]}, "v"]}
+
+
+def test_numpy_columns() -> None:
+    numpy = pytest.importorskip("numpy")
+
+    result = unflatten(
+        {"items[][qty]": [1, 2], "items[][price]": [0.5, 1.5]}, columns="numpy"
+    )
+
+    assert isinstance(result, dict)
+    assert isinstance(result["items"]["qty"], numpy.ndarray)
+    assert result["items"]["price"].tolist() == [0.5, 1.5]
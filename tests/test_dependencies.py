@@ -0,0 +1,95 @@
+from typing import Any
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from rugged.codecs import StdlibCodec
+from rugged.dependencies import Unflattened, get_type_adapter
+from rugged.middleware import RuggedMiddleware
+
+
+class ShoppingListItem(BaseModel):
+    item: str
+    qty: int
+
+
+class ShoppingList(BaseModel):
+    title: str
+    items: list[ShoppingListItem]
+
+
+class CountingCodec(StdlibCodec):
+    def __init__(self) -> None:
+        self.encoded = 0
+
+    def encode(self, data: Any) -> bytes:
+        self.encoded += 1
+        return super().encode(data)
+
+
+BODY = {
+    "title": "Sofrito time",
+    "items[][item]": ["carrots", "celery"],
+    "items[][qty]": [1, 2],
+}
+
+
+def make_app(codec: CountingCodec | None = None) -> FastAPI:
+    app = FastAPI()
+    if codec is not None:
+        app.add_middleware(RuggedMiddleware, codec=codec)
+
+    @app.post("/list")
+    async def save_list(shopping_list: Unflattened[ShoppingList]) -> ShoppingList:
+        return shopping_list
+
+    @app.post("/list/body")
+    async def save_list_body(shopping_list: ShoppingList) -> ShoppingList:
+        return shopping_list
+
+    return app
+
+
+def test_unflattened_dependency_skips_reencoding() -> None:
+    codec = CountingCodec()
+    client = TestClient(make_app(codec))
+
+    response = client.post("/list", json=BODY)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "title": "Sofrito time",
+        "items": [{"item": "carrots", "qty": 1}, {"item": "celery", "qty": 2}],
+    }
+    assert codec.encoded == 0
+
+    # Body parameters still need the body re-encoded
+    response = client.post("/list/body", json=BODY)
+
+    assert response.status_code == 200
+    assert codec.encoded == 1
+
+
+def test_unflattened_dependency_validation_errors() -> None:
+    client = TestClient(make_app(CountingCodec()))
+
+    response = client.post("/list", json={**BODY, "items[][qty]": ["one", 2]})
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "items", 0, "qty"]
+
+
+def test_unflattened_dependency_without_middleware() -> None:
+    client = TestClient(make_app())
+
+    response = client.post(
+        "/list", json={"title": "Sofrito time", "items": [{"item": "onions", "qty": 3}]}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [{"item": "onions", "qty": 3}]
+
+
+def test_type_adapters_are_cached() -> None:
+    assert get_type_adapter(ShoppingList) is get_type_adapter(ShoppingList)
@@ -0,0 +1,117 @@
+from typing import Any
+
+import pytest
+
+from rugged.caching import LRUCache
+from rugged.flatteners import NameCache, flatten, iter_flatten
+from rugged.unflatteners import unflatten
+
+SHAPES: list[dict[str, Any]] = [
+    {"action": "signup", "email": "foo@example.com"},
+    {"address": {"zipcode": "90210", "city": "Beverly Hills"}},
+    {"emails": ["foo@example.com", "bar@example.com"]},
+    {"emails": []},
+    {"users": [{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]},
+    {
+        "users": [
+            {"id": 1, "name": {"given": "Foo"}},
+            {"id": 2, "name": {"given": "Bar"}},
+        ]
+    },
+    {"users": [{"id": 1, "tags": ["a"]}, {"id": 2, "tags": ["b", "c"]}]},
+    {"users": [{"id": 1}, {"name": "bar"}]},
+    {"users": [{"name": {"given": "Foo"}}, {"name": {"family": "Bar"}}]},
+    {"grid": [[1, 2], [3]]},
+    {"mixed": [1, {"a": 2}]},
+    {"meta": {}, "rows": [{"meta": {}}, {"meta": {}}]},
+    {"reports": {"daily": {"rows": [{"n": 1}, {"n": 2}], "to": ["a", "b"]}}},
+]
+
+
+@pytest.mark.parametrize("columns", [False, True])
+@pytest.mark.parametrize("data", SHAPES)
+def test_flatten_is_inverse_of_unflatten(data: dict[str, Any], columns: bool) -> None:
+    assert unflatten(flatten(data, columns=columns)) == data
+
+
+def test_flattening_objects() -> None:
+    assert flatten({"address": {"zipcode": "90210", "city": "Beverly Hills"}}) == {
+        "address[zipcode]": "90210",
+        "address[city]": "Beverly Hills",
+    }
+
+
+def test_flattening_lists() -> None:
+    assert flatten({"emails": ["foo@example.com", "bar@example.com"]}) == {
+        "emails[]": ["foo@example.com", "bar@example.com"]
+    }
+
+
+def test_flattening_lists_of_objects() -> None:
+    data = {"users": [{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]}
+
+    assert flatten(data) == {
+        "users[0][id]": 1,
+        "users[0][name]": "foo",
+        "users[1][id]": 2,
+        "users[1][name]": "bar",
+    }
+
+
+def test_flattening_lists_of_objects_into_columns() -> None:
+    data = {
+        "users": [
+            {"id": 1, "name": {"given": "Foo"}},
+            {"id": 2, "name": {"given": "Bar"}},
+        ]
+    }
+
+    assert flatten(data, columns=True) == {
+        "users[][id]": [1, 2],
+        "users[][name][given]": ["Foo", "Bar"],
+    }
+
+
+@pytest.mark.parametrize(
+    "users",
+    [
+        # Rows with different keys
+        [{"id": 1}, {"name": "bar"}],
+        # Nested objects with different keys
+        [{"name": {"given": "Foo"}}, {"name": {"family": "Bar"}}],
+        # Rows with lists
+        [{"id": 1, "tags": ["a"]}, {"id": 2, "tags": ["b"]}],
+    ],
+)
+def test_columns_fall_back_to_numbered_keys(users: list[dict[str, Any]]) -> None:
+    flat = flatten({"users": users}, columns=True)
+
+    assert all(key.startswith(("users[0]", "users[1]")) for key in flat)
+
+
+def test_column_names_are_cached() -> None:
+    name_cache: NameCache = LRUCache()
+    data = {"users": [{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}]}
+
+    first = flatten(data, columns=True, name_cache=name_cache)
+    second = flatten(data, columns=True, name_cache=name_cache)
+
+    assert name_cache.stats().misses == 2
+    assert name_cache.stats().hits == 2
+    assert [id(key) for key in first] == [id(key) for key in second]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_iter_flatten_batches(batch_size: int) -> None:
+    data = {
+        "title": "Bulk order",
+        "items": [{"item": f"item {i}", "qty": i} for i in range(10)],
+        "address": {"city": "London"},
+    }
+
+    batches = list(iter_flatten(data, batch_size=batch_size))
+
+    assert {key: value for batch in batches for key, value in batch.items()} == (
+        flatten(data)
+    )
+    assert all(len(batch) <= batch_size + 1 for batch in batches)
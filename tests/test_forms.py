@@ -0,0 +1,88 @@
+import pytest
+
+from rugged.forms import (
+    Field,
+    FileFieldFound,
+    FormParser,
+    URLEncodedParser,
+    get_form_parser,
+)
+from rugged.unflatteners import Unflattener
+
+
+def parse(parser: FormParser, chunks: list[bytes]) -> list[Field]:
+    fields: list[Field] = []
+    for chunk in chunks:
+        fields.extend(parser.feed(chunk))
+    fields.extend(parser.close())
+    return fields
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_urlencoded_chunks(size: int) -> None:
+    body = b"title=Sofrito+time&items%5B%5D%5Bitem%5D=carrots&empty=&flag"
+    chunks = [body[i : i + size] for i in range(0, len(body), size)]
+
+    assert parse(URLEncodedParser(), chunks) == [
+        ("title", "Sofrito time"),
+        ("items[][item]", "carrots"),
+        ("empty", ""),
+        ("flag", ""),
+    ]
+
+
+def test_urlencoded_unflattens() -> None:
+    body = b"title=List&items[][item]=carrots&items[][qty]=1&items[][item]=celery&items[][qty]=2&tags=a&tags=b"
+
+    unflattener = Unflattener()
+    for key, value in parse(URLEncodedParser(), [body]):
+        unflattener.add_pair(key, value)
+
+    assert unflattener.result() == {
+        "title": "List",
+        "items": [{"item": "carrots", "qty": "1"}, {"item": "celery", "qty": "2"}],
+        "tags": ["a", "b"],
+    }
+
+
+def multipart(parts: list[tuple[str, str, str | None]]) -> bytes:
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--boundary\r\nContent-Disposition: {disposition}\r\n\r\n{value}\r\n".encode()
+    return body + b"--boundary--\r\n"
+
+
+def test_multipart_fields() -> None:
+    pytest.importorskip("python_multipart")
+
+    body = multipart([("title", "List", None), ("items[][item]", "carrots", None)])
+    parser = get_form_parser(b"multipart/form-data; boundary=boundary")
+    assert parser is not None
+
+    assert parse(parser, [body[i : i + 5] for i in range(0, len(body), 5)]) == [
+        ("title", "List"),
+        ("items[][item]", "carrots"),
+    ]
+
+
+def test_multipart_file() -> None:
+    pytest.importorskip("python_multipart")
+
+    body = multipart([("title", "List", None), ("upload", "contents", "list.txt")])
+    parser = get_form_parser(b"multipart/form-data; boundary=boundary")
+    assert parser is not None
+
+    with pytest.raises(FileFieldFound):
+        parse(parser, [body])
+
+
+def test_get_form_parser() -> None:
+    assert isinstance(
+        get_form_parser(b"application/x-www-form-urlencoded; charset=utf-8"),
+        URLEncodedParser,
+    )
+    assert get_form_parser(b"multipart/form-data") is None
+    assert get_form_parser(b"text/plain") is None
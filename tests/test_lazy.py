@@ -0,0 +1,78 @@
+import pytest
+
+from rugged.lazy import LazyUnflattened, group_by_root
+from rugged.limits import LimitExceeded, Limits
+from rugged.unflatteners import unflatten
+
+
+def test_group_by_root() -> None:
+    assert group_by_root(
+        {
+            "action": "save",
+            "items[][qty]": [1],
+            "address[city]": "London",
+            "items[][item]": ["carrots"],
+            "address[road": "main st",
+            "[address][postcode]": "sw1a 1aa",
+        }
+    ) == {
+        "action": {"action": "save"},
+        "items": {"items[][qty]": [1], "items[][item]": ["carrots"]},
+        "address": {"address[city]": "London"},
+        "address[road": {"address[road": "main st"},
+        "[address][postcode]": {"[address][postcode]": "sw1a 1aa"},
+    }
+
+
+def test_lazy_unflatten() -> None:
+    data = {
+        "action": "save",
+        "items[][item]": ["carrots", "celery"],
+        "items[][qty]": [1, 2],
+        "meta[0]": "a",
+        "meta[1]": "b",
+        "0": "zero",
+    }
+
+    result = unflatten(data, lazy=True)
+
+    assert isinstance(result, LazyUnflattened)
+    assert list(result) == ["action", "items", "meta", "0"]
+    assert len(result) == 4
+    assert "items" in result
+    assert dict(result) == unflatten(data)
+
+
+def test_lazy_unflatten_builds_on_access() -> None:
+    # Only the items that are read are checked against the limits
+    result = unflatten(
+        {"action": "discard", "items[]": list(range(100))},
+        limits=Limits(max_list_length=10),
+        lazy=True,
+    )
+
+    assert isinstance(result, LazyUnflattened)
+    assert result["action"] == "discard"
+    assert "items" not in result.built
+
+    with pytest.raises(LimitExceeded):
+        result["items"]
+
+
+def test_lazy_unflatten_caches_values() -> None:
+    result = unflatten({"address[city]": "London"}, lazy=True)
+    assert isinstance(result, LazyUnflattened)
+
+    assert result["address"] is result["address"]
+
+
+def test_lazy_unflatten_of_a_list() -> None:
+    assert unflatten({"0": "a", "1[x]": "b"}, lazy=True) == ["a", {"x": "b"}]
+
+
+def test_lazy_unflatten_is_read_only() -> None:
+    result = unflatten({"address[city]": "London"}, lazy=True)
+    assert isinstance(result, LazyUnflattened)
+
+    with pytest.raises(TypeError):
+        result["address"] = {}  # type: ignore[index]
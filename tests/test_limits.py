@@ -0,0 +1,102 @@
+from typing import Any
+
+import pytest
+
+from rugged.caching import LRUCache
+from rugged.limits import KeyConflict, LimitExceeded, Limits
+from rugged.plans import PlanCache
+from rugged.unflatteners import Unflattener, derive, unflatten
+
+
+def both(data: dict[str, Any], limits: Limits) -> Any:
+    """
+    Unflattens data with a plan and by deriving it, which should agree
+
+    """
+
+    planned = unflatten(data, plan_cache=LRUCache(), limits=limits)
+    derived = derive(data, limits=limits)
+    assert planned == derived
+    return planned
+
+
+def test_within_limits() -> None:
+    data = {
+        "title": "List",
+        "address[home][city]": "London",
+        "items[][item]": ["carrots", "celery"],
+        "items[][qty]": [1, 2],
+        "emails[]": ["foo@example.com"],
+        "tags[1]": "b",
+    }
+    limits = Limits(max_keys=6, max_depth=2, max_list_length=2, max_index=1)
+
+    assert both(data, limits)["items"] == [
+        {"item": "carrots", "qty": 1},
+        {"item": "celery", "qty": 2},
+    ]
+
+
+@pytest.mark.parametrize(
+    "data, limits, status_code",
+    [
+        ({"a": 1, "b": 2, "c": 3}, Limits(max_keys=2), 413),
+        ({"a[b][c][d]": 1}, Limits(max_depth=2), 400),
+        ({"items[][qty]": [1, 2, 3]}, Limits(max_list_length=2), 413),
+        ({"emails[]": [1, 2]}, Limits(max_list_length=1), 413),
+        ({"items[11][qty]": 1}, Limits(max_index=10), 400),
+        ({"items[" + "9" * 5000 + "]": 1}, Limits(max_index=10), 400),
+        # Checked before the key is placed, rather than recursing through each level
+        ({"a" + "[x]" * 2000: 1}, Limits(max_depth=5), 400),
+    ],
+)
+def test_exceeded(data: dict[str, Any], limits: Limits, status_code: int) -> None:
+    with pytest.raises(LimitExceeded) as planned:
+        unflatten(data, plan_cache=LRUCache(), limits=limits)
+    with pytest.raises(LimitExceeded) as derived:
+        derive(data, limits=limits)
+
+    assert planned.value.status_code == derived.value.status_code == status_code
+
+
+def test_leading_zeros_within_limit() -> None:
+    assert both({"items[" + "0" * 5000 + "1]": 1}, Limits(max_index=1)) == {
+        "items": {"0" * 5000 + "1": 1}
+    }
+
+
+def test_cached_plan_checked_against_limits() -> None:
+    plan_cache: PlanCache = LRUCache()
+    data = {"items[][qty]": [1, 2, 3]}
+
+    unflatten(data, plan_cache=plan_cache)
+
+    with pytest.raises(LimitExceeded):
+        unflatten(data, plan_cache=plan_cache, limits=Limits(max_list_length=2))
+
+
+def test_unflattener_fails_fast() -> None:
+    unflattener = Unflattener(limits=Limits(max_keys=2, max_list_length=2))
+    unflattener.add_pair("tags", "a")
+    unflattener.add_pair("tags", "b")
+
+    with pytest.raises(LimitExceeded):
+        unflattener.add_pair("tags", "c")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"users[][a]": [1, 2], "users[][b]": [1]},
+        {"a": 1, "a[b]": 2},
+        {"a[][]": 1},
+        {"emails[]": [{"count": 1}]},
+    ],
+)
+def test_conflicting_keys(data: dict[str, Any]) -> None:
+    with pytest.raises(KeyConflict) as planned:
+        unflatten(data, plan_cache=LRUCache())
+    with pytest.raises(KeyConflict) as derived:
+        derive(data)
+
+    assert planned.value.status_code == derived.value.status_code == 400
@@ -0,0 +1,1239 @@
+import json
+import threading
+from typing import Any
+
+import anyio
+import anyio.lowlevel
+import pytest
+from starlette.exceptions import HTTPException, WebSocketException
+from starlette.types import Message, Receive, Scope, Send
+
+from rugged.codecs import Codec, StdlibCodec
+from rugged.flatteners import flatten
+from rugged.instrumentation import RequestMetrics, server_timing
+from rugged.keys import KeySyntax
+from rugged.limits import Limits
+from rugged.middleware import RuggedMiddleware
+from rugged.receivers import JSONReceiver
+from rugged.routes import Route
+from rugged.unflatteners import unflatten
+from rugged.websockets import WebSocketReceiver
+
+
+def make_scope(headers: dict[str, str], method: str = "POST", path: str = "/") -> Scope:
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+    }
+
+
+def make_receive(chunks: list[bytes]) -> Receive:
+    messages: list[Message] = [
+        {"type": "http.request", "body": chunk, "more_body": idx < len(chunks) - 1}
+        for idx, chunk in enumerate(chunks)
+    ]
+
+    async def receive() -> Message:
+        # Let other requests run between chunks
+        await anyio.lowlevel.checkpoint()
+
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+async def echo_app(scope: Scope, receive: Receive, send: Send) -> None:
+    # Read the whole body, as an ASGI app should
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def call(
+    middleware: RuggedMiddleware,
+    headers: dict[str, str],
+    chunks: list[bytes],
+    path: str = "/",
+) -> tuple[int, bytes]:
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await middleware(make_scope(headers, path=path), make_receive(chunks), send)
+
+    status: int = sent[0]["status"]
+    return status, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def split(body: bytes, size: int) -> list[bytes]:
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+def form_body(rows: int) -> bytes:
+    data: dict[str, Any] = {
+        "title": "Bulk order",
+        "items[][item]": [f"item {i}" for i in range(rows)],
+        "items[][qty]": list(range(rows)),
+    }
+    return json.dumps(data).encode()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("with_length", [True, False])
+async def test_streamed_body(with_length: bool) -> None:
+    body = form_body(100)
+    headers = {"content-type": "application/json"}
+    if with_length:
+        headers["content-length"] = str(len(body))
+
+    status, response = await call(RuggedMiddleware(echo_app), headers, split(body, 64))
+
+    assert status == 200
+    data = json.loads(response)
+    assert data["title"] == "Bulk order"
+    assert data["items"][99] == {"item": "item 99", "qty": 99}
+
+
+@pytest.mark.anyio
+async def test_streamed_body_spooled_to_disk() -> None:
+    body = form_body(1000)
+    headers = {"content-type": "application/json"}
+
+    status, response = await call(
+        RuggedMiddleware(echo_app, spool_size=1024), headers, split(body, 512)
+    )
+
+    assert status == 200
+    assert len(json.loads(response)["items"]) == 1000
+
+
+@pytest.mark.anyio
+async def test_body_too_large_by_content_length() -> None:
+    body = form_body(100)
+    headers = {"content-type": "application/json", "content-length": str(len(body))}
+
+    status, _ = await call(
+        RuggedMiddleware(echo_app, max_body_size=100), headers, [body]
+    )
+
+    assert status == 413
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("chunk_size", [64, 1_000_000])
+async def test_body_too_large_while_streaming(chunk_size: int) -> None:
+    body = form_body(100)
+    headers = {"content-type": "application/json"}
+
+    with pytest.raises(HTTPException) as exc_info:
+        await call(
+            RuggedMiddleware(echo_app, max_body_size=100),
+            headers,
+            split(body, chunk_size),
+        )
+
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_concurrent_requests_are_isolated() -> None:
+    middleware = RuggedMiddleware(echo_app)
+    results: dict[int, tuple[int, bytes]] = {}
+
+    async def request(n: int) -> None:
+        body = json.dumps({"id": n, "items[][qty]": list(range(n % 7 + 1))}).encode()
+        headers = {"content-type": "application/json"}
+        results[n] = await call(middleware, headers, split(body, 8))
+
+    async with anyio.create_task_group() as tg:
+        for n in range(500):
+            tg.start_soon(request, n)
+
+    for n, (status, response) in results.items():
+        assert status == 200
+        assert json.loads(response) == {
+            "id": n,
+            "items": [{"qty": i} for i in range(n % 7 + 1)],
+        }
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "scope",
+    [
+        {"type": "lifespan"},
+        {"type": "websocket", "path": "/", "headers": []},
+        make_scope({"content-type": "application/json"}, method="GET"),
+        make_scope({"content-type": "application/x-www-form-urlencoded"}),
+        make_scope({}),
+    ],
+)
+async def test_passthrough_is_untouched(scope: Scope) -> None:
+    received: list[Receive] = []
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        received.append(receive)
+
+    receive = make_receive([b"{}"])
+
+    async def send(message: Message) -> None:
+        pass
+
+    await RuggedMiddleware(app)(scope, receive, send)
+
+    # The app gets the server's receive channel, without any wrapping
+    assert received == [receive]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("codec", ["auto", "json", StdlibCodec()])
+async def test_codecs(codec: Codec | str) -> None:
+    body = form_body(3)
+    headers = {"content-type": "application/json"}
+
+    status, response = await call(
+        RuggedMiddleware(echo_app, codec=codec), headers, [body]
+    )
+
+    assert status == 200
+    assert json.loads(response)["items"][2] == {"item": "item 2", "qty": 2}
+
+
+@pytest.mark.anyio
+async def test_default_codec_keeps_big_ints_and_nan() -> None:
+    body = b'{"order[id]": 123456789012345678901234567890, "order[score]": NaN}'
+    headers = {"content-type": "application/json"}
+
+    status, response = await call(RuggedMiddleware(echo_app), headers, [body])
+
+    assert status == 200
+    assert response == b'{"order":{"id":123456789012345678901234567890,"score":NaN}}'
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{ "title" : "Sofrito time",\n  "meta": {"0": "zero"} }',
+        b'{"items": [1, 2, 3], "note": "[not a key]"}',
+        b'[{"items[]": 1}]',
+    ],
+)
+async def test_bodies_without_bracket_keys_are_forwarded(body: bytes) -> None:
+    headers = {"content-type": "application/json"}
+
+    status, response = await call(RuggedMiddleware(echo_app), headers, split(body, 16))
+
+    assert status == 200
+    assert response == body
+
+
+@pytest.mark.anyio
+async def test_escaped_bracket_keys_are_unflattened() -> None:
+    body = b'{"emails\\u005b]": ["foo@example.com"]}'
+    headers = {"content-type": "application/json"}
+
+    status, response = await call(RuggedMiddleware(echo_app), headers, [body])
+
+    assert status == 200
+    assert json.loads(response) == {"emails": ["foo@example.com"]}
+
+
+@pytest.mark.anyio
+async def test_urlencoded_form() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True)
+    body = b"title=List&items[][item]=carrots&items[][qty]=1&items[][item]=celery&items[][qty]=2"
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        split(body, 7),
+    )
+
+    assert status == 200
+    assert json.loads(response) == {
+        "title": "List",
+        "items": [{"item": "carrots", "qty": "1"}, {"item": "celery", "qty": "2"}],
+    }
+
+
+@pytest.mark.anyio
+async def test_forms_disabled() -> None:
+    middleware = RuggedMiddleware(echo_app)
+    body = b"items[][item]=carrots"
+
+    status, response = await call(
+        middleware, {"content-type": "application/x-www-form-urlencoded"}, [body]
+    )
+
+    assert status == 200
+    assert response == body
+
+
+@pytest.mark.anyio
+async def test_urlencoded_form_too_large() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, max_body_size=10)
+
+    status, _ = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"title=List&", b"items[][item]=carrots"],
+    )
+
+    assert status == 413
+
+
+@pytest.mark.anyio
+async def test_multipart_form_with_file() -> None:
+    pytest.importorskip("python_multipart")
+
+    middleware = RuggedMiddleware(echo_app, forms=True)
+    body = (
+        b'--boundary\r\nContent-Disposition: form-data; name="items[][item]"\r\n\r\n'
+        b"carrots\r\n"
+        b'--boundary\r\nContent-Disposition: form-data; name="upload"; filename="a.txt"\r\n\r\n'
+        b"contents\r\n"
+        b"--boundary--\r\n"
+    )
+
+    status, response = await call(
+        middleware,
+        {"content-type": "multipart/form-data; boundary=boundary"},
+        split(body, 16),
+    )
+
+    # Bodies with files are passed on as they were sent
+    assert status == 200
+    assert response == body
+
+
+def multipart_with_file(contents: bytes) -> bytes:
+    return (
+        b'--boundary\r\nContent-Disposition: form-data; name="items[][item]"\r\n\r\n'
+        b"carrots\r\n"
+        b'--boundary\r\nContent-Disposition: form-data; name="upload"; filename="a.txt"\r\n\r\n'
+        + contents
+        + b"\r\n--boundary--\r\n"
+    )
+
+
+@pytest.mark.anyio
+async def test_multipart_form_with_file_is_streamed() -> None:
+    pytest.importorskip("python_multipart")
+
+    body = multipart_with_file(b"x" * 4096)
+    chunks = split(body, 256)
+    source = make_receive(chunks)
+    received = 0
+
+    async def receive() -> Message:
+        nonlocal received
+        received += 1
+        return await source()
+
+    first_read: list[int] = []
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        first_read.append(received)
+        await echo_app(scope, receive, send)
+
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    middleware = RuggedMiddleware(app, forms=True)
+    headers = {"content-type": "multipart/form-data; boundary=boundary"}
+    await middleware(make_scope(headers), receive, send)
+
+    # The app is called once the file is found, rather than after the whole upload
+    assert first_read[0] < len(chunks)
+    assert b"".join(m.get("body", b"") for m in sent[1:]) == body
+
+
+@pytest.mark.anyio
+async def test_multipart_form_with_file_too_large() -> None:
+    pytest.importorskip("python_multipart")
+
+    body = multipart_with_file(b"x" * 4096)
+    middleware = RuggedMiddleware(echo_app, forms=True, max_body_size=len(body) - 1)
+    headers = {"content-type": "multipart/form-data; boundary=boundary"}
+
+    with pytest.raises(HTTPException) as exc_info:
+        await call(middleware, headers, split(body, 256))
+
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_urlencoded_form_with_conflicting_keys() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True)
+
+    status, _ = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"a=1&a[b]=2"],
+    )
+
+    assert status == 400
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("with_length", [True, False])
+async def test_streamed_unflattening(with_length: bool) -> None:
+    middleware = RuggedMiddleware(echo_app, stream_size=100)
+    body = form_body(50)
+
+    headers = {"content-type": "application/json"}
+    if with_length:
+        headers["content-length"] = str(len(body))
+
+    status, response = await call(middleware, headers, split(body, 64))
+
+    assert status == 200
+    assert json.loads(response) == unflatten(json.loads(body))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream_size", [None, 10])
+async def test_streamed_repeated_keys(stream_size: int | None) -> None:
+    middleware = RuggedMiddleware(echo_app, stream_size=stream_size)
+    body = b'{"a[]": [1], "b": 1, "a[]": [2]}'
+
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, split(body, 8)
+    )
+
+    # Streamed or not, the last value of a repeated key is kept
+    assert status == 200
+    assert json.loads(response) == {"a": [2], "b": 1}
+
+
+@pytest.mark.anyio
+async def test_streamed_without_brackets() -> None:
+    middleware = RuggedMiddleware(echo_app, stream_size=10)
+    data = {"0": "a", "1": "b", "nested": {"0": "c"}}
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/json"},
+        split(json.dumps(data).encode(), 8),
+    )
+
+    assert status == 200
+    assert json.loads(response) == data
+
+
+@pytest.mark.anyio
+async def test_streamed_too_large() -> None:
+    middleware = RuggedMiddleware(echo_app, stream_size=10, max_body_size=100)
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware, {"content-type": "application/json"}, split(form_body(50), 64)
+        )
+
+    assert exc.value.status_code == 413
+
+
+async def call_messages(
+    middleware: RuggedMiddleware, content_type: str, chunks: list[bytes]
+) -> list[Message]:
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await middleware(
+        make_scope({"content-type": content_type}), make_receive(chunks), send
+    )
+    return sent
+
+
+def test_uninstrumented_receiver() -> None:
+    middleware = RuggedMiddleware(echo_app)
+
+    assert middleware.receiver_class is JSONReceiver
+
+
+@pytest.mark.anyio
+async def test_instruments() -> None:
+    recorded: list[RequestMetrics] = []
+    middleware = RuggedMiddleware(echo_app, instruments=[recorded.append])
+    body = form_body(10)
+
+    for _ in range(2):
+        await call_messages(middleware, "application/json", split(body, 100))
+
+    first, second = recorded
+    assert first.method == "POST"
+    assert first.path == "/"
+    assert list(first.phases) == ["read", "decode", "unflatten", "encode"]
+    assert first.body_size == len(body)
+    assert first.key_count == 3
+
+    assert first.plan_cache_hit is False
+    assert first.key_cache_misses == 3
+    assert second.plan_cache_hit is True
+    assert second.key_cache_misses == 0
+
+
+@pytest.mark.anyio
+async def test_instruments_without_brackets() -> None:
+    recorded: list[RequestMetrics] = []
+    middleware = RuggedMiddleware(echo_app, instruments=[recorded.append])
+
+    await call_messages(middleware, "application/json", [b'{"title": "List"}'])
+
+    assert list(recorded[0].phases) == ["read"]
+    assert recorded[0].plan_cache_hit is None
+
+
+@pytest.mark.anyio
+async def test_instruments_forms() -> None:
+    recorded: list[RequestMetrics] = []
+    middleware = RuggedMiddleware(echo_app, forms=True, instruments=[recorded.append])
+    body = b"items[][item]=carrots&items[][qty]=1"
+
+    await call_messages(middleware, "application/x-www-form-urlencoded", [body])
+
+    assert list(recorded[0].phases) == ["read", "encode"]
+    assert recorded[0].body_size == len(body)
+    assert recorded[0].key_count == 2
+
+
+@pytest.mark.anyio
+async def test_server_timing() -> None:
+    middleware = RuggedMiddleware(echo_app, server_timing=True)
+
+    sent = await call_messages(middleware, "application/json", [form_body(10)])
+
+    headers = dict(sent[0]["headers"])
+    phases = [entry.split(b";")[0] for entry in headers[b"server-timing"].split(b", ")]
+    assert phases == [
+        b"rugged-read",
+        b"rugged-decode",
+        b"rugged-unflatten",
+        b"rugged-encode",
+    ]
+    assert json.loads(sent[1]["body"])["items"][0] == {"item": "item 0", "qty": 0}
+
+
+def test_server_timing_format() -> None:
+    metrics = RequestMetrics("POST", "/", phases={"read": 0.0012, "decode": 0.00005})
+
+    assert server_timing(metrics) == b"rugged-read;dur=1.200, rugged-decode;dur=0.050"
+
+
+@pytest.mark.anyio
+async def test_opentelemetry() -> None:
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    from rugged.instrumentation import OpenTelemetryInstrument
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+
+    recorded: list[RequestMetrics] = []
+    middleware = RuggedMiddleware(
+        echo_app,
+        instruments=[
+            OpenTelemetryInstrument(tracer_provider=provider),
+            recorded.append,
+        ],
+    )
+    await call_messages(middleware, "application/json", [form_body(10)])
+
+    (span,) = exporter.get_finished_spans()
+    assert span.name == "rugged.unflatten"
+    assert span.attributes is not None
+    assert span.attributes["rugged.key_count"] == 3
+    assert span.attributes["rugged.plan_cache_hit"] is False
+    assert "rugged.unflatten.duration_ms" in span.attributes
+    # The span ends when the last phase did, however long the phases took
+    assert span.start_time is not None and span.end_time is not None
+    assert span.end_time - span.start_time >= sum(
+        int(duration * 1e9) for duration in recorded[0].phases.values()
+    )
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("stream_size", [None, 10])
+async def test_limits(stream_size: int | None) -> None:
+    middleware = RuggedMiddleware(
+        echo_app, limits=Limits(max_list_length=10), stream_size=stream_size
+    )
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware, {"content-type": "application/json"}, split(form_body(50), 64)
+        )
+
+    assert exc.value.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_form_limits() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, limits=Limits(max_index=10))
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"items[0][item]=carrots&items[100][item]=celery"],
+    )
+
+    assert status == 400
+    assert response == b"'items[100][item]' has an index larger than 10"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"users[][a]": [1, 2], "users[][b]": [1]}',
+        b'{"a": 1, "a[b]": 2}',
+        b'{"a[][]": 1}',
+    ],
+)
+@pytest.mark.parametrize("stream_size", [None, 10])
+async def test_conflicting_keys(body: bytes, stream_size: int | None) -> None:
+    middleware = RuggedMiddleware(echo_app, stream_size=stream_size)
+
+    with pytest.raises(HTTPException) as exc:
+        await call(middleware, {"content-type": "application/json"}, split(body, 8))
+
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_ndjson_conflicting_keys() -> None:
+    middleware = RuggedMiddleware(echo_app, ndjson=True)
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware,
+            {"content-type": "application/x-ndjson"},
+            [b'{"a": 1, "a[b]": 2}\n'],
+        )
+
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_websocket_conflicting_keys() -> None:
+    messages: list[Message] = [
+        {"type": "websocket.receive", "text": '{"a": 1, "a[b]": 2}'},
+    ]
+
+    async def receive() -> Message:
+        return messages.pop(0)
+
+    middleware = RuggedMiddleware(echo_app, websockets=True)
+    receiver = WebSocketReceiver(middleware.options, receive)
+
+    with pytest.raises(WebSocketException) as exc:
+        await receiver()
+
+    assert exc.value.code == 1008
+
+
+@pytest.mark.anyio
+async def test_sparse_lists() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, sparse_lists="compact")
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/json"},
+        [b'{"items[3][item]": "carrots", "items[7][item]": "celery"}'],
+    )
+
+    assert status == 200
+    assert json.loads(response) == {"items": [{"item": "carrots"}, {"item": "celery"}]}
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"items[3][item]=carrots&items[7][item]=celery"],
+    )
+
+    assert status == 200
+    assert json.loads(response) == {"items": [{"item": "carrots"}, {"item": "celery"}]}
+
+
+@pytest.mark.anyio
+async def test_sparse_lists_rejected() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, sparse_lists="reject")
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"items[3][item]=carrots&items[7][item]=celery"],
+    )
+
+    assert status == 400
+    assert response == b"'items' has gaps in its numeric indexes"
+
+
+@pytest.mark.anyio
+async def test_columns() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, columns=True)
+    expected = {"items": {"item": ["carrots", "celery"], "qty": ["1", "2"]}}
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/json"},
+        [b'{"items[][item]": ["carrots", "celery"], "items[][qty]": ["1", "2"]}'],
+    )
+
+    assert status == 200
+    assert json.loads(response) == expected
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"items[][item]=carrots&items[][qty]=1&items[][item]=celery&items[][qty]=2"],
+    )
+
+    assert status == 200
+    assert json.loads(response) == expected
+
+
+@pytest.mark.anyio
+async def test_key_syntax() -> None:
+    middleware = RuggedMiddleware(echo_app, forms=True, key_syntax=KeySyntax("mixed"))
+    expected = {"items": [{"item": "carrots"}], "address": {"city": "London"}}
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/json"},
+        [b'{"items[0].item": "carrots", "address.city": "London"}'],
+    )
+
+    assert status == 200
+    assert json.loads(response) == expected
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"items[0].item=carrots&address.city=London"],
+    )
+
+    assert status == 200
+    assert json.loads(response) == expected
+
+
+@pytest.mark.anyio
+async def test_malformed_keys_rejected() -> None:
+    middleware = RuggedMiddleware(
+        echo_app, forms=True, key_syntax=KeySyntax(reject_malformed=True)
+    )
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/x-www-form-urlencoded"},
+        [b"address]city[=London"],
+    )
+
+    assert status == 400
+    assert response == b"'address]city[' is not a valid key"
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware,
+            {"content-type": "application/json"},
+            [b'{"address[city]road": "London"}'],
+        )
+
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_websocket_receiver() -> None:
+    frame = '{"items[][item]": ["carrots"], "items[][qty]": [1]}'
+    messages: list[Message] = [
+        {"type": "websocket.connect"},
+        *({"type": "websocket.receive", "text": frame} for _ in range(3)),
+        {"type": "websocket.receive", "bytes": frame.encode()},
+    ]
+
+    async def receive() -> Message:
+        return messages.pop(0)
+
+    middleware = RuggedMiddleware(echo_app, websockets=True)
+    receiver = WebSocketReceiver(middleware.options, receive)
+
+    assert await receiver() == {"type": "websocket.connect"}
+    for _ in range(3):
+        message = await receiver()
+        assert json.loads(message["text"]) == {"items": [{"item": "carrots", "qty": 1}]}
+    # Binary messages are passed on as they were sent
+    assert await receiver() == {"type": "websocket.receive", "bytes": frame.encode()}
+
+    # The plan for the first message was reused for the others
+    assert receiver.plan_cache.misses == 1
+    assert receiver.plan_cache.hits == 0
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"stream_size": 10}, {"process_size": 10, "codec": "json"}],
+)
+async def test_merge_duplicate_keys(options: dict[str, Any]) -> None:
+    middleware = RuggedMiddleware(echo_app, merge_duplicate_keys=True, **options)
+    body = (
+        b'{"items[][item]": "carrots", "items[][qty]": 1, '
+        b'"items[][item]": "celery", "items[][qty]": 2, "tag": "a", "tag": "b"}'
+    )
+
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, split(body, 32)
+    )
+
+    assert status == 200
+    assert json.loads(response) == {
+        "items": [{"item": "carrots", "qty": 1}, {"item": "celery", "qty": 2}],
+        "tag": ["a", "b"],
+    }
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"stream_size": 10}, {"process_size": 10, "codec": "json"}],
+)
+async def test_merge_duplicate_keys_without_brackets(options: dict[str, Any]) -> None:
+    middleware = RuggedMiddleware(echo_app, merge_duplicate_keys=True, **options)
+
+    status, response = await call(
+        middleware,
+        {"content-type": "application/json"},
+        split(b'{"tag": "a", "tag": "b", "title": "Sofrito time"}', 16),
+    )
+
+    assert status == 200
+    assert json.loads(response) == {"tag": ["a", "b"], "title": "Sofrito time"}
+
+    # Bodies without keys to merge or unflatten are passed on as they were sent
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, [b'{"tag": "a"}']
+    )
+
+    assert status == 200
+    assert response == b'{"tag": "a"}'
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "path, unflattened",
+    [
+        ("/signup", True),
+        ("/users/1/address", True),
+        ("/users/1/address/history", False),
+        ("/forms/", True),
+        ("/forms/orders/new", True),
+        ("/forms/upload", False),
+        ("/api/orders", False),
+    ],
+)
+async def test_routes(path: str, unflattened: bool) -> None:
+    middleware = RuggedMiddleware(
+        echo_app,
+        routes=["/signup", "/users/{id}/address", "/forms/*"],
+        exclude_routes=["/forms/upload"],
+    )
+    body = b'{"address[city]": "London"}'
+
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, [body], path=path
+    )
+
+    assert status == 200
+    if unflattened:
+        assert json.loads(response) == {"address": {"city": "London"}}
+    else:
+        assert response == body
+
+
+@pytest.mark.anyio
+async def test_exclude_routes() -> None:
+    middleware = RuggedMiddleware(echo_app, exclude_routes=["/raw/*"])
+    body = b'{"address[city]": "London"}'
+
+    _, response = await call(
+        middleware, {"content-type": "application/json"}, [body], path="/raw/1"
+    )
+    assert response == body
+
+    _, response = await call(
+        middleware, {"content-type": "application/json"}, [body], path="/signup"
+    )
+    assert json.loads(response) == {"address": {"city": "London"}}
+
+
+@pytest.mark.anyio
+async def test_route_options() -> None:
+    middleware = RuggedMiddleware(
+        echo_app,
+        routes=[
+            Route("/import", columns=True, limits=Limits(max_keys=2)),
+            "/*",
+        ],
+    )
+    body = b'{"items[][qty]": [1, 2]}'
+
+    _, response = await call(
+        middleware, {"content-type": "application/json"}, [body], path="/import"
+    )
+    assert json.loads(response) == {"items": {"qty": [1, 2]}}
+
+    _, response = await call(
+        middleware, {"content-type": "application/json"}, [body], path="/orders"
+    )
+    assert json.loads(response) == {"items": [{"qty": 1}, {"qty": 2}]}
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware,
+            {"content-type": "application/json"},
+            [b'{"a[]": 1, "b[]": 2, "c[]": 3}'],
+            path="/import",
+        )
+    assert exc.value.status_code == 413
+
+    # Routes are handled with a copy of the options, leaving the middleware's own unchanged
+    assert middleware.options.columns is False
+    assert middleware.options.limits is None
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("rows, offloaded", [(1, False), (50, True)])
+async def test_thread_offload(rows: int, offloaded: bool) -> None:
+    threads: list[int] = []
+
+    class ThreadCodec(StdlibCodec):
+        def decode(self, body: bytes | bytearray) -> Any:
+            threads.append(threading.get_ident())
+            return super().decode(body)
+
+    middleware = RuggedMiddleware(echo_app, codec=ThreadCodec(), thread_size=500)
+    body = form_body(rows)
+
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, [body]
+    )
+
+    assert status == 200
+    assert json.loads(response) == unflatten(json.loads(body))
+    assert (threads[0] != threading.get_ident()) is offloaded
+
+
+@pytest.mark.anyio
+async def test_process_offload() -> None:
+    recorded: list[RequestMetrics] = []
+    middleware = RuggedMiddleware(
+        echo_app, codec="json", process_size=500, instruments=[recorded.append]
+    )
+    body = form_body(50)
+
+    status, response = await call(
+        middleware, {"content-type": "application/json"}, [body]
+    )
+
+    assert status == 200
+    assert json.loads(response) == unflatten(json.loads(body))
+    assert list(recorded[0].phases) == ["read", "process"]
+
+    middleware = RuggedMiddleware(
+        echo_app, codec="json", process_size=500, limits=Limits(max_list_length=10)
+    )
+
+    with pytest.raises(HTTPException) as exc:
+        await call(middleware, {"content-type": "application/json"}, [body])
+
+    assert exc.value.status_code == 413
+
+
+def test_process_offload_needs_builtin_codec() -> None:
+    class CustomCodec(StdlibCodec):
+        name = "custom"
+
+    with pytest.raises(ValueError):
+        RuggedMiddleware(echo_app, codec=CustomCodec(), process_size=500)
+
+
+def ndjson_body(rows: int) -> bytes:
+    lines = [
+        {"order": i, "items[][item]": ["carrots", "celery"], "items[][qty]": [1, 2]}
+        for i in range(rows)
+    ]
+    lines.append({"order": rows, "note": "no brackets"})
+    return b"".join(json.dumps(line).encode() + b"\n" for line in lines)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("chunk_size", [7, 64, 100_000])
+async def test_ndjson(chunk_size: int) -> None:
+    middleware = RuggedMiddleware(echo_app, ndjson=True)
+    body = ndjson_body(20)
+
+    status, response = await call(
+        middleware, {"content-type": "application/x-ndjson"}, split(body, chunk_size)
+    )
+
+    assert status == 200
+    assert [json.loads(line) for line in response.splitlines()] == [
+        unflatten(json.loads(line)) for line in body.splitlines()
+    ]
+    # Lines without brackets are passed on as they were sent
+    assert response.splitlines()[-1] == body.splitlines()[-1]
+
+
+@pytest.mark.anyio
+async def test_ndjson_lines_are_passed_on_as_received() -> None:
+    received: list[Message] = []
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        while not received or received[-1]["more_body"]:
+            received.append(await receive())
+        await echo_app(scope, receive, send)
+
+    middleware = RuggedMiddleware(app, ndjson=True)
+    await call(
+        middleware, {"content-type": "application/x-ndjson"}, split(ndjson_body(20), 64)
+    )
+
+    assert len(received) > 1
+    for message in received[:-1]:
+        assert message["body"].endswith(b"\n")
+        assert message["more_body"]
+
+
+@pytest.mark.anyio
+async def test_ndjson_disabled() -> None:
+    middleware = RuggedMiddleware(echo_app)
+    body = ndjson_body(2)
+
+    status, response = await call(
+        middleware, {"content-type": "application/x-ndjson"}, [body]
+    )
+
+    assert status == 200
+    assert response == body
+
+
+@pytest.mark.anyio
+async def test_ndjson_limits() -> None:
+    middleware = RuggedMiddleware(
+        echo_app, ndjson=True, limits=Limits(max_list_length=1)
+    )
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware, {"content-type": "application/x-ndjson"}, [ndjson_body(2)]
+        )
+
+    assert exc.value.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_ndjson_invalid_lines_are_passed_on() -> None:
+    middleware = RuggedMiddleware(echo_app, ndjson=True)
+    body = b'{"a[b]": 1}\n{"a[b]": \n\n{"c[]": [2]}\n'
+
+    status, response = await call(
+        middleware, {"content-type": "application/x-ndjson"}, split(body, 8)
+    )
+
+    assert status == 200
+    assert response == b'{"a":{"b":1}}\n{"a[b]": \n\n{"c":[2]}\n'
+
+
+@pytest.mark.anyio
+async def test_ndjson_merge_duplicate_keys() -> None:
+    middleware = RuggedMiddleware(echo_app, ndjson=True, merge_duplicate_keys=True)
+    body = b'{"tag": "a", "tag": "b"}\n{"a[]": 1, "a[]": 2, "b": 3}\n{"c": 4}\n'
+
+    status, response = await call(
+        middleware, {"content-type": "application/x-ndjson"}, [body]
+    )
+
+    assert status == 200
+    assert response.split(b"\n") == [
+        b'{"tag":["a","b"]}',
+        b'{"a":[1,2],"b":3}',
+        b'{"c": 4}',
+        b"",
+    ]
+
+
+@pytest.mark.anyio
+async def test_ndjson_too_large() -> None:
+    middleware = RuggedMiddleware(echo_app, ndjson=True, max_body_size=100)
+
+    with pytest.raises(HTTPException) as exc:
+        await call(
+            middleware,
+            {"content-type": "application/x-ndjson"},
+            split(ndjson_body(20), 64),
+        )
+
+    assert exc.value.status_code == 413
+
+
+def respond_with(
+    body: bytes, content_type: str = "application/json", status: int = 200
+) -> Any:
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        headers = [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        # Send the body in parts, as streaming responses do
+        for chunk in split(body, 1000):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def order(rows: int) -> dict[str, Any]:
+    return {
+        "title": "Bulk order",
+        "items": [{"item": f"item {i}", "qty": i} for i in range(rows)],
+    }
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("rows", [2, 5000])
+@pytest.mark.parametrize("columns", [False, True])
+async def test_flatten_responses(rows: int, columns: bool) -> None:
+    data = order(rows)
+    middleware = RuggedMiddleware(
+        respond_with(json.dumps(data).encode()),
+        flatten_responses=True,
+        flatten_columns=columns,
+    )
+
+    messages = await call_messages(middleware, "text/plain", [b""])
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    headers = dict(messages[0]["headers"])
+
+    assert json.loads(body) == flatten(data, columns=columns)
+    if len(messages) > 2:
+        # Large responses are streamed, so their length isn't known up front
+        assert b"content-length" not in headers
+    else:
+        assert headers[b"content-length"] == str(len(body)).encode()
+
+
+@pytest.mark.anyio
+async def test_flatten_large_responses_in_parts() -> None:
+    middleware = RuggedMiddleware(
+        respond_with(json.dumps(order(5000)).encode()), flatten_responses=True
+    )
+
+    messages = await call_messages(middleware, "text/plain", [b""])
+
+    assert len(messages) > 3
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body, content_type",
+    [
+        (b'{"items": [{"qty": 1}]}', "text/plain"),
+        (b'[{"qty": 1}]', "application/json"),
+        (b'{"items": [', "application/json"),
+    ],
+)
+async def test_flatten_responses_passthrough(body: bytes, content_type: str) -> None:
+    middleware = RuggedMiddleware(
+        respond_with(body, content_type), flatten_responses=True
+    )
+
+    messages = await call_messages(middleware, "text/plain", [b""])
+
+    assert dict(messages[0]["headers"])[b"content-length"] == str(len(body)).encode()
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == body
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [201, 404, 422, 500])
+async def test_flatten_responses_only_when_successful(status: int) -> None:
+    body = json.dumps(
+        {"detail": [{"type": "missing", "loc": ["body", "title"], "msg": "Missing"}]}
+    ).encode()
+    middleware = RuggedMiddleware(
+        respond_with(body, status=status), flatten_responses=True
+    )
+
+    messages = await call_messages(middleware, "text/plain", [b""])
+    response = b"".join(m.get("body", b"") for m in messages[1:])
+
+    assert messages[0]["status"] == status
+    if status < 300:
+        assert json.loads(response) == flatten(json.loads(body))
+    else:
+        assert response == body
+
+
+@pytest.mark.anyio
+async def test_flatten_responses_disabled() -> None:
+    body = json.dumps(order(2)).encode()
+    middleware = RuggedMiddleware(respond_with(body))
+
+    messages = await call_messages(middleware, "text/plain", [b""])
+
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == body
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sends_body", [True, False])
+async def test_flatten_responses_to_head(sends_body: bool) -> None:
+    body = json.dumps(order(2)).encode()
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body if sends_body else b""})
+
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    middleware = RuggedMiddleware(app, flatten_responses=True)
+    await middleware(make_scope({}, method="HEAD"), make_receive([b""]), send)
+
+    headers = dict(sent[0]["headers"])
+    if sends_body:
+        flat = b"".join(m.get("body", b"") for m in sent[1:])
+        assert json.loads(flat) == flatten(order(2))
+        assert headers[b"content-length"] == str(len(flat)).encode()
+    else:
+        # The length of the unflattened response would be wrong
+        assert b"content-length" not in headers
@@ -1,21 +1,37 @@
+from collections.abc import Callable, Sequence
+from typing import Any
+
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from pydantic import BaseModel
+from starlette.middleware import Middleware
 
 from rugged.middleware import RuggedMiddleware
 
 
-def test_fastapi_usage() -> None:
-    app = FastAPI()
-    app.add_middleware(RuggedMiddleware)
+class InviteEmails(BaseModel):
+    emails: list[str]
+
+
+async def invite(invite: InviteEmails) -> dict[str, list[str]]:
+    return {"emails": invite.emails}
 
-    class InviteEmails(BaseModel):
-        emails: list[str]
 
-    @app.post("/invite", response_model=InviteEmails)
-    async def invite(invite: InviteEmails) -> dict[str, list[str]]:
-        return {"emails": invite.emails}
+def make_app(
+    endpoint: Callable[..., Any] = invite, middleware: Sequence[Middleware] = ()
+) -> FastAPI:
+    """
+    Returns an app that handles POST requests to /invite with endpoint
 
+    """
+
+    app = FastAPI(middleware=middleware)
+    app.post("/invite")(endpoint)
+    return app
+
+
+def test_fastapi_usage() -> None:
+    app = make_app(middleware=[Middleware(RuggedMiddleware)])
     client = TestClient(app)
 
     response = client.post(
@@ -1,24 +1,40 @@
+from collections.abc import Awaitable, Callable, Sequence
+
+import pytest
 from starlette.applications import Starlette
-from starlette.requests import Request
 from starlette.middleware import Middleware
-from starlette.responses import JSONResponse
-from starlette.routing import Route
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
 from starlette.testclient import TestClient
+from starlette.websockets import WebSocket, WebSocketDisconnect
 
+from rugged.limits import Limits
 from rugged.middleware import RuggedMiddleware
 
 
-def test_starlette_usage() -> None:
-    async def invite(request: Request) -> JSONResponse:
-        return JSONResponse(await request.json())
+async def invite(request: Request) -> Response:
+    return JSONResponse(await request.json())
 
-    app = Starlette(
-        routes=[Route("/invite", methods=["POST"], endpoint=invite)],
-        middleware=[
-            Middleware(RuggedMiddleware),
-        ],
+
+def make_app(
+    endpoint: Callable[[Request], Awaitable[Response]] = invite,
+    middleware: Sequence[Middleware] = (),
+) -> Starlette:
+    """
+    Returns an app that handles POST requests to /invite with endpoint
+
+    """
+
+    return Starlette(
+        routes=[Route("/invite", methods=["POST"], endpoint=endpoint)],
+        middleware=middleware,
     )
 
+
+def test_starlette_usage() -> None:
+    app = make_app(middleware=[Middleware(RuggedMiddleware)])
+
     client = TestClient(app)
 
     response = client.post(
@@ -36,3 +52,95 @@ def test_starlette_usage() -> None:
             "baz@example.com",
         ],
     }
+
+
+def test_starlette_caches() -> None:
+    app = RuggedMiddleware(
+        make_app(),
+        key_cache_size=1,
+        plan_cache_size=1,
+    )
+
+    client = TestClient(app)
+
+    for _ in range(2):
+        response = client.post("/invite", json={"emails[]": ["foo@example.com"]})
+        assert response.json() == {"emails": ["foo@example.com"]}
+
+    client.post("/invite", json={"address[zipcode]": "90210"})
+
+    # The second request replays the plan, so its key isn't parsed again
+    stats = app.plan_cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (1, 2, 1)
+
+    stats = app.key_cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (0, 2, 1)
+    assert stats.maxsize == 1
+
+
+def test_starlette_body_too_large() -> None:
+    app = make_app(middleware=[Middleware(RuggedMiddleware, max_body_size=40)])
+
+    client = TestClient(app)
+
+    response = client.post("/invite", json={"emails[]": ["foo@example.com"]})
+    assert response.status_code == 200
+
+    response = client.post(
+        "/invite",
+        json={"emails[]": ["foo@example.com", "bar@example.com"]},
+    )
+    assert response.status_code == 413
+
+
+def test_starlette_limits() -> None:
+    app = make_app(
+        middleware=[
+            Middleware(RuggedMiddleware, limits=Limits(max_depth=2, max_keys=3))
+        ]
+    )
+
+    client = TestClient(app)
+
+    response = client.post("/invite", json={"address[home][city]": "London"})
+    assert response.status_code == 200
+
+    response = client.post("/invite", json={"address[home][city][name]": "London"})
+    assert response.status_code == 400
+
+    response = client.post("/invite", json={"a[]": 1, "b[]": 2, "c[]": 3, "d[]": 4})
+    assert response.status_code == 413
+
+
+def test_starlette_websockets() -> None:
+    async def echo(websocket: WebSocket) -> None:
+        await websocket.accept()
+        while True:
+            await websocket.send_text(await websocket.receive_text())
+
+    app = Starlette(
+        routes=[WebSocketRoute("/ws", endpoint=echo)],
+        middleware=[
+            Middleware(
+                RuggedMiddleware, websockets=True, limits=Limits(max_list_length=2)
+            ),
+        ],
+    )
+
+    client = TestClient(app)
+
+    with client.websocket_connect("/ws") as websocket:
+        for qty in range(3):
+            websocket.send_json({"items[][item]": ["carrots"], "items[][qty]": [qty]})
+            assert websocket.receive_json() == {
+                "items": [{"item": "carrots", "qty": qty}]
+            }
+
+        websocket.send_text("not json [")
+        assert websocket.receive_text() == "not json ["
+
+        websocket.send_json({"emails[]": ["foo", "bar", "baz"]})
+        with pytest.raises(WebSocketDisconnect) as exc:
+            websocket.receive_json()
+
+    assert exc.value.code == 1009
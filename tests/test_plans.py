@@ -0,0 +1,196 @@
+from typing import Any
+
+import pytest
+
+from rugged.caching import LRUCache
+from rugged.limits import KeyConflict
+from rugged.plans import (
+    MAX_PLAN_DEPTH,
+    MapNode,
+    PlanCache,
+    UnflattenPlan,
+    compile_plan,
+)
+from rugged.unflatteners import (
+    SparseLists,
+    apply_plan,
+    derive,
+    unflatten,
+    unflatten_many,
+    unflatten_pairs,
+)
+
+SHAPES: list[dict[str, Any]] = [
+    {"action": "signup", "email": "foo@example.com"},
+    {"address[zipcode]": "90210", "address[city]": "Beverly Hills"},
+    {"emails[]": ["foo@example.com", "bar@example.com"]},
+    {"users[][id]": [1, 2], "users[][name]": ["foo", "bar"]},
+    {"users[][id]": 1, "users[][name]": "foo"},
+    {"users[0][name]": "Foo", "users[1][name]": "Bar"},
+    {"users[3][name]": "Foo", "users[12][name]": "Bar"},
+    {"reports[daily][to][]": ["a", "b"], "reports[daily][rows][][n]": [1, 2]},
+    {"grid[][0]": ["a", "b"], "grid[][1]": ["c", "d"]},
+    {"tags[]": "one", "meta": {"0": "nested", "1": "values"}},
+    {"address[road": "main st", "[address][postcode]": "sw1a 1aa"},
+]
+
+
+@pytest.mark.parametrize("data", SHAPES)
+def test_plan_matches_derived_structure(data: dict[str, Any]) -> None:
+    plan = compile_plan(data)
+
+    assert plan is not None
+    assert apply_plan(plan, data) == derive(data)
+
+
+@pytest.mark.parametrize("sparse_lists", ["compact", "pad"])
+@pytest.mark.parametrize("data", SHAPES)
+def test_plan_matches_derived_sparse_lists(
+    data: dict[str, Any], sparse_lists: SparseLists
+) -> None:
+    plan = compile_plan(data)
+
+    assert plan is not None
+    assert apply_plan(plan, data, sparse_lists=sparse_lists) == derive(
+        data, sparse_lists=sparse_lists
+    )
+
+
+@pytest.mark.parametrize("data", SHAPES)
+def test_plan_matches_derived_columns(data: dict[str, Any]) -> None:
+    plan = compile_plan(data)
+
+    assert plan is not None
+    assert apply_plan(plan, data, columns=True) == derive(data, columns=True)
+
+
+def test_plan_records_sparse_lists() -> None:
+    plan = compile_plan(
+        ["users[3][name]", "users[12][name]", "tags[1]", "tags[0]", "ids[0]"]
+    )
+
+    assert plan is not None
+    assert plan.sparse == [("users", 2, 13), ("tags", 2, 2)]
+
+
+def test_plan_replays_with_new_values() -> None:
+    plan = compile_plan(["title", "items[][item]", "items[][qty]"])
+    assert isinstance(plan, UnflattenPlan)
+
+    assert apply_plan(
+        plan, {"title": "Sofrito", "items[][item]": ["onions"], "items[][qty]": [2]}
+    ) == {"title": "Sofrito", "items": [{"item": "onions", "qty": 2}]}
+    assert apply_plan(
+        plan,
+        {"title": "Soup", "items[][item]": ["leeks", "stock"], "items[][qty]": [3, 1]},
+    ) == {
+        "title": "Soup",
+        "items": [{"item": "leeks", "qty": 3}, {"item": "stock", "qty": 1}],
+    }
+
+
+def test_plan_checks_list_item_counts() -> None:
+    data = {"users[][id]": [1, 2], "users[][name]": ["foo"]}
+    plan = compile_plan(data)
+    assert plan is not None
+
+    with pytest.raises(KeyConflict):
+        apply_plan(plan, data)
+
+
+@pytest.mark.parametrize(
+    "keys",
+    [
+        # Conflicting uses of the same root key
+        ["address", "address[zipcode]"],
+        ["address[zipcode]", "address[]"],
+        ["emails[]", "emails[][address]"],
+        # Deeper structures within lists
+        ["recipients[][name][title]"],
+        ["matrix[][]"],
+        # Sequential keys at the top level
+        ["0", "1"],
+    ],
+)
+def test_unplannable_shapes(keys: list[str]) -> None:
+    assert compile_plan(keys) is None
+
+
+def test_unflatten_caches_plans_by_key_signature() -> None:
+    cache: LRUCache[tuple[str, ...], Any] = LRUCache()
+
+    first = unflatten({"a[b]": 1, "c": 2}, plan_cache=cache)
+    second = unflatten({"a[b]": 3, "c": 4}, plan_cache=cache)
+    # Same keys in another order are a different shape
+    unflatten({"c": 5, "a[b]": 6}, plan_cache=cache)
+
+    assert first == {"a": {"b": 1}, "c": 2}
+    assert second == {"a": {"b": 3}, "c": 4}
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+
+
+def test_unflatten_falls_back_for_unplannable_shapes() -> None:
+    cache: LRUCache[tuple[str, ...], Any] = LRUCache()
+    data = {"address[zipcode]": "90210", "address": "1 Main St"}
+
+    for _ in range(2):
+        assert unflatten(data, plan_cache=cache) == derive(data)
+
+    assert cache.get(tuple(data)) is False
+
+
+def test_unflatten_many_reuses_plans() -> None:
+    plan_cache: PlanCache = LRUCache()
+    records = [
+        {"users[][id]": [i, i + 1], "users[][name]": ["foo", "bar"]} for i in range(3)
+    ]
+    records.append({"address[city]": "London"})
+
+    results = unflatten_many(records, plan_cache=plan_cache)
+
+    assert next(results) == {
+        "users": [{"id": 0, "name": "foo"}, {"id": 1, "name": "bar"}]
+    }
+    assert list(results) == [unflatten(record) for record in records[1:]]
+    assert plan_cache.misses == 2
+
+
+def test_unflatten_pairs_reuses_plans() -> None:
+    plan_cache: PlanCache = LRUCache()
+    data = {"users[][id]": [1, 2], "users[][name]": ["foo", "bar"], "tag": "a"}
+
+    for _ in range(2):
+        result = unflatten_pairs(list(data.items()), plan_cache=plan_cache)
+        assert result == unflatten(data)
+    assert (plan_cache.misses, plan_cache.hits) == (1, 1)
+
+    # Plans aren't compiled for repeated keys, which are merged instead
+    pairs = [*data.items(), ("tag", "b")]
+    assert unflatten_pairs(pairs, plan_cache=plan_cache) == {
+        "users": [{"id": 1, "name": "foo"}, {"id": 2, "name": "bar"}],
+        "tag": ["a", "b"],
+    }
+    assert tuple(key for key, _ in pairs) not in plan_cache
+
+
+def test_plan_finalised_without_recursion() -> None:
+    key = "a" + "[x]" * MAX_PLAN_DEPTH
+    plan = compile_plan([key, "b[0]", "b[1]"])
+
+    assert plan is not None
+    node = plan.root.children["b"]
+    assert isinstance(node, MapNode) and node.as_list
+
+
+def test_keys_deeper_than_recursion_limit_are_derived() -> None:
+    data = {"a" + "[x]" * 2000: 1}
+
+    assert compile_plan(data) is None
+
+    result: Any = unflatten(data, plan_cache=LRUCache())
+    value = result["a"]
+    for _ in range(2000):
+        value = value["x"]
+    assert value == 1
@@ -0,0 +1,49 @@
+import pytest
+
+from rugged.routes import Route, RouteMatcher
+
+
+@pytest.mark.parametrize(
+    "pattern, path, matches",
+    [
+        ("/signup", "/signup", True),
+        ("/signup", "/signup/", False),
+        ("/signup", "/signups", False),
+        ("/users/{id}", "/users/1", True),
+        ("/users/{id}", "/users/", False),
+        ("/users/{id}", "/users/1/address", False),
+        ("/users/{id}/address", "/users/1/address", True),
+        ("/forms/*", "/forms/", True),
+        ("/forms/*", "/forms/orders/new", True),
+        ("/forms/*", "/forms", False),
+        ("/v1.0/*", "/v1x0/orders", False),
+    ],
+)
+def test_route_patterns(pattern: str, path: str, matches: bool) -> None:
+    matcher: RouteMatcher[str | None] = RouteMatcher([(pattern, "route")])
+
+    assert matcher.match(path, None) == ("route" if matches else None)
+
+
+def test_first_matching_route() -> None:
+    matcher: RouteMatcher[str | None] = RouteMatcher(
+        [("/forms/upload", "upload"), ("/forms/*", "forms"), ("/*", "other")]
+    )
+
+    assert matcher.match("/forms/upload", None) == "upload"
+    assert matcher.match("/forms/signup", None) == "forms"
+    assert matcher.match("/signup", None) == "other"
+
+
+def test_no_routes() -> None:
+    matcher: RouteMatcher[str] = RouteMatcher([])
+
+    assert matcher.match("/signup", "default") == "default"
+
+
+def test_route_validation() -> None:
+    with pytest.raises(ValueError, match="must start with /"):
+        Route("signup")
+
+    with pytest.raises(ValueError, match="Unknown route options: codec"):
+        Route("/signup", codec="json")
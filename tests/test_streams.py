@@ -0,0 +1,74 @@
+import json
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+
+from rugged.streams import PairDecoder, unflatten_stream
+from rugged.unflatteners import unflatten
+
+
+async def chunked(body: bytes, size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100_000])
+@pytest.mark.parametrize("indent", [None, 2])
+async def test_unflatten_stream(size: int, indent: int | None) -> None:
+    data: dict[str, Any] = {
+        "title": "Sofrito time 🍅",
+        "items[][item]": ["carrots", "celery", "onions"],
+        "items[][qty]": [1, 1, 2],
+        "address[city]": "Paris",
+        "address[zip]": 75001,
+        "price": -12.5e2,
+        "notes": {"text": "a }, b", "tags": [True, False, None]},
+    }
+    body = json.dumps(data, indent=indent, ensure_ascii=False).encode()
+
+    assert await unflatten_stream(chunked(body, size)) == unflatten(data)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"a[]": [1], "b": 1, "a[]": [2]}',
+        b'{"u[][n]": [1, 2], "u[][m]": [3], "u[][n]": [4], "x": 1, "x": {"0": 2}}',
+        b'{"a[b]": 1, "a[c][]": 2, "a[b]": 3, "a[c][]": 4, "a[c][]": 5}',
+    ],
+)
+async def test_unflatten_stream_repeated_keys(body: bytes) -> None:
+    # The last value of a repeated key is kept, as it is by json.loads()
+    assert await unflatten_stream(chunked(body, 3)) == unflatten(json.loads(body))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("data", [[1, 2, 3], "text", 123, {}])
+async def test_unflatten_stream_other_documents(data: Any) -> None:
+    body = json.dumps(data).encode()
+
+    assert await unflatten_stream(chunked(body, 1)) == data
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "body",
+    [b"", b'{"a": 1', b'{"a" 1}', b'{"a": 1}x', b'{"a": 1,}', b'{"a": tru}', b"[1"],
+)
+async def test_unflatten_stream_invalid(body: bytes) -> None:
+    with pytest.raises(json.JSONDecodeError):
+        await unflatten_stream(chunked(body, 1))
+
+
+def test_pair_decoder_yields_complete_values() -> None:
+    decoder = PairDecoder()
+
+    assert decoder.feed(b'{"a": "one", "b": 12') == [("a", "one")]
+    # The number may continue in the next chunk
+    assert decoder.feed(b"3") == []
+    assert decoder.feed(b', "c": [1,') == [("b", 123)]
+    assert decoder.feed(b" 2]}") == [("c", [1, 2])]
+    assert decoder.close() == []
@@ -1,8 +1,19 @@
+from collections.abc import Callable
+from typing import Any
 from uuid import uuid4
 
 import pytest
 
-from rugged.unflatteners import unflatten
+from rugged.keys import KeyNotation, KeySyntax
+from rugged.limits import LimitExceeded, Limits
+from rugged.unflatteners import (
+    MAX_PADDED_LENGTH,
+    SparseLists,
+    Unflattener,
+    derive,
+    unflatten,
+    unflatten_pairs,
+)
 
 
 def test_unflatten_flat_dict() -> None:
@@ -47,6 +58,60 @@ def test_unflatten_broken_brackets() -> None:
     }
 
 
+@pytest.mark.parametrize("notation", ["dotted", "mixed"])
+def test_unflatten_dotted_keys(notation: KeyNotation) -> None:
+    d = {
+        "title": "Sofrito time",
+        "address.city": "London",
+        "items.0.item": "carrots",
+        "items.1.item": "celery",
+    }
+    expected = {
+        "title": "Sofrito time",
+        "address": {"city": "London"},
+        "items": [{"item": "carrots"}, {"item": "celery"}],
+    }
+
+    assert unflatten(d, key_syntax=KeySyntax(notation)) == expected
+    assert derive(d, key_syntax=KeySyntax(notation)) == expected
+
+
+def test_unflatten_mixed_keys() -> None:
+    d = {
+        "items[][item]": ["carrots", "celery"],
+        "items[][price].amount": [1, 2],
+        "address.lines[]": ["1 Main St", "London"],
+    }
+
+    assert unflatten(d, key_syntax=KeySyntax("mixed")) == {
+        "items": [
+            {"item": "carrots", "price": {"amount": 1}},
+            {"item": "celery", "price": {"amount": 2}},
+        ],
+        "address": {"lines": ["1 Main St", "London"]},
+    }
+
+
+def test_unflatten_key_syntaxes_have_their_own_plans() -> None:
+    d = {"address.city": "London"}
+
+    assert unflatten(d) == d
+    assert unflatten(d, key_syntax=KeySyntax("dotted")) == {
+        "address": {"city": "London"}
+    }
+    assert unflatten(d) == d
+
+
+def test_unflatten_rejects_malformed_keys() -> None:
+    syntax = KeySyntax(reject_malformed=True)
+
+    with pytest.raises(LimitExceeded, match="'address]city\\[' is not a valid key"):
+        unflatten({"address]city[": "london"}, key_syntax=syntax)
+
+    with pytest.raises(LimitExceeded):
+        derive({"[address][postcode]": "sw1a 1aa"}, key_syntax=syntax)
+
+
 def test_unflatten_deep_nesting() -> None:
     d = {
         "reports[daily][name]": "Daily report",
@@ -124,7 +189,6 @@ def test_unflattening_multi_list_item_flat_structure() -> None:
     }
 
 
-@pytest.mark.xfail(reason="Requires further refactoring")
 def test_unflattening_single_list_item_deep_structure() -> None:
     """
     Example HTML for this case:
@@ -153,7 +217,6 @@ def test_unflattening_single_list_item_deep_structure() -> None:
     }
 
 
-@pytest.mark.xfail(reason="Requires further refactoring")
 def test_unflattening_multi_list_item_deep_structure() -> None:
     """
     Example HTML for this case:
@@ -246,3 +309,145 @@ def test_non_sequential_ints_treated_as_named_brackets() -> None:
             },
         }
     }
+
+
+SPARSE = {
+    "users[3][name]": "Foo",
+    "users[12][name]": "Bar",
+    "users[2][name]": "Baz",
+}
+
+
+@pytest.mark.parametrize("unflattener", [unflatten, derive])
+def test_sparse_lists_compacted(unflattener: Callable[..., Any]) -> None:
+    assert unflattener(SPARSE, sparse_lists="compact") == {
+        "users": [{"name": "Baz"}, {"name": "Foo"}, {"name": "Bar"}]
+    }
+
+
+@pytest.mark.parametrize("unflattener", [unflatten, derive])
+def test_sparse_lists_padded(unflattener: Callable[..., Any]) -> None:
+    users: list[Any] = [None] * 13
+    users[2], users[3], users[12] = {"name": "Baz"}, {"name": "Foo"}, {"name": "Bar"}
+
+    assert unflattener(SPARSE, sparse_lists="pad") == {"users": users}
+
+
+@pytest.mark.parametrize("unflattener", [unflatten, derive])
+def test_sparse_lists_rejected(unflattener: Callable[..., Any]) -> None:
+    with pytest.raises(LimitExceeded, match="'users' has gaps in its numeric indexes"):
+        unflattener(SPARSE, sparse_lists="reject")
+
+
+@pytest.mark.parametrize("unflattener", [unflatten, derive])
+@pytest.mark.parametrize(
+    "limits, max_length",
+    [
+        (None, MAX_PADDED_LENGTH),
+        (Limits(max_index=100_000), 100_001),
+        (Limits(max_list_length=50), 50),
+    ],
+)
+def test_sparse_lists_padding_capped(
+    unflattener: Callable[..., Any], limits: Limits | None, max_length: int
+) -> None:
+    within = {"users[1]": "Foo", f"users[{max_length - 1}]": "Bar"}
+    result = unflattener(within, sparse_lists="pad", limits=limits)
+    assert len(result["users"]) == max_length
+
+    beyond = {"users[1]": "Foo", f"users[{max_length}]": "Bar"}
+    with pytest.raises(LimitExceeded):
+        unflattener(beyond, sparse_lists="pad", limits=limits)
+
+
+@pytest.mark.parametrize("sparse_lists", ["compact", "pad", "reject"])
+def test_out_of_order_ints_listed_in_order(sparse_lists: SparseLists) -> None:
+    d = {"tags[1]": "b", "tags[2]": "c", "tags[0]": "a"}
+
+    assert unflatten(d, sparse_lists=sparse_lists) == {"tags": ["a", "b", "c"]}
+    assert unflatten(d) == {"tags": {"1": "b", "2": "c", "0": "a"}}
+
+
+def test_padded_lists_are_limited() -> None:
+    with pytest.raises(LimitExceeded):
+        unflatten(SPARSE, sparse_lists="pad", limits=Limits(max_list_length=10))
+
+
+@pytest.mark.parametrize("index", ["03", "1e3", "\u0663", "9" * 30])
+def test_non_positional_ints_are_named(index: str) -> None:
+    d = {"tags[0]": "a", f"tags[{index}]": "b"}
+
+    assert unflatten(d, sparse_lists="compact") == {"tags": {"0": "a", index: "b"}}
+
+
+def test_unflattening_empty_list() -> None:
+    assert unflatten({"emails[]": []}) == {"emails": []}
+
+
+def test_unflattening_does_not_modify_values() -> None:
+    tags = {"0": "foo", "1": "bar"}
+    d = {"tags": tags, "address": {"city": "London"}, "address[zipcode]": "SW1A"}
+
+    assert unflatten(d) == {
+        "tags": ["foo", "bar"],
+        "address": {"city": "London", "zipcode": "SW1A"},
+    }
+    assert tags == {"0": "foo", "1": "bar"}
+    assert d["address"] == {"city": "London"}
+
+
+def test_unflattening_copies_only_converted_values() -> None:
+    address = {"city": "London", "lines": ["1 High St"]}
+    items = [{"sizes": {"0": "S", "1": "M"}}, {"sizes": ["L"]}]
+    result = unflatten({"address": address, "items": items, "a[b]": 1})
+
+    assert result == {
+        "address": {"city": "London", "lines": ["1 High St"]},
+        "items": [{"sizes": ["S", "M"]}, {"sizes": ["L"]}],
+        "a": {"b": 1},
+    }
+    assert isinstance(result, dict)
+    # Values without numeric keys are passed on as they are
+    assert result["address"] is address
+    assert result["items"][1] is items[1]
+    # Those with them are rebuilt, leaving the body unchanged
+    assert items[0] == {"sizes": {"0": "S", "1": "M"}}
+
+
+def test_unflattening_list_within_list() -> None:
+    with pytest.raises(ValueError):
+        unflatten({"matrix[][]": [1, 2]})
+
+
+def test_unflattener_builds_incrementally() -> None:
+    unflattener = Unflattener()
+
+    unflattener.add("title", "Sofrito time")
+    unflattener.add("items[][item]", ["carrots", "celery"])
+    unflattener.add("items[][qty]", [1, 2])
+
+    assert unflattener.result() == {
+        "title": "Sofrito time",
+        "items": [{"item": "carrots", "qty": 1}, {"item": "celery", "qty": 2}],
+    }
+
+
+def test_unflatten_pairs() -> None:
+    assert unflatten_pairs(
+        [
+            ("title", "Sofrito time"),
+            ("items[][item]", "carrots"),
+            ("items[][qty]", 1),
+            ("emails[]", "foo@example.com"),
+            ("items[][item]", "celery"),
+            ("items[][qty]", 2),
+            ("emails[]", "bar@example.com"),
+            ("tag", "vegetables"),
+            ("tag", "shopping"),
+        ]
+    ) == {
+        "title": "Sofrito time",
+        "items": [{"item": "carrots", "qty": 1}, {"item": "celery", "qty": 2}],
+        "emails": ["foo@example.com", "bar@example.com"],
+        "tag": ["vegetables", "shopping"],
+    }
@@ -0,0 +1,133 @@
+from typing import Annotated
+
+from fastapi import Body, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, Field
+from starlette.middleware.errors import ServerErrorMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+
+from rugged.dependencies import Unflattened
+from rugged.middleware import RuggedMiddleware
+from rugged.warming import app_body_models, app_shapes, model_keys, model_shapes
+
+
+class Price(BaseModel):
+    amount: int
+    currency: str = "GBP"
+
+
+class ShoppingListItem(BaseModel):
+    item: str
+    qty: int
+    price: Price | None = None
+    tags: list[str] = []
+
+
+class Address(BaseModel):
+    city: str
+    post_code: str = Field(alias="postcode")
+
+
+class ShoppingList(BaseModel):
+    title: str
+    items: list[ShoppingListItem]
+    emails: list[str]
+    deliver_to: Address | None
+    meta: dict[str, str] = {}
+
+
+def test_model_keys() -> None:
+    assert model_keys(ShoppingList) == [
+        "title",
+        "items[][item]",
+        "items[][qty]",
+        "items[][price][amount]",
+        "items[][price][currency]",
+        "emails[]",
+        "deliver_to[city]",
+        "deliver_to[postcode]",
+    ]
+
+
+def test_model_shapes() -> None:
+    assert model_shapes(Address) == [("city", "postcode")]
+    assert model_shapes(Price) == [("amount", "currency"), ("amount",)]
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/list")
+    async def save_list(shopping_list: Unflattened[ShoppingList]) -> None:
+        pass
+
+    @app.post("/address")
+    async def save_address(address: Address) -> None:
+        pass
+
+    @app.post("/order")
+    async def save_order(
+        price: Price, note: Annotated[str, Body()], address: Address
+    ) -> None:
+        pass
+
+    @app.get("/list")
+    async def get_list() -> None:
+        pass
+
+    return app
+
+
+def test_app_body_models() -> None:
+    models = app_body_models(make_app())
+
+    assert ShoppingList in models
+    assert Address in models
+    assert len(models) == 3
+
+
+def test_app_shapes() -> None:
+    shapes = app_shapes(make_app())
+
+    assert tuple(model_keys(ShoppingList)) in shapes
+    assert (
+        "price[amount]",
+        "price[currency]",
+        "note",
+        "address[city]",
+        "address[postcode]",
+    ) in shapes
+
+
+def test_precompile_on_startup() -> None:
+    app = make_app()
+    app.add_middleware(RuggedMiddleware, precompile=True)
+
+    with TestClient(app) as client:
+        # Each middleware in the stack wraps the next as its app
+        middleware = app.middleware_stack
+        while not isinstance(middleware, RuggedMiddleware):
+            assert isinstance(middleware, (ServerErrorMiddleware, ExceptionMiddleware))
+            middleware = middleware.app
+
+        compiled = middleware.plan_cache.stats().size
+        assert compiled == len(app_shapes(app))
+
+        response = client.post(
+            "/list",
+            json={
+                "title": "Sofrito time",
+                "items[][item]": ["carrots"],
+                "items[][qty]": [1],
+                "items[][price][amount]": [50],
+                "items[][price][currency]": ["GBP"],
+                "emails[]": ["foo@example.com"],
+                "deliver_to[city]": "London",
+                "deliver_to[postcode]": "N1",
+            },
+        )
+        assert response.status_code == 200
+
+        # The body's plan was compiled at startup
+        assert middleware.plan_cache.misses == compiled
+        assert middleware.plan_cache.hits == 1